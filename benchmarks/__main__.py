@@ -0,0 +1,131 @@
+'''
+Run the offline benchmarks, asv-style: every `time_*` method of the `*Suite`
+classes in the `bench_*` modules is timed once per combination of the
+suite's `params`, after calling its `setup` with them, and before its
+`teardown`.
+
+    python -m benchmarks                          # run everything
+    python -m benchmarks -k QuerySuite --json bench.json
+    python -m benchmarks --compare bench.json     # fail on regressions
+
+`--compare` exits with status 1 when a benchmark is slower than the saved
+run by more than `--threshold`, so it can gate CI.
+'''
+import argparse
+import importlib
+import itertools
+import json
+import logging
+import pkgutil
+import sys
+import timeit
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+
+class Benchmark(NamedTuple):
+    name: str
+    suite: type
+    method: str
+    params: tuple
+
+
+def _param_sets(suite) -> Iterator[tuple[tuple, str]]:
+    params = getattr(suite, 'params', None)
+    if params is None:
+        yield (), ''
+        return
+    if not all(isinstance(p, list) for p in params):
+        params = [params]
+    names = getattr(suite, 'param_names', None) \
+        or [f'param{i}' for i in range(len(params))]
+    for combination in itertools.product(*params):
+        label = ', '.join(f'{n}={v!r}' for n, v in zip(names, combination))
+        yield combination, f'({label})'
+
+
+def discover(keyword: str | None = None) -> list[Benchmark]:
+    benchmarks = []
+    package = Path(__file__).parent
+    for module_info in pkgutil.iter_modules([str(package)]):
+        if not module_info.name.startswith('bench_'):
+            continue
+        module = importlib.import_module(f'{__package__}.{module_info.name}')
+        for suite_name, suite in vars(module).items():
+            if not (isinstance(suite, type) and suite_name.endswith('Suite')
+                    and suite.__module__ == module.__name__):
+                continue
+            for method in sorted(m for m in vars(suite) if m.startswith('time_')):
+                for params, label in _param_sets(suite):
+                    name = f'{module_info.name}.{suite_name}.{method}{label}'
+                    if keyword is None or keyword in name:
+                        benchmarks.append(Benchmark(name, suite, method, params))
+    return benchmarks
+
+
+def measure(benchmark: Benchmark, repeat: int) -> float:
+    '''
+    The best time per call over `repeat` runs, in seconds.
+    '''
+    suite = benchmark.suite()
+    if hasattr(suite, 'setup'):
+        suite.setup(*benchmark.params)
+    method = getattr(suite, benchmark.method)
+    timer = timeit.Timer(lambda: method(*benchmark.params))
+    try:
+        number, _ = timer.autorange()
+        return min(timer.repeat(repeat=repeat, number=number)) / number
+    finally:
+        if hasattr(suite, 'teardown'):
+            suite.teardown(*benchmark.params)
+
+
+def _format_time(seconds: float) -> str:
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:8.2f} {unit}'
+    return f'{seconds / 1e-9:8.2f} ns'
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('-k', dest='keyword',
+                        help='only run benchmarks whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', type=Path, help='save the results here')
+    parser.add_argument('--compare', type=Path,
+                        help='compare against results saved with --json')
+    parser.add_argument('--threshold', type=float, default=1.5,
+                        help='slowdown ratio counted as a regression')
+    args = parser.parse_args(argv)
+
+    # Every `st.spinner` outside of `streamlit run` logs a warning, and
+    # streamlit resets its loggers' levels when it loads its config.
+    logging.disable(logging.WARNING)
+    benchmarks = discover(args.keyword)
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else {}
+    results = {}
+    regressions = []
+    for benchmark in benchmarks:
+        seconds = results[benchmark.name] = measure(benchmark, args.repeat)
+        line = f'{_format_time(seconds)}  {benchmark.name}'
+        if benchmark.name in baseline:
+            ratio = seconds / baseline[benchmark.name]
+            line += f'  x{ratio:.2f}'
+            if ratio > args.threshold:
+                regressions.append(benchmark.name)
+                line += '  REGRESSION'
+        print(line, flush=True)
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    if regressions:
+        print(f'{len(regressions)} benchmark(s) slower than x{args.threshold}:',
+              *regressions, sep='\n  ', file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
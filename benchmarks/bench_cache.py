@@ -0,0 +1,116 @@
+'''
+Benchmarks of the per-call work behind the result cache: query parsing,
+key hashing, size estimation, snapshots and the SQLite backend.
+'''
+import os
+import tempfile
+
+from src.cache import ResultCache, estimate_size, make_key
+from src.edgeql import classify, fingerprint, normalize, parse_params
+from src.frames import to_columns
+from src.snapshot import Snapshot
+from src.sqlite_cache import SQLiteResultCache
+from tests.fakes import sized_result
+
+QRY = '''
+WITH m := (SELECT Movie FILTER .release_year > <int64>$year)
+SELECT m {title, actors: {name, @character_name}}
+ORDER BY .title LIMIT <int64>$limit;  # the newest movies
+'''
+ROWS = [1, 100, 10_000]
+
+
+class EdgeQLSuite:
+    '''
+    The parsers are lru_cached, so both the cold and the warm paths matter.
+    '''
+
+    def time_normalize(self):
+        normalize(QRY)
+
+    def time_fingerprint_cold(self):
+        fingerprint.__wrapped__(QRY)
+
+    def time_classify_cold(self):
+        classify.__wrapped__(QRY)
+
+    def time_classify_warm(self):
+        classify(QRY)
+
+    def time_parse_params_cold(self):
+        parse_params.__wrapped__(QRY)
+
+
+class KeySuite:
+    params = [0, 10, 1000]
+    param_names = ['args']
+
+    def setup(self, args):
+        self.kwargs = {f'p{i}': [i, str(i)] for i in range(args)}
+
+    def time_make_key(self, args):
+        make_key('query', QRY, (), self.kwargs)
+
+
+class ResultCacheSuite:
+    params = ROWS
+    param_names = ['rows']
+
+    def setup(self, rows):
+        self.result = sized_result(rows)('query', QRY)
+        self.cache = ResultCache()
+        self.key = make_key('query', QRY, (), {})
+        self.cache.set(self.key, self.result)
+        self.snapshot = Snapshot(self.result)
+
+    def time_get(self, rows):
+        self.cache.get(self.key)
+
+    def time_set(self, rows):
+        self.cache.set(self.key, self.result)
+
+    def time_estimate_size(self, rows):
+        estimate_size(self.result)
+
+    def time_snapshot(self, rows):
+        Snapshot(self.result)
+
+    def time_snapshot_thaw(self, rows):
+        self.snapshot.thaw()
+
+    def time_to_columns(self, rows):
+        to_columns(self.result)
+
+
+class SQLiteCacheSuite:
+    '''
+    The persistent backend, whose hits pay for a read and a decode.
+    '''
+    params = ROWS
+    param_names = ['rows']
+
+    def setup(self, rows):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache = SQLiteResultCache(os.path.join(self.dir.name, 'cache.sqlite'))
+        self.result = sized_result(rows)('query', QRY)
+        self.json = sized_result(rows)('query_json', QRY)
+        self.key = make_key('query', QRY, (), {})
+        self.json_key = make_key('query_json', QRY, (), {})
+        self.cache.set(self.key, self.result)
+        self.cache.set(self.json_key, self.json)
+
+    def teardown(self, rows):
+        self.cache.close()
+        self.dir.cleanup()
+
+    def time_get(self, rows):
+        self.cache.get(self.key).thaw()
+
+    def time_get_json(self, rows):
+        self.cache.get(self.json_key)
+
+    def time_set(self, rows):
+        self.cache.set(self.key, self.result)
+
+    def time_set_json(self, rows):
+        self.cache.set(self.json_key, self.json)
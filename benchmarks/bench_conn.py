@@ -0,0 +1,148 @@
+'''
+Connection-level benchmarks, run against the in-process fake client so that
+only our own dispatch, caching and conversion overhead is measured.
+'''
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from tests.fakes import FAKE_DSN, FakeEdgeDBConnection, make_conn, sized_result
+
+QRY = 'SELECT Movie {title, release_year, rating} FILTER .rating > <float64>$0;'
+ROWS = [1, 100, 10_000]
+SCHEMA = json.dumps([
+    {'name': 'default::Content', 'ancestors': [], 'links': [
+        {'target': {'name': 'default::Person'}}]},
+    {'name': 'default::Movie', 'ancestors': [{'name': 'default::Content'}],
+     'links': [{'target': {'name': 'default::Person'}}]},
+    {'name': 'default::Show', 'ancestors': [{'name': 'default::Content'}],
+     'links': [{'target': {'name': 'default::Season'}}]},
+    {'name': 'default::Season', 'ancestors': [], 'links': [
+        {'target': {'name': 'default::Show'}}]},
+    {'name': 'default::Person', 'ancestors': [], 'links': []},
+])
+
+
+class QuerySuite:
+    params = ROWS
+    param_names = ['rows']
+
+    def setup(self, rows):
+        self.conn = make_conn('bench_conn', result=sized_result(rows))
+        self.prepared = self.conn.prepare(QRY)
+        self.conn.query(QRY, 2.5)
+        self.conn.query(QRY, 2.5, jsonify=True)
+        self.conn.query(QRY, 2.5, storage='data')
+        self.conn.query_df(QRY, 2.5)
+
+    def time_query_miss(self, rows):
+        self.conn.query(QRY, 2.5, ttl=0)
+
+    def time_query_hit(self, rows):
+        self.conn.query(QRY, 2.5)
+
+    def time_query_json_hit(self, rows):
+        self.conn.query(QRY, 2.5, jsonify=True)
+
+    def time_query_data_hit(self, rows):
+        self.conn.query(QRY, 2.5, storage='data')
+
+    def time_prepared_hit(self, rows):
+        self.prepared(2.5)
+
+    def time_query_df_hit(self, rows):
+        self.conn.query_df(QRY, 2.5)
+
+    def time_query_df_miss(self, rows):
+        self.conn.query_df(QRY, 2.5, ttl=0)
+
+    def time_query_df_arrow_miss(self, rows):
+        self.conn.query_df(QRY, 2.5, ttl=0, engine='arrow')
+
+
+class QueryManySuite:
+    '''
+    With a simulated round trip, the misses should overlap on the thread pool.
+    '''
+    params = [[1, 8], [0.0, 0.005]]
+    param_names = ['queries', 'latency']
+
+    def setup(self, queries, latency):
+        self.conn = make_conn('bench_conn', result=sized_result(10), delay=latency)
+        self.specs = [(QRY, (i / 2,)) for i in range(queries)]
+
+    def time_query_many_miss(self, queries, latency):
+        self.conn.query_many(self.specs, ttl=0)
+
+
+class CoalesceSuite:
+    '''
+    Sessions missing the cache at once share a single query.
+    '''
+    params = [1, 8]
+    param_names = ['sessions']
+
+    def setup(self, sessions):
+        self.conn = make_conn('bench_conn', result=sized_result(100), delay=0.005)
+        self.pool = ThreadPoolExecutor(sessions)
+        self.sessions = sessions
+
+    def time_concurrent_misses(self, sessions):
+        self.conn.cache.clear()
+        list(self.pool.map(lambda _: self.conn.query(QRY, 2.5),
+                           range(self.sessions)))
+
+
+class MutationSuite:
+    '''
+    `time_execute` refills the entries it invalidates, so it includes
+    `cached` cache sets.
+    '''
+    params = [[0, 100], [False, True]]
+    param_names = ['cached', 'schema_aware']
+
+    def setup(self, cached, schema_aware):
+        self.conn = make_conn('bench_conn', schema_aware_invalidation=schema_aware)
+        if schema_aware:
+            self.conn._load_dependents(SCHEMA)
+        self.cached = cached
+        self.fill()
+
+    def fill(self):
+        for i in range(self.cached):
+            self.conn.cache.set(('bench', i), i, tags=frozenset({'Movie'}))
+
+    def time_execute(self, cached, schema_aware):
+        self.conn.execute('INSERT Movie {title := "Dune"};')
+        self.fill()
+
+    def time_transaction(self, cached, schema_aware):
+        for tx in self.conn():
+            tx.execute('INSERT Movie {title := "Dune"};')
+
+    def time_transaction_retried(self, cached, schema_aware):
+        self.conn.client.conflicts = 2
+        for tx in self.conn():
+            tx.execute('INSERT Movie {title := "Dune"};')
+
+
+class BulkInsertSuite:
+    params = [100, 10_000]
+    param_names = ['rows']
+
+    def setup(self, rows):
+        self.conn = make_conn('bench_conn', result=self.inserted,
+                              schema_aware_invalidation=False)
+        self.rows = [{'title': f'Movie {i}', 'release_year': 1900 + i % 120,
+                      'rating': i % 10 / 2} for i in range(rows)]
+
+    @staticmethod
+    def inserted(func_name, qry, data):
+        return data.count('{')
+
+    def time_bulk_insert(self, rows):
+        self.conn.bulk_insert('Movie', self.rows)
+
+
+class ConnectSuite:
+    def time_connect(self):
+        FakeEdgeDBConnection('bench_conn', dsn=FAKE_DSN)
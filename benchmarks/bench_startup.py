@@ -0,0 +1,52 @@
+'''
+Cold start benchmarks: importing the connection module in a fresh
+interpreter, and the first query of a script run, with the connection built
+anew or reused through `get_connection`.
+'''
+import subprocess
+import sys
+from pathlib import Path
+
+from src.st_edgedb_conn import close_connections, get_connection
+from tests.fakes import FAKE_DSN, FakeEdgeDBConnection, make_conn, sized_result
+
+ROOT = Path(__file__).resolve().parents[1]
+QRY = 'SELECT Movie {title, release_year, rating};'
+RESULT = sized_result(100)
+
+
+def _python(code: str) -> None:
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, check=True)
+
+
+class ImportSuite:
+    '''
+    The import of streamlit alone is the baseline: the connections subclass
+    its base connection, so it is always imported.
+    '''
+
+    def time_import_streamlit(self):
+        _python('import streamlit')
+
+    def time_import_conn(self):
+        _python('import src.st_edgedb_conn')
+
+
+class FirstQuerySuite:
+    def setup(self):
+        get_connection('bench_startup', FakeEdgeDBConnection,
+                       dsn=FAKE_DSN, result=RESULT).query(QRY)
+
+    def teardown(self):
+        close_connections()
+
+    def time_first_query(self):
+        make_conn('bench_startup_cold', result=RESULT).query(QRY)
+
+    def time_rerun_new_connection(self):
+        FakeEdgeDBConnection('bench_startup', dsn=FAKE_DSN,
+                             result=RESULT).query(QRY)
+
+    def time_rerun_get_connection(self):
+        get_connection('bench_startup', FakeEdgeDBConnection,
+                       dsn=FAKE_DSN, result=RESULT).query(QRY)
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import AsyncIterator, Iterator
+
+
+class OverloadedError(Exception):
+    '''
+    Raised instead of queueing a call when `max_in_flight` calls are already
+    running and the queue is full, or when a queued call got no slot within
+    `queue_timeout`.
+    '''
+
+
+class DeadlineExceededError(TimeoutError):
+    '''
+    Raised when a call's `timeout` runs out before the client answered.
+    '''
+
+
+def deadline_errors() -> tuple[type[BaseException], ...]:
+    '''
+    The errors a call with a deadline fails with once it runs out, on the
+    client or, through `query_execution_timeout`, on the server.
+    '''
+    import edgedb
+
+    return (DeadlineExceededError, edgedb.QueryTimeoutError)
+
+
+def deadline_after(timeout: float | timedelta | None) -> float | None:
+    if timeout is None:
+        return None
+    if isinstance(timeout, timedelta):
+        timeout = timeout.total_seconds()
+    return time.monotonic() + timeout
+
+
+def remaining(deadline: float) -> float:
+    '''
+    The seconds left before `deadline`, raising `DeadlineExceededError` once
+    there are none.
+    '''
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise DeadlineExceededError('the call ran out of time')
+    return left
+
+
+@dataclass(frozen=True)
+class AdmissionStats:
+    max_in_flight: int
+    in_flight: int
+    queued: int
+    admitted: int
+    rejected: int
+
+
+class Admission:
+    '''
+    Lets at most `max_in_flight` calls run at once. Up to `max_queued` more
+    wait for a slot, for at most `queue_timeout` seconds or until their
+    deadline, and the calls beyond that fail at once with `OverloadedError`.
+    A queued call whose own deadline runs out first fails with
+    `DeadlineExceededError` instead, and is not counted as rejected.
+    '''
+
+    def __init__(self,
+                 max_in_flight: int,
+                 max_queued: int | None = None,
+                 queue_timeout: float | None = 5.0) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_in_flight if max_queued is None else max_queued
+        self.queue_timeout = queue_timeout
+        self._in_flight = 0
+        self._queued = 0
+        self._admitted = 0
+        self._rejected = 0
+        self._cond = threading.Condition()
+
+    def _wait_time(self, deadline: float | None) -> float | None:
+        waits = [w for w in (self.queue_timeout,
+                             None if deadline is None else remaining(deadline))
+                 if w is not None]
+        return min(waits) if waits else None
+
+    def _timed_out(self, deadline: float | None) -> Exception:
+        if deadline is not None and deadline <= time.monotonic():
+            return DeadlineExceededError('the call ran out of time in the queue')
+        return self._reject('no slot freed up in time')
+
+    def _reject(self, reason: str) -> OverloadedError:
+        self._rejected += 1
+        return OverloadedError(
+            f'{self.max_in_flight} calls in flight and {self._queued} queued: {reason}')
+
+    def _admit(self) -> None:
+        self._in_flight += 1
+        self._admitted += 1
+
+    @contextmanager
+    def admit(self, deadline: float | None = None) -> Iterator[None]:
+        with self._cond:
+            if self._in_flight >= self.max_in_flight:
+                wait = self._wait_time(deadline)
+                if self._queued >= self.max_queued:
+                    raise self._reject('the queue is full')
+                self._queued += 1
+                try:
+                    admitted = self._cond.wait_for(
+                        lambda: self._in_flight < self.max_in_flight, wait)
+                finally:
+                    self._queued -= 1
+                if not admitted:
+                    raise self._timed_out(deadline)
+            self._admit()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify()
+
+    def stats(self) -> AdmissionStats:
+        return AdmissionStats(max_in_flight=self.max_in_flight,
+                              in_flight=self._in_flight,
+                              queued=self._queued,
+                              admitted=self._admitted,
+                              rejected=self._rejected)
+
+
+class AsyncAdmission(Admission):
+    '''
+    The asyncio flavour of `Admission`, for calls on a single event loop.
+    '''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def admit(self, deadline: float | None = None) -> AsyncIterator[None]:
+        async with self._cond:
+            if self._in_flight >= self.max_in_flight:
+                wait = self._wait_time(deadline)
+                if self._queued >= self.max_queued:
+                    raise self._reject('the queue is full')
+                self._queued += 1
+                try:
+                    async with asyncio.timeout(wait):
+                        await self._cond.wait_for(
+                            lambda: self._in_flight < self.max_in_flight)
+                except TimeoutError:
+                    raise self._timed_out(deadline) from None
+                finally:
+                    self._queued -= 1
+            self._admit()
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._in_flight -= 1
+                self._cond.notify()
@@ -0,0 +1,122 @@
+import json
+import re
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Iterable, Iterator, Mapping
+from uuid import UUID
+
+_NAME_RE = re.compile(r'[A-Za-z_]\w*')
+_QUALIFIED_NAME_RE = re.compile(r'[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*')
+
+# Scalars that can be cast from a JSON value directly; the others are parsed
+# from the JSON string we encode them to.
+_JSON_CASTS = frozenset({'str', 'bool', 'int16', 'int32', 'int64',
+                         'float32', 'float64'})
+
+Casts = tuple[tuple[str, str], ...]
+
+
+def is_name(name: str, qualified: bool = False) -> bool:
+    regex = _QUALIFIED_NAME_RE if qualified else _NAME_RE
+    return isinstance(name, str) and regex.fullmatch(name) is not None
+
+
+def infer_cast(value: Any) -> str | None:
+    '''
+    The EdgeDB scalar type of a Python value, as the edgedb client would
+    decode it, or None when there is no obvious one.
+    '''
+    match value:
+        case bool():
+            return 'bool'
+        case int():
+            return 'int64'
+        case float():
+            return 'float64'
+        case Decimal():
+            return 'decimal'
+        case str():
+            return 'str'
+        case datetime():
+            return 'cal::local_datetime' if value.tzinfo is None else 'datetime'
+        case date():
+            return 'cal::local_date'
+        case time():
+            return 'cal::local_time'
+        case timedelta():
+            return 'duration'
+        case UUID():
+            return 'uuid'
+        case dict() | list():
+            return 'json'
+        case _ if hasattr(value, 'item'):
+            # numpy scalars
+            return infer_cast(value.item())
+        case _:
+            return None
+
+
+def infer_casts(rows: list[Mapping[str, Any]],
+                overrides: Mapping[str, str] | None = None) -> dict[str, str | None]:
+    '''
+    The cast of every field in the rows, from its first non-null value,
+    unless given in `overrides`. Fields that are null in every row are None.
+    '''
+    casts = dict(overrides or {})
+    for row in rows:
+        for name, value in row.items():
+            if casts.get(name) is not None or value is None:
+                casts.setdefault(name, None)
+                continue
+            if (cast := infer_cast(value)) is None:
+                raise TypeError(f"Can't infer the EdgeDB type of {name}={value!r}, "
+                                f"pass it in casts")
+            casts[name] = cast
+    return casts
+
+
+def _encode(value: Any) -> Any:
+    match value:
+        case Decimal() | UUID():
+            return str(value)
+        case datetime() | date() | time():
+            return value.isoformat()
+        case timedelta():
+            return f'{value // timedelta(microseconds=1)} microseconds'
+        case _ if hasattr(value, 'item'):
+            return value.item()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def encode_rows(rows: list[Mapping[str, Any]]) -> str:
+    return json.dumps(rows, default=_encode)
+
+
+def chunked(rows: Iterable, size: int) -> Iterator[list]:
+    it = iter(rows)
+    while chunk := list(islice(it, size)):
+        yield chunk
+
+
+def _field(name: str, cast: str) -> str:
+    value = f"json_get(item, '{name}')"
+    if cast == 'json':
+        return f'{name} := {value}'
+    if cast in _JSON_CASTS:
+        return f'{name} := <{cast}>{value}'
+    return f'{name} := <{cast}><str>{value}'
+
+
+@lru_cache(maxsize=64)
+def insert_query(type_name: str, casts: Casts) -> str:
+    '''
+    A single statement inserting one object per element of the `$data` JSON
+    array and returning how many were inserted. Missing keys and nulls leave
+    the property empty, so it gets its default.
+    The names must already be checked with `is_name`.
+    '''
+    shape = ', '.join(_field(name, cast) for name, cast in casts)
+    return (f'SELECT count((FOR item IN json_array_unpack(<json>$data) '
+            f'UNION (INSERT {type_name} {{{shape}}})))')
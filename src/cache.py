@@ -0,0 +1,320 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import timedelta
+from itertools import islice
+from typing import Any, Hashable
+
+from .edgeql import WILDCARD, fingerprint
+from .lazy import is_edgedb_object
+
+MISSING = object()
+
+_SIZE_SAMPLE = 64
+
+# The generation counter bumped by every invalidation, which the entries
+# tagged with `WILDCARD` depend on. No object type has an empty name.
+_ANY = ''
+
+
+def generation_tags(tags: frozenset[str]) -> tuple[str, ...]:
+    '''
+    The counters telling whether an entry tagged with `tags` was invalidated:
+    one per tag, and the one of `WILDCARD` invalidations.
+    '''
+    if WILDCARD in tags:
+        return (_ANY,)
+    return (WILDCARD, *sorted(tags))
+
+
+def bumped_tags(tags: frozenset[str]) -> tuple[str, ...]:
+    '''
+    The counters bumped by an invalidation of `tags`.
+    '''
+    return (*tags, _ANY)
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    hits: int
+    stale_hits: int
+    misses: int
+    evictions: int
+    invalidations: int
+    entries: int
+    nbytes: int
+
+
+@dataclass(frozen=True)
+class EntryInfo:
+    key: Hashable
+    nbytes: int
+    expires_in: float | None
+    stale_in: float | None
+    tags: frozenset[str]
+
+
+class _Entry:
+    __slots__ = ('value', 'expires_at', 'stale_at', 'nbytes', 'tags')
+
+    def __init__(self, value, expires_at, stale_at, nbytes, tags):
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_at = stale_at
+        self.nbytes = nbytes
+        self.tags = tags
+
+
+def freeze_arg(arg):
+    match arg:
+        case list() | tuple():
+            return tuple(freeze_arg(a) for a in arg)
+        case dict():
+            return tuple(sorted((k, freeze_arg(v)) for k, v in arg.items()))
+        case set() | frozenset():
+            return frozenset(freeze_arg(a) for a in arg)
+        case _:
+            return arg
+
+
+def make_key_prefix(func_name: str, qry: str) -> tuple[str, str]:
+    return (fingerprint(qry), func_name)
+
+
+def make_key(func_name: str, qry: str, args: tuple, kwargs: dict) -> Hashable:
+    return (*make_key_prefix(func_name, qry),
+            freeze_arg(args),
+            freeze_arg(kwargs))
+
+
+def to_seconds(ttl: float | timedelta | None) -> float | None:
+    if isinstance(ttl, timedelta):
+        return ttl.total_seconds()
+    return ttl
+
+
+def estimate_size(value: Any) -> int:
+    '''
+    A cheap approximation of the memory held by a query result.
+    Large collections are sampled instead of walked in full.
+    '''
+    size = sys.getsizeof(value)
+    match value:
+        case str() | bytes() | int() | float() | bool() | None:
+            return size
+        case dict():
+            items = list(value.items())
+            values = [v for kv in items[:_SIZE_SAMPLE] for v in kv]
+            n = len(items)
+        case list() | tuple() | set() | frozenset():
+            values = list(islice(value, _SIZE_SAMPLE))
+            n = len(value)
+        case _ if is_edgedb_object(value):
+            values = [getattr(value, name) for name in dir(value)]
+            n = len(values)
+        case _:
+            # pandas reports its deep size through `__sizeof__`, pyarrow
+            # and numpy through `nbytes`.
+            return max(size, getattr(value, 'nbytes', 0))
+    if not values:
+        return size
+    sampled = sum(estimate_size(v) for v in values)
+    return size + sampled * n // len(values)
+
+
+class ResultCache:
+    """A thread-safe LRU cache for query results with per-entry TTL,
+    bounded by both the number of entries and their estimated size.
+
+    Entries can be tagged with the object types they read, so that a write
+    only drops the entries that depend on the written types. Each tag also
+    has a generation, bumped by its invalidations, so that a result read
+    while its tags were invalidated is not stored."""
+
+    def __init__(self,
+                 max_entries: int = 1024,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 clock=time.monotonic) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        self._entries: OrderedDict[Hashable, _Entry] = OrderedDict()
+        self._tags: dict[str, set[Hashable]] = {}
+        self._generations: dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._nbytes = 0
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key: Hashable) -> Any:
+        '''
+        Return the cached value, or `MISSING` if there is no live entry.
+        '''
+        return self.lookup(key)[0]
+
+    def lookup(self, key: Hashable) -> tuple[Any, bool]:
+        '''
+        Return the cached value, or `MISSING`, and whether it is past its
+        soft TTL, i.e. still served but due for a refresh.
+        '''
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at is not None \
+                    and entry.expires_at <= now:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return MISSING, False
+            self._entries.move_to_end(key)
+            self._hits += 1
+            stale = entry.stale_at is not None and entry.stale_at <= now
+            self._stale_hits += stale
+            return entry.value, stale
+
+    def _peek(self, key: Hashable) -> Any:
+        '''
+        Like `get`, without counting a hit or a miss, for a read that was
+        already counted.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at is not None \
+                    and entry.expires_at <= self._clock():
+                return MISSING
+            return entry.value
+
+    def set(self,
+            key: Hashable,
+            value: Any,
+            ttl: float | timedelta | None = None,
+            tags: frozenset[str] = frozenset({WILDCARD}),
+            soft_ttl: float | timedelta | None = None,
+            generation: tuple[int, ...] | None = None) -> None:
+        '''
+        `ttl=None` keeps the entry until it is evicted, and a non-positive
+        `ttl` does not store it at all. After `soft_ttl` the entry is reported
+        as stale by `lookup`, but still served until `ttl`. An entry tagged
+        with `WILDCARD` is dropped by any invalidation.
+
+        Pass the `generation(tags)` taken before reading the value to not
+        store it if its tags were invalidated since.
+        '''
+        ttl = to_seconds(ttl)
+        soft_ttl = to_seconds(soft_ttl)
+        if ttl is not None and ttl <= 0:
+            return
+        nbytes = estimate_size(value)
+        if nbytes > self.max_bytes:
+            return
+        now = self._clock()
+        expires_at = None if ttl is None else now + ttl
+        stale_at = None
+        if soft_ttl is not None and (ttl is None or soft_ttl < ttl):
+            stale_at = now + soft_ttl
+        with self._lock:
+            if generation is not None and generation != self.generation(tags):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, expires_at, stale_at, nbytes, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            self._nbytes += nbytes
+            self._evict()
+
+    def invalidate(self, key: Hashable) -> bool:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def invalidate_tags(self, tags: frozenset[str]) -> int:
+        '''
+        Drop every entry tagged with one of `tags`, or with `WILDCARD`.
+        Passing `WILDCARD` itself drops everything.
+        Return the number of dropped entries.
+        '''
+        with self._lock:
+            if WILDCARD in tags:
+                keys = list(self._entries)
+            else:
+                keys = set().union(*(self._tags.get(tag, ())
+                                     for tag in (*tags, WILDCARD)))
+            for key in keys:
+                self._remove(key)
+            self._bump(tags)
+            self._invalidations += len(keys)
+            return len(keys)
+
+    def generation(self, tags: frozenset[str]) -> tuple[int, ...]:
+        with self._lock:
+            return tuple(self._generations.get(tag, 0)
+                         for tag in generation_tags(tags))
+
+    def _bump(self, tags: frozenset[str]) -> None:
+        for tag in bumped_tags(tags):
+            self._generations[tag] = self._generations.get(tag, 0) + 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bump(frozenset({WILDCARD}))
+            self._nbytes = 0
+
+    def entries(self) -> list[EntryInfo]:
+        '''
+        Report the estimated memory footprint and remaining TTL of each
+        entry, from the least to the most recently used.
+        '''
+        with self._lock:
+            now = self._clock()
+            return [EntryInfo(key=key,
+                              nbytes=entry.nbytes,
+                              expires_in=None if entry.expires_at is None
+                              else max(entry.expires_at - now, 0),
+                              stale_in=None if entry.stale_at is None
+                              else max(entry.stale_at - now, 0),
+                              tags=entry.tags)
+                    for key, entry in self._entries.items()]
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            return CacheStats(hits=self._hits,
+                              stale_hits=self._stale_hits,
+                              misses=self._misses,
+                              evictions=self._evictions,
+                              invalidations=self._invalidations,
+                              entries=len(self._entries),
+                              nbytes=self._nbytes)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def _remove(self, key: Hashable) -> _Entry:
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+        for tag in entry.tags:
+            keys = self._tags[tag]
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+        return entry
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._nbytes > self.max_bytes):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self._evictions += 1
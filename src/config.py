@@ -0,0 +1,138 @@
+from dataclasses import dataclass, fields
+from typing import TYPE_CHECKING, Any, Mapping
+
+if TYPE_CHECKING:
+    from edgedb import RetryOptions, TransactionOptions
+
+
+class InvalidConfigError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class EdgeDBConfig:
+    '''
+    Client pool sizing, timeouts and retry policy.
+
+    Every field can be set in `[connections.<connection_name>]` of
+    `.streamlit/secrets.toml`, or as a keyword argument of the connection,
+    which takes precedence:
+
+        [connections.edgedb_conn]
+        EDGEDB_DSN = "edgedb://..."
+        max_concurrency = 20
+        timeout = 5
+        retry_attempts = 3
+    '''
+    max_concurrency: int | None = None
+    timeout: float = 10
+    wait_until_available: float = 30
+    retry_attempts: int | None = None
+    transaction_conflict_attempts: int | None = None
+    network_error_attempts: int | None = None
+    readonly: bool = False
+    deferrable: bool = False
+
+    def __post_init__(self) -> None:
+        for name in ('max_concurrency', 'retry_attempts',
+                     'transaction_conflict_attempts', 'network_error_attempts'):
+            value = getattr(self, name)
+            if value is not None and (not isinstance(value, int)
+                                      or isinstance(value, bool) or value < 1):
+                raise InvalidConfigError(
+                    f'{name} must be a positive integer, got {value!r}')
+        for name in ('timeout', 'wait_until_available'):
+            value = getattr(self, name)
+            if not isinstance(value, int | float) or isinstance(value, bool) \
+                    or value <= 0:
+                raise InvalidConfigError(
+                    f'{name} must be a positive number, got {value!r}')
+        for name in ('readonly', 'deferrable'):
+            if not isinstance(getattr(self, name), bool):
+                raise InvalidConfigError(f'{name} must be True/False')
+
+    @classmethod
+    def from_sources(cls,
+                     secrets: Mapping[str, Any],
+                     kwargs: Mapping[str, Any]) -> 'EdgeDBConfig':
+        '''
+        Collect the fields from the connection secrets, overridden by kwargs.
+        Unrelated keys, like the dsn, are ignored.
+        '''
+        options = {}
+        for field in fields(cls):
+            for source in (secrets, kwargs):
+                if field.name in source:
+                    options[field.name] = source[field.name]
+        return cls(**options)
+
+    @property
+    def client_kwargs(self) -> dict[str, Any]:
+        return {'max_concurrency': self.max_concurrency,
+                'timeout': self.timeout,
+                'wait_until_available': self.wait_until_available}
+
+    @property
+    def retry_options(self) -> 'RetryOptions | None':
+        from edgedb import RetryCondition, RetryOptions
+
+        if (self.retry_attempts, self.transaction_conflict_attempts,
+                self.network_error_attempts) == (None, None, None):
+            return None
+        # 3 attempts is the edgedb default.
+        options = RetryOptions(attempts=self.retry_attempts or 3)
+        if self.transaction_conflict_attempts is not None:
+            options = options.with_rule(RetryCondition.TransactionConflict,
+                                        self.transaction_conflict_attempts)
+        if self.network_error_attempts is not None:
+            options = options.with_rule(RetryCondition.NetworkError,
+                                        self.network_error_attempts)
+        return options
+
+    @property
+    def transaction_options(self) -> 'TransactionOptions | None':
+        from edgedb import TransactionOptions
+
+        if not (self.readonly or self.deferrable):
+            return None
+        return TransactionOptions(readonly=self.readonly,
+                                  deferrable=self.deferrable)
+
+    def apply(self, client):
+        '''
+        Return the client with the retry and transaction policies applied.
+        The returned client shares the pool of the given one.
+        '''
+        if (retry_options := self.retry_options) is not None:
+            client = client.with_retry_options(retry_options)
+        if (transaction_options := self.transaction_options) is not None:
+            client = client.with_transaction_options(transaction_options)
+        return client
+
+
+@dataclass(frozen=True)
+class PoolStats:
+    max_concurrency: int
+    open: int
+    idle: int
+    in_use: int
+
+
+def pool_stats(client) -> PoolStats:
+    '''
+    Count the connections of an edgedb client pool. The client only exposes
+    `max_concurrency` and `free_size`, so the open and idle connections are
+    read from the pool's connection holders.
+    '''
+    holders = getattr(getattr(client, '_impl', None), '_holders', None) or ()
+    open_ = in_use = 0
+    for holder in holders:
+        con = getattr(holder, '_con', None)
+        if con is not None and not con.is_closed():
+            open_ += 1
+            if not holder._release_event.is_set():
+                in_use += 1
+    return PoolStats(max_concurrency=client.max_concurrency,
+                     open=open_,
+                     idle=open_ - in_use,
+                     in_use=in_use)
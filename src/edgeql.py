@@ -0,0 +1,237 @@
+import hashlib
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple
+
+_TOKEN_RE = re.compile(r'''
+    (?P<string>
+        r?'(?:[^'\\]|\\.)*'
+      | r?"(?:[^"\\]|\\.)*"
+      | \$(?P<tag>[A-Za-z_]\w*)?\$.*?\$(?P=tag)?\$
+      | `[^`]*`
+    )
+  | (?P<comment>\#[^\n]*)
+  | (?P<space>\s+)
+  | (?P<param>\$\w+)
+  | (?P<name>[A-Za-z_]\w*(?:::[A-Za-z_]\w*)*)
+  | (?P<op>.)
+''', re.VERBOSE | re.DOTALL)
+
+
+def tokenize(qry: str):
+    """Yield ``(kind, text)`` pairs for an EdgeQL string.
+
+    Kinds are ``string``, ``comment``, ``space``, ``param``, ``name`` and ``op``.
+    """
+    for m in _TOKEN_RE.finditer(qry):
+        yield m.lastgroup, m.group()
+
+
+def normalize(qry: str) -> str:
+    '''
+    Collapse whitespace and drop comments outside of string literals,
+    and strip the trailing semicolons.
+    '''
+    parts = []
+    for kind, text in tokenize(qry):
+        if kind in ('space', 'comment'):
+            if parts and parts[-1] != ' ':
+                parts.append(' ')
+        else:
+            parts.append(text)
+    return ''.join(parts).strip().rstrip(';').rstrip()
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(qry: str) -> str:
+    """A short, stable digest of the normalized query text."""
+    return hashlib.blake2b(normalize(qry).encode(), digest_size=16).hexdigest()
+
+
+class QueryParams(NamedTuple):
+    positional: int
+    named: frozenset[str]
+
+
+@lru_cache(maxsize=1024)
+def parse_params(qry: str) -> QueryParams:
+    '''
+    The number of positional (`$0`, `$1`, ...) and the names of the named
+    (`$title`) query parameters.
+    '''
+    positional, named = 0, set()
+    for kind, text in tokenize(qry):
+        if kind == 'param':
+            name = text[1:]
+            if name.isdigit():
+                positional = max(positional, int(name) + 1)
+            else:
+                named.add(name)
+    return QueryParams(positional, frozenset(named))
+
+
+WILDCARD = '*'
+
+_MUTATION_KEYWORDS = frozenset({'insert', 'update', 'delete'})
+_DDL_KEYWORDS = frozenset({'create', 'alter', 'drop', 'configure',
+                           'populate', 'start', 'commit', 'rollback'})
+_KEYWORDS = _MUTATION_KEYWORDS | _DDL_KEYWORDS | frozenset({
+    'select', 'with', 'for', 'in', 'union', 'filter', 'order', 'by', 'asc',
+    'desc', 'empty', 'first', 'last', 'offset', 'limit', 'set', 'unless',
+    'conflict', 'on', 'else', 'group', 'using', 'is', 'not', 'and', 'or',
+    'like', 'ilike', 'exists', 'distinct', 'detached', 'if', 'optional',
+    'module', 'as', 'introspect', 'typeof', 'true', 'false', 'analyze',
+    'describe', 'global', 'reset', 'required', 'single', 'multi',
+    'intersect', 'except', 'type', 'property', 'link', 'abstract',
+    'extending', 'migration', 'transaction',
+})
+_BUILTIN_MODULES = frozenset({'std', 'schema', 'sys', 'cfg', 'cal', 'math',
+                              'ext', 'fts', 'pg', '__derived__'})
+
+
+@dataclass(frozen=True)
+class StatementInfo:
+    '''
+    The object types a query reads and writes. `WILDCARD` in `writes` means
+    the written types are unknown, e.g. DDL or a statement we can't parse.
+    '''
+    reads: frozenset[str]
+    writes: frozenset[str]
+
+    @property
+    def is_mutation(self) -> bool:
+        return bool(self.writes)
+
+
+def strip_module(name: str) -> str:
+    return name.removeprefix('default::')
+
+
+def _is_builtin(name: str) -> bool:
+    module, sep, _ = name.rpartition('::')
+    return bool(sep) and module.split('::')[0] in _BUILTIN_MODULES
+
+
+def _is_op(tokens, i, text):
+    return 0 <= i < len(tokens) and tokens[i] == ('op', text)
+
+
+def _is_type_name(tokens, i) -> bool:
+    '''
+    Object types are told apart from fields, aliases and keywords by the
+    CamelCase naming convention and their surrounding tokens.
+    '''
+    text = tokens[i][1]
+    short = text.rpartition('::')[2]
+    return (short[:1].isupper()
+            and short.casefold() not in _KEYWORDS
+            and not _is_builtin(text)
+            and not (_is_op(tokens, i - 1, '.') or _is_op(tokens, i - 1, '@'))
+            and not _is_op(tokens, i + 1, '('))
+
+
+def _mutation_target(tokens, i) -> str:
+    while i < len(tokens) and (tokens[i] == ('op', '(')
+                               or (tokens[i][0] == 'name'
+                                   and tokens[i][1].casefold() in ('select', 'detached'))):
+        i += 1
+    if i < len(tokens) and tokens[i][0] == 'name' \
+            and tokens[i][1].casefold() not in _KEYWORDS:
+        return strip_module(tokens[i][1])
+    return WILDCARD
+
+
+@lru_cache(maxsize=1024)
+def classify(qry: str) -> StatementInfo:
+    """Extract the object types a query reads and writes."""
+    tokens = [(kind, text) for kind, text in tokenize(qry)
+              if kind not in ('space', 'comment')]
+    aliases = {text for i, (kind, text) in enumerate(tokens)
+               if kind == 'name' and _is_op(tokens, i + 1, ':')
+               and _is_op(tokens, i + 2, '=')}
+    reads, writes = set(), set()
+    statement_start = True
+    for i, (kind, text) in enumerate(tokens):
+        at_start, statement_start = statement_start, (kind, text) == ('op', ';')
+        if kind != 'name':
+            continue
+        word = text.casefold()
+        if at_start and word in _DDL_KEYWORDS:
+            writes.add(WILDCARD)
+        elif word in _MUTATION_KEYWORDS:
+            writes.add(_mutation_target(tokens, i + 1))
+        elif text not in aliases and _is_type_name(tokens, i):
+            reads.add(strip_module(text))
+    return StatementInfo(frozenset(reads), frozenset(writes))
+
+
+SCHEMA_QUERY = '''
+SELECT schema::ObjectType {
+    name,
+    ancestors: {name},
+    links: {target: {name}},
+};
+'''
+
+
+def build_dependents(object_types: list[dict]) -> dict[str, frozenset[str]]:
+    '''
+    Map each object type to the types whose query results may change when it
+    is written: its ancestors and descendants, plus every type that reaches
+    it, transitively, through links. `object_types` is the decoded JSON
+    result of `SCHEMA_QUERY`.
+    '''
+    ancestors = defaultdict(set)
+    descendants = defaultdict(set)
+    linked_from = defaultdict(set)
+    for object_type in object_types:
+        name = object_type['name']
+        if _is_builtin(name):
+            continue
+        name = strip_module(name)
+        for ancestor in object_type.get('ancestors') or ():
+            if not _is_builtin(ancestor['name']):
+                ancestors[name].add(strip_module(ancestor['name']))
+                descendants[strip_module(ancestor['name'])].add(name)
+        for link in object_type.get('links') or ():
+            target = (link.get('target') or {}).get('name')
+            if target and not _is_builtin(target):
+                linked_from[strip_module(target)].add(name)
+
+    dependents = {}
+    for name in ancestors.keys() | descendants.keys() | linked_from.keys():
+        affected = {name} | ancestors[name] | descendants[name]
+        pending = set(affected)
+        while pending:
+            linkers = set().union(*(linked_from[t] for t in pending))
+            linkers |= set().union(*(ancestors[t] for t in linkers))
+            pending = linkers - affected
+            affected |= pending
+        dependents[name] = frozenset(affected)
+    return dependents
+
+
+def paginate(qry: str,
+             limit: int,
+             offset: int = 0,
+             after_id: str | None = None,
+             keyset: bool = False) -> str:
+    '''
+    Wrap a query to select one page of its results, either by OFFSET/LIMIT
+    or, with `keyset`, by `.id`: the first page when `after_id` is None, and
+    the page after `after_id` otherwise. Keyset pages are all ordered by
+    `.id`, so that the last id of a page is where the next one starts.
+
+    The page bounds are integers or a uuid we read back from the database,
+    so they are inlined instead of taking the query's positional or named
+    arguments.
+    '''
+    inner = normalize(qry)
+    if after_id is not None:
+        return (f"SELECT ({inner}) FILTER .id > <uuid>'{after_id}' "
+                f"ORDER BY .id LIMIT {int(limit)}")
+    if keyset:
+        return f'SELECT ({inner}) ORDER BY .id LIMIT {int(limit)}'
+    return f'SELECT ({inner}) OFFSET {int(offset)} LIMIT {int(limit)}'
@@ -0,0 +1,217 @@
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field, replace
+from typing import Any, Callable, Iterator, Mapping
+
+from .edgeql import classify
+from .instrumentation import QueryEvent
+from .refresh import Refresher
+
+# The operations whose slow calls are worth a plan: writes would be run
+# again by `analyze`.
+_EXPLAINABLE = frozenset({'query', 'refresh', 'watch'})
+
+
+def analyze_query(qry: str) -> str:
+    return f'analyze {qry.strip().rstrip(";")};'
+
+
+def _norm(node: Mapping[str, Any]) -> dict[str, Any]:
+    '''
+    Accept both EdgeDB's snake_case keys and PostgreSQL's `Actual Total Time`.
+    '''
+    return {k.lower().replace(' ', '_'): v for k, v in node.items()}
+
+
+@dataclass(frozen=True)
+class PlanNode:
+    '''
+    A node of an `analyze` plan. Times are in milliseconds per loop, like
+    PostgreSQL reports them, and `label` is the part of the query the node
+    runs, when EdgeDB could tell.
+    '''
+    node_type: str
+    label: str = ''
+    total_time: float | None = None
+    startup_time: float | None = None
+    rows: float | None = None
+    plan_rows: float | None = None
+    loops: float | None = None
+    cost: float | None = None
+    children: tuple['PlanNode', ...] = ()
+    raw: Mapping[str, Any] = field(default_factory=dict, repr=False, compare=False)
+
+    @property
+    def self_time(self) -> float | None:
+        '''
+        The time spent in this node, without its children.
+        '''
+        if self.total_time is None:
+            return None
+        own = self.total_time * (self.loops or 1)
+        for child in self.children:
+            if child.total_time is not None:
+                own -= child.total_time * (child.loops or 1)
+        return max(own, 0.0)
+
+    def walk(self, depth: int = 0) -> Iterator[tuple[int, 'PlanNode']]:
+        yield depth, self
+        for child in self.children:
+            yield from child.walk(depth + 1)
+
+
+def parse_node(node: Mapping[str, Any]) -> PlanNode:
+    '''
+    Build a `PlanNode` from a node of EdgeDB's fine or coarse grained plan,
+    whose `pipeline` lists the fused PostgreSQL nodes it is made of, or from
+    a plain PostgreSQL plan node.
+    '''
+    node = _norm(node)
+    stages = [_norm(s) for s in node.get('pipeline') or ()] or [node]
+    top = stages[0]
+    children = [*(node.get('subplans') or ()), *(node.get('plans') or ()),
+                *(c.get('node', c) for c in node.get('children') or ())]
+    contexts = node.get('contexts') or top.get('contexts') or ()
+    return PlanNode(
+        node_type=' / '.join(str(s.get('plan_type') or s.get('node_type') or '?')
+                             for s in stages),
+        label=' '.join(c['text'] for c in contexts
+                       if isinstance(c, Mapping) and c.get('text')),
+        total_time=top.get('actual_total_time', node.get('full_total_time')),
+        startup_time=top.get('actual_startup_time'),
+        rows=top.get('actual_rows'),
+        plan_rows=top.get('plan_rows'),
+        loops=top.get('actual_loops'),
+        cost=top.get('total_cost', node.get('full_total_cost')),
+        children=tuple(parse_node(c) for c in children if isinstance(c, Mapping)),
+        raw=node)
+
+
+@dataclass(frozen=True)
+class Plan:
+    qry: str
+    root: PlanNode
+    raw: Any = field(repr=False, compare=False)
+
+    @property
+    def total_time(self) -> float | None:
+        return self.root.total_time
+
+    def nodes(self) -> list[tuple[int, PlanNode]]:
+        '''
+        The `(depth, node)` pairs of the tree, depth first.
+        '''
+        return list(self.root.walk())
+
+    def slowest(self, n: int = 5) -> list[PlanNode]:
+        '''
+        The `n` nodes with the largest `self_time`.
+        '''
+        nodes = [node for _, node in self.root.walk() if node.self_time is not None]
+        return sorted(nodes, key=lambda node: node.self_time, reverse=True)[:n]
+
+
+def parse_plan(qry: str, output: str | Mapping | list) -> Plan:
+    '''
+    Parse the JSON `analyze` returns. EdgeDB maps the PostgreSQL plan back
+    to the query in `fine_grained`, and to its shape in `coarse_grained`.
+    '''
+    raw = json.loads(output) if isinstance(output, str) else output
+    data = raw[0] if isinstance(raw, list) and raw else raw
+    if isinstance(data, Mapping):
+        data = _norm(data)
+        root = data.get('fine_grained') or data.get('coarse_grained') \
+            or data.get('plan') or data
+    else:
+        root = {'node_type': type(data).__name__}
+    return Plan(qry=qry, root=parse_node(root), raw=raw)
+
+
+@dataclass(frozen=True)
+class SlowQuery:
+    fingerprint: str
+    qry: str
+    operation: str
+    func_name: str
+    args_shape: str
+    latency: float
+    client_time: float
+    started_at: float
+    error: str | None = None
+    plan: Plan | None = None
+
+
+class SlowQueryLog:
+    '''
+    Keeps the last `maxlen` calls that took at least `threshold` seconds,
+    cache hits aside. With an `explain` function, slow reads are explained
+    in the background with the same arguments, one at a time per query
+    fingerprint, and their plan is added to the entry.
+    '''
+
+    def __init__(self,
+                 threshold: float,
+                 maxlen: int = 100,
+                 explain: Callable[[str, tuple, dict], Plan] | None = None) -> None:
+        self.threshold = threshold
+        self.explain = explain
+        self._entries: deque[SlowQuery] = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+        self._explainer = Refresher(max_workers=1, max_pending=16)
+
+    def observe(self, event: QueryEvent, args: tuple = (),
+                kwargs: dict | None = None) -> None:
+        if event.cache_hit or event.wall_time < self.threshold \
+                or event.operation == 'explain':
+            return
+        entry = SlowQuery(fingerprint=event.fingerprint,
+                          qry=event.qry,
+                          operation=event.operation,
+                          func_name=event.func_name,
+                          args_shape=event.args_shape,
+                          latency=event.wall_time,
+                          client_time=event.client_time,
+                          started_at=event.started_at,
+                          error=event.error)
+        with self._lock:
+            self._entries.append(entry)
+        explain = self.explain
+        if explain is not None and event.error is None \
+                and event.operation in _EXPLAINABLE \
+                and not classify(event.qry).is_mutation:
+            self._explainer.submit(
+                event.fingerprint,
+                lambda: self._attach(entry, explain(event.qry, args, kwargs or {})))
+
+    def _attach(self, entry: SlowQuery, plan: Plan) -> None:
+        with self._lock:
+            for i, e in enumerate(self._entries):
+                if e is entry:
+                    self._entries[i] = replace(entry, plan=plan)
+                    return
+
+    def entries(self) -> list[SlowQuery]:
+        '''
+        The slow calls, the latest first.
+        '''
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def wait(self, timeout: float = 5.0) -> bool:
+        '''
+        Wait for the pending explains, e.g. in tests. Return whether they
+        are all done.
+        '''
+        deadline = time.monotonic() + timeout
+        while len(self._explainer) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not len(self._explainer)
+
+    def __len__(self) -> int:
+        return len(self._entries)
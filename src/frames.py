@@ -0,0 +1,76 @@
+from datetime import date, datetime
+from operator import attrgetter
+from uuid import UUID
+
+from .lazy import is_edgedb_object
+from .snapshot import _pointers
+
+SCALAR_COLUMN = 'value'
+
+
+def to_columns(result) -> dict[str, tuple]:
+    '''
+    Turn a query result set into columns in one pass over its rows.
+
+    The column names come from the output shape of the first object, in
+    the query's order and without the implicit `id` and `__tid__`, unless
+    the shape has nothing else. Each row is read with a single `attrgetter`
+    call, so no per-row dict is built. Results of scalars or tuples land in
+    a single `value` column.
+    '''
+    rows = list(result)
+    if not rows or not is_edgedb_object(rows[0]):
+        return {SCALAR_COLUMN: tuple(rows)}
+    names = _shape(rows[0])
+    if len(names) == 1:
+        return {names[0]: tuple(map(attrgetter(names[0]), rows))}
+    return dict(zip(names, zip(*map(attrgetter(*names), rows))))
+
+
+def _shape(obj) -> list[str]:
+    from edgedb.datatypes.datatypes import get_object_descriptor
+
+    pointers = _pointers(get_object_descriptor(obj))
+    names = [name for name, kind in pointers if kind in ('property', 'link')]
+    return names or [name for name, kind in pointers
+                     if kind == 'implicit' and not name.startswith('__')]
+
+
+def to_dataframe(result):
+    '''
+    Build a pandas DataFrame from a query result set. Numeric, boolean,
+    datetime and duration properties get native dtypes from pandas'
+    inference, `cal::local_date` is converted to datetime64 as well, while
+    links, sets, uuids and decimals stay as objects.
+    '''
+    import pandas as pd
+
+    columns = to_columns(result)
+    for name, values in columns.items():
+        first = next((v for v in values if v is not None), None)
+        if isinstance(first, date) and not isinstance(first, datetime):
+            columns[name] = pd.to_datetime(list(values))
+    return pd.DataFrame(columns)
+
+
+def to_arrow(result):
+    '''
+    Build a pyarrow Table from a query result set. Columns pyarrow can't type,
+    like links, uuids or mixed values, are stored as strings.
+    '''
+    import pyarrow as pa
+
+    arrays = {}
+    for name, values in to_columns(result).items():
+        if any(isinstance(v, UUID) or is_edgedb_object(v) for v in values[:1]):
+            arrays[name] = _as_strings(pa, values)
+            continue
+        try:
+            arrays[name] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arrays[name] = _as_strings(pa, values)
+    return pa.table(arrays)
+
+
+def _as_strings(pa, values):
+    return pa.array([None if v is None else str(v) for v in values], pa.string())
@@ -0,0 +1,200 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable
+
+# https://www.edgedb.com/docs/guides/deployment/health_checks#health-checks
+ALIVE_PATH = '/server/status/alive'
+READY_PATH = '/server/status/ready'
+
+
+@dataclass(frozen=True)
+class HealthStatus:
+    '''
+    `alive` and `ready` are the HTTP status endpoints of the server, either
+    over http or https, `binary` is a `SELECT 1` over the binary protocol,
+    or None when it wasn't checked. `latency` is how long the check took.
+    '''
+    alive: bool
+    ready: bool
+    binary: bool | None
+    checked_at: float
+    latency: float
+    errors: tuple[str, ...] = ()
+
+    @property
+    def healthy(self) -> bool:
+        return self.alive and self.ready and self.binary is not False
+
+
+class HealthChecker:
+    '''
+    Checks the health of an EdgeDB server with short timeouts, all probes
+    running concurrently on a keep-alive HTTP client, and caches the status
+    for `ttl` seconds. `start_polling` keeps the cached status fresh from a
+    background thread, so that `check()` never waits on the network.
+
+    The binary pings run on a thread of their own, one at a time: a ping
+    still running from an earlier check fails the next ones instead of
+    piling up behind it.
+    '''
+
+    def __init__(self,
+                 alive_urls: list[str],
+                 ready_urls: list[str],
+                 ttl: float = 5.0,
+                 timeout: float = 2.0,
+                 clock=time.monotonic) -> None:
+        self._urls = {ALIVE_PATH: list(alive_urls), READY_PATH: list(ready_urls)}
+        self.ttl = ttl
+        self.timeout = timeout
+        self._clock = clock
+        self._status: HealthStatus | None = None
+        self._status_at = 0.0
+        self._http = None
+        self._executor: ThreadPoolExecutor | None = None
+        self._ping_executor: ThreadPoolExecutor | None = None
+        self._ping_future: Future | None = None
+        self._lock = threading.Lock()
+        self._check_lock = threading.Lock()
+        self._polling: threading.Event | None = None
+
+    @property
+    def status(self) -> HealthStatus | None:
+        '''
+        The last status, without checking.
+        '''
+        return self._status
+
+    def check(self,
+              ping: Callable[[], object] | None = None,
+              max_age: float | None = None) -> HealthStatus:
+        '''
+        Return the cached status if it is younger than `max_age`, `ttl` by
+        default, otherwise check again. `ping` runs a query over the binary
+        protocol. Concurrent callers share a single check.
+        '''
+        max_age = self.ttl if max_age is None else max_age
+        if self._fresh(max_age):
+            return self._status
+        with self._check_lock:
+            if self._fresh(max_age):
+                return self._status
+            status = self._probe(ping)
+            self._status, self._status_at = status, self._clock()
+            return status
+
+    def _fresh(self, max_age: float) -> bool:
+        return self._status is not None \
+            and self._clock() - self._status_at < max_age
+
+    def _client(self):
+        import httpx
+
+        with self._lock:
+            if self._http is None:
+                self._http = httpx.Client(
+                    timeout=self.timeout,
+                    verify=False,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_keepalive_connections=4))
+                self._executor = ThreadPoolExecutor(
+                    4, thread_name_prefix='edgedb-conn-health')
+                self._ping_executor = ThreadPoolExecutor(
+                    1, thread_name_prefix='edgedb-conn-health-ping')
+            return self._http, self._executor
+
+    def _submit_ping(self, ping: Callable[[], object]) -> Future:
+        '''
+        Run `ping`, unless the previous one is still running, which is then
+        reported as a failure of this check as well.
+        '''
+        previous = self._ping_future
+        if previous is not None and not previous.done():
+            failed = Future()
+            failed.set_exception(TimeoutError('the previous ping is still running'))
+            return failed
+        self._ping_future = self._ping_executor.submit(ping)
+        return self._ping_future
+
+    def _get(self, http, url: str) -> bool:
+        return http.get(url).status_code == 200
+
+    def _probe(self, ping: Callable[[], object] | None) -> HealthStatus:
+        http, executor = self._client()
+        start = time.perf_counter()
+        futures = {}
+        for path, urls in self._urls.items():
+            for url in urls:
+                futures[executor.submit(self._get, http, url)] = path
+        if ping is not None:
+            futures[self._submit_ping(ping)] = 'binary'
+
+        passed: set[str] = set()
+        errors = []
+        pending = set(futures)
+        deadline = start + self.timeout
+        # Stop waiting for the other scheme once one of them answered.
+        while pending and not ({ALIVE_PATH, READY_PATH} <= passed
+                               and (ping is None or 'binary' in passed)):
+            done, pending = wait(pending, timeout=deadline - time.perf_counter(),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                check = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    errors.append(f'{check}: {type(e).__name__}: {e}')
+                    continue
+                if check == 'binary' or result:
+                    passed.add(check)
+        for future in pending:
+            if futures[future] not in passed:
+                errors.append(f'{futures[future]}: timed out')
+        return HealthStatus(alive=ALIVE_PATH in passed,
+                            ready=READY_PATH in passed,
+                            binary=None if ping is None else 'binary' in passed,
+                            checked_at=time.time(),
+                            latency=time.perf_counter() - start,
+                            errors=tuple(errors))
+
+    def start_polling(self,
+                      interval: float,
+                      ping: Callable[[], object] | None = None) -> None:
+        '''
+        Check every `interval` seconds in a daemon thread, until
+        `stop_polling()`.
+        '''
+        with self._lock:
+            if self._polling is not None:
+                return
+            self._polling = stopped = threading.Event()
+
+        def _poll():
+            while not stopped.is_set():
+                self.check(ping, max_age=0)
+                stopped.wait(interval)
+
+        threading.Thread(target=_poll, name='edgedb-conn-health-poll',
+                         daemon=True).start()
+
+    def stop_polling(self) -> None:
+        with self._lock:
+            stopped, self._polling = self._polling, None
+        if stopped is not None:
+            stopped.set()
+
+    def close(self) -> None:
+        self.stop_polling()
+        with self._lock:
+            http, self._http = self._http, None
+            executors = self._executor, self._ping_executor
+            self._executor = self._ping_executor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=False)
+        if http is not None:
+            http.close()
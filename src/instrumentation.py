@@ -0,0 +1,371 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from .edgeql import fingerprint, normalize
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class QueryEvent:
+    '''
+    One call through the connection. `client_time` is spent in the edgedb
+    client (network and decoding of the wire format), `decode_time` in our
+    own decoding of cached snapshots or conversion to frames. `result_size`
+    counts items for result sets and characters for JSON results.
+    Transactions also record the time slept between attempts, `backoff_time`,
+    and the time spent committing, `commit_time`. `coalesced` reads waited
+    for an identical query already in flight instead of running their own.
+    `args_shape` describes the types of the query arguments, not their values.
+    '''
+    operation: str
+    func_name: str
+    fingerprint: str
+    qry: str
+    started_at: float
+    wall_time: float
+    client_time: float
+    decode_time: float
+    backoff_time: float
+    commit_time: float
+    result_size: int
+    cache_hit: bool
+    coalesced: bool
+    retries: int
+    error: str | None
+    args_shape: str = ''
+
+
+@dataclass(frozen=True)
+class QueryStats:
+    operation: str
+    func_name: str
+    fingerprint: str
+    qry: str
+    calls: int
+    cache_hits: int
+    coalesced: int
+    errors: int
+    retries: int
+    total_time: float
+    max_time: float
+    client_time: float
+    decode_time: float
+    backoff_time: float
+    commit_time: float
+    result_size: int
+
+    @property
+    def mean_time(self) -> float:
+        return self.total_time / self.calls if self.calls else 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.cache_hits / self.calls if self.calls else 0.0
+
+
+def result_size(result: Any) -> int:
+    match result:
+        case None:
+            return 0
+        case str() | list() | tuple():
+            return len(result)
+        case _ if hasattr(result, 'num_rows'):
+            # pyarrow.Table
+            return result.num_rows
+        case _ if hasattr(result, 'columns') and hasattr(result, 'index'):
+            # pandas.DataFrame
+            return len(result)
+        case _:
+            return 1
+
+
+def _shape(value: Any) -> str:
+    match value:
+        case list() | tuple() | set() | frozenset():
+            return f'{type(value).__name__}[{len(value)}]'
+        case _:
+            return type(value).__name__
+
+
+def args_shape(args: tuple = (), kwargs: dict | None = None) -> str:
+    '''
+    `(int, str, title: str)` for `(1, 'a', title='b')`.
+    '''
+    return '(' + ', '.join([*map(_shape, args),
+                            *(f'{k}: {_shape(v)}' for k, v in (kwargs or {}).items())]) + ')'
+
+
+class Probe:
+    '''
+    Times one call and records it when the `with` block exits, including
+    calls that raise.
+    '''
+    __slots__ = ('_instrumentation', 'operation', 'func_name', 'qry',
+                 'started_at', '_start', 'client_time', 'decode_time',
+                 'backoff_time', 'commit_time', 'result', 'cache_hit',
+                 'coalesced', 'retries', '_discarded', 'args', 'kwargs')
+
+    def __init__(self, instrumentation, operation, func_name, qry,
+                 args=(), kwargs=None):
+        self._instrumentation = instrumentation
+        self.operation = operation
+        self.func_name = func_name
+        self.qry = qry
+        self.args = args
+        self.kwargs = kwargs
+        self.client_time = 0.0
+        self.decode_time = 0.0
+        self.backoff_time = 0.0
+        self.commit_time = 0.0
+        self.result = None
+        self.cache_hit = False
+        self.coalesced = False
+        self.retries = 0
+        self._discarded = False
+
+    def __enter__(self) -> 'Probe':
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        if self._discarded:
+            return
+        wall_time = time.perf_counter() - self._start
+        error = None
+        if exc_type is not None and not issubclass(exc_type, GeneratorExit):
+            error = exc_type.__name__
+        event = QueryEvent(
+            operation=self.operation,
+            func_name=self.func_name,
+            fingerprint=fingerprint(self.qry),
+            qry=self.qry,
+            started_at=self.started_at,
+            wall_time=wall_time,
+            client_time=self.client_time,
+            decode_time=self.decode_time,
+            backoff_time=self.backoff_time,
+            commit_time=self.commit_time,
+            result_size=result_size(self.result),
+            cache_hit=self.cache_hit,
+            coalesced=self.coalesced,
+            retries=self.retries,
+            error=error,
+            args_shape=args_shape(self.args, self.kwargs))
+        self._instrumentation.record(event)
+        if (slow_log := self._instrumentation.slow_log) is not None:
+            slow_log.observe(event, self.args, self.kwargs)
+
+    def done(self, result: Any, cache_hit: bool = False,
+             coalesced: bool = False) -> Any:
+        self.result = result
+        self.cache_hit = cache_hit
+        self.coalesced = coalesced
+        return result
+
+    def discard(self) -> None:
+        '''
+        Don't record this call, e.g. when it is handed off to another probe.
+        '''
+        self._discarded = True
+
+    @contextmanager
+    def _timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            setattr(self, name, getattr(self, name) + time.perf_counter() - start)
+
+    def client(self):
+        return self._timer('client_time')
+
+    def decode(self):
+        return self._timer('decode_time')
+
+    def backoff(self):
+        return self._timer('backoff_time')
+
+    def commit(self):
+        return self._timer('commit_time')
+
+
+class _Aggregate:
+    __slots__ = ('operation', 'func_name', 'fingerprint', 'qry', 'calls',
+                 'cache_hits', 'coalesced', 'errors', 'retries', 'total_time', 'max_time',
+                 'client_time', 'decode_time', 'backoff_time', 'commit_time',
+                 'result_size')
+
+    def __init__(self, event: QueryEvent) -> None:
+        self.operation = event.operation
+        self.func_name = event.func_name
+        self.fingerprint = event.fingerprint
+        self.qry = normalize(event.qry)
+        self.calls = self.cache_hits = self.coalesced = 0
+        self.errors = self.retries = 0
+        self.total_time = self.max_time = 0.0
+        self.client_time = self.decode_time = 0.0
+        self.backoff_time = self.commit_time = 0.0
+        self.result_size = 0
+
+    def add(self, event: QueryEvent) -> None:
+        self.calls += 1
+        self.cache_hits += event.cache_hit
+        self.coalesced += event.coalesced
+        self.errors += event.error is not None
+        self.retries += event.retries
+        self.total_time += event.wall_time
+        self.max_time = max(self.max_time, event.wall_time)
+        self.client_time += event.client_time
+        self.decode_time += event.decode_time
+        self.backoff_time += event.backoff_time
+        self.commit_time += event.commit_time
+        self.result_size += event.result_size
+
+    def freeze(self) -> QueryStats:
+        return QueryStats(**{name: getattr(self, name) for name in self.__slots__})
+
+
+class Instrumentation:
+    '''
+    Aggregates `QueryEvent`s per operation and query fingerprint, and passes
+    every event on to the registered hooks. Queries with their values inlined
+    each get a fingerprint of their own, so only the `max_queries` most
+    recently recorded are kept.
+    '''
+
+    def __init__(self, max_queries: int = 1000) -> None:
+        self.max_queries = max_queries
+        self._stats: OrderedDict[tuple[str, str, str], _Aggregate] = OrderedDict()
+        self._hooks: list[Callable[[QueryEvent], None]] = []
+        self._lock = threading.Lock()
+        # Unlike the hooks, it also gets the argument values, to explain the
+        # slow queries.
+        self.slow_log = None
+
+    def probe(self,
+              operation: str,
+              func_name: str,
+              qry: str,
+              args: tuple = (),
+              kwargs: dict | None = None) -> Probe:
+        return Probe(self, operation, func_name, qry, args, kwargs)
+
+    def add_hook(self, hook: Callable[[QueryEvent], None]) -> None:
+        with self._lock:
+            self._hooks = [*self._hooks, hook]
+
+    def remove_hook(self, hook: Callable[[QueryEvent], None]) -> None:
+        with self._lock:
+            self._hooks = [h for h in self._hooks if h != hook]
+
+    def record(self, event: QueryEvent) -> None:
+        key = (event.operation, event.func_name, event.fingerprint)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _Aggregate(event)
+                if len(self._stats) > self.max_queries:
+                    self._stats.popitem(last=False)
+            else:
+                self._stats.move_to_end(key)
+            stats.add(event)
+            hooks = self._hooks
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception:
+                logger.exception('Query instrumentation hook %r failed', hook)
+
+    def stats(self) -> list[QueryStats]:
+        '''
+        The aggregated stats, slowest queries (by total time) first.
+        '''
+        with self._lock:
+            stats = [aggregate.freeze() for aggregate in self._stats.values()]
+        return sorted(stats, key=lambda s: s.total_time, reverse=True)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+
+
+def prometheus_hook(registry=None, prefix: str = 'edgedb_conn'):
+    '''
+    Return a hook exporting query latency, cache hits, errors and retries
+    through `prometheus_client`, labelled by operation and query fingerprint.
+    '''
+    from prometheus_client import REGISTRY, Counter, Histogram
+
+    registry = registry or REGISTRY
+    labels = ('operation', 'func_name', 'fingerprint')
+    latency = Histogram(f'{prefix}_query_seconds', 'Query wall time',
+                        labels, registry=registry)
+    hits = Counter(f'{prefix}_cache_hits', 'Query cache hits',
+                   labels, registry=registry)
+    coalesced = Counter(f'{prefix}_coalesced', 'Reads coalesced into another',
+                        labels, registry=registry)
+    errors = Counter(f'{prefix}_errors', 'Failed queries',
+                     labels, registry=registry)
+    retries = Counter(f'{prefix}_retries', 'Transaction retries',
+                      labels, registry=registry)
+    backoff = Counter(f'{prefix}_backoff_seconds', 'Time slept between retries',
+                      labels, registry=registry)
+    commit = Histogram(f'{prefix}_commit_seconds', 'Transaction commit time',
+                       labels, registry=registry)
+
+    def hook(event: QueryEvent) -> None:
+        values = (event.operation, event.func_name, event.fingerprint)
+        latency.labels(*values).observe(event.wall_time)
+        if event.cache_hit:
+            hits.labels(*values).inc()
+        if event.coalesced:
+            coalesced.labels(*values).inc()
+        if event.error is not None:
+            errors.labels(*values).inc()
+        if event.retries:
+            retries.labels(*values).inc(event.retries)
+            backoff.labels(*values).inc(event.backoff_time)
+        if event.operation == 'transaction':
+            commit.labels(*values).observe(event.commit_time)
+
+    return hook
+
+
+def opentelemetry_hook(tracer=None):
+    '''
+    Return a hook recording every event as an OpenTelemetry span.
+    '''
+    from opentelemetry import trace
+
+    tracer = tracer or trace.get_tracer(__name__)
+
+    def hook(event: QueryEvent) -> None:
+        start = int(event.started_at * 1e9)
+        span = tracer.start_span(f'edgedb.{event.operation}',
+                                 start_time=start,
+                                 attributes={
+                                     'db.system': 'edgedb',
+                                     'db.statement': event.qry,
+                                     'db.operation': event.func_name,
+                                     'edgedb.fingerprint': event.fingerprint,
+                                     'edgedb.cache_hit': event.cache_hit,
+                                     'edgedb.coalesced': event.coalesced,
+                                     'edgedb.client_time': event.client_time,
+                                     'edgedb.decode_time': event.decode_time,
+                                     'edgedb.result_size': event.result_size,
+                                     'edgedb.retries': event.retries,
+                                     'edgedb.backoff_time': event.backoff_time,
+                                     'edgedb.commit_time': event.commit_time,
+                                 })
+        if event.error is not None:
+            span.set_status(trace.Status(trace.StatusCode.ERROR, event.error))
+        span.end(end_time=start + int(event.wall_time * 1e9))
+
+    return hook
@@ -0,0 +1,84 @@
+import json
+from functools import cached_property
+from typing import Any
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class JSONResult(str):
+    '''
+    The JSON text returned by the `query*_json` methods. It is the string the
+    client decoded, so it can be handed to `st.json` as is, while `data`
+    parses it once on first access and `head(n)` only decodes the first `n`
+    elements of an array. Libraries that only take an exact `str`, like
+    orjson, take its `text`.
+
+    `data` is cached on the result, which may be shared by every session
+    through the result cache, so treat it as read-only.
+    '''
+
+    @cached_property
+    def data(self) -> Any:
+        return json.loads(self)
+
+    @cached_property
+    def text(self) -> str:
+        '''
+        The text as an exact `str`. It is a copy, made once on first access
+        and kept with the result.
+        '''
+        return str(self)
+
+    @property
+    def is_null(self) -> bool:
+        return self == 'null'
+
+    def head(self, n: int) -> 'JSONResult':
+        '''
+        The JSON array of the first `n` elements, sliced out of this one
+        without parsing the elements past them. Results that are not arrays
+        are returned whole.
+        '''
+        end = self._offset(n)
+        if end is None:
+            return self
+        return JSONResult(f'{self[:end]}]')
+
+    def _offset(self, n: int) -> int | None:
+        '''
+        Where the `n`th element of the array ends, or None when the array has
+        no more than `n` elements, or isn't an array at all.
+        '''
+        pos = self._skip(0)
+        if not self.startswith('[', pos):
+            return None
+        end = pos + 1
+        for i in range(n):
+            pos = self._skip(end)
+            if self.startswith(']', pos):
+                return None
+            if i:
+                # Past the comma after the previous element.
+                pos = self._skip(pos + 1)
+            _, end = _decoder.raw_decode(self, pos)
+        if self.startswith(']', self._skip(end)):
+            return None
+        return end
+
+    def _skip(self, pos: int) -> int:
+        while pos < len(self) and self[pos] in _WHITESPACE:
+            pos += 1
+        return pos
+
+    def __reduce__(self):
+        return JSONResult, (str(self),)
+
+
+def wrap_json(func_name: str, result: Any) -> Any:
+    '''
+    Wrap the result of the `query*_json` methods in a `JSONResult`.
+    '''
+    if func_name.endswith('_json') and type(result) is str:
+        return JSONResult(result)
+    return result
@@ -0,0 +1,11 @@
+import sys
+from typing import Any
+
+
+def is_edgedb_object(value: Any) -> bool:
+    '''
+    Whether `value` is an `edgedb.Object`, without importing edgedb: until
+    it is imported, nothing can be one.
+    '''
+    edgedb = sys.modules.get('edgedb')
+    return edgedb is not None and isinstance(value, edgedb.Object)
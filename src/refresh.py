@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class Refresher:
+    '''
+    Runs the background refreshes of stale cache entries on its own thread
+    pool, at most `max_workers` at a time and one per key. Refreshes beyond
+    `max_pending` are dropped, the stale entry is then simply refreshed by a
+    later read.
+    '''
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 256) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending: set[Hashable] = set()
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def submit(self, key: Hashable, func: Callable[[], Any]) -> bool:
+        '''
+        Schedule `func` unless a refresh of `key` is already pending, and
+        return whether it was scheduled.
+        '''
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    self.max_workers, thread_name_prefix='edgedb-conn-refresh')
+            self._pending.add(key)
+            self._executor.submit(self._run, key, func)
+            return True
+
+    def _run(self, key: Hashable, func: Callable[[], Any]) -> None:
+        try:
+            func()
+        except Exception:
+            logger.exception('Refreshing cache entry %r failed', key)
+        finally:
+            with self._lock:
+                self._pending.discard(key)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+
+class AsyncRefresher:
+    '''
+    The asyncio flavour of `Refresher`, running the refreshes as tasks on
+    the current event loop.
+    '''
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 256) -> None:
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending: dict[Hashable, asyncio.Task] = {}
+        self._semaphore: asyncio.Semaphore | None = None
+
+    def submit(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> bool:
+        if key in self._pending or len(self._pending) >= self.max_pending:
+            return False
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        self._pending[key] = asyncio.get_running_loop().create_task(
+            self._run(key, func))
+        return True
+
+    async def _run(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            async with self._semaphore:
+                await func()
+        except Exception:
+            logger.exception('Refreshing cache entry %r failed', key)
+        finally:
+            del self._pending[key]
+
+    def __len__(self) -> int:
+        return len(self._pending)
@@ -0,0 +1,226 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Any, Callable, Literal, Sequence
+from urllib.parse import urlsplit
+
+from .edgeql import WILDCARD
+
+# 'least_outstanding' sends a read to the replica with the fewest reads in
+# flight, 'round_robin' to each replica in turn.
+Balancing = Literal['least_outstanding', 'round_robin']
+BALANCINGS = ('least_outstanding', 'round_robin')
+
+
+def replica_errors() -> tuple[type[BaseException], ...]:
+    '''
+    The errors telling that a replica could not answer, rather than that the
+    query itself failed.
+    '''
+    import edgedb
+
+    return (OSError, edgedb.ClientConnectionError, edgedb.AvailabilityError)
+
+
+def replica_name(dsn: str) -> str:
+    '''
+    The `host:port` of a dsn, without its credentials.
+    '''
+    url = urlsplit(dsn)
+    if url.port is None:
+        return url.hostname or dsn
+    return f'{url.hostname}:{url.port}'
+
+
+class RecentWrites:
+    '''
+    The object types written in the last `window` seconds. A replica may not
+    have caught up with them yet, so reading them there could refill the
+    cache with the results the write just invalidated.
+    '''
+
+    def __init__(self, window: float = 5.0, clock=time.monotonic) -> None:
+        self.window = window
+        self._clock = clock
+        self._until: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, types: frozenset[str]) -> None:
+        if self.window <= 0:
+            return
+        now = self._clock()
+        with self._lock:
+            self._until = {t: until for t, until in self._until.items()
+                           if until > now}
+            for t in types:
+                self._until[t] = now + self.window
+
+    def overlaps(self, types: frozenset[str]) -> bool:
+        '''
+        Whether any of `types` was written within the window. `WILDCARD`, on
+        either side, overlaps with every type.
+        '''
+        if not self._until:
+            return False
+        now = self._clock()
+        with self._lock:
+            recent = {t for t, until in self._until.items() if until > now}
+        if WILDCARD in types or WILDCARD in recent:
+            return bool(recent)
+        return not recent.isdisjoint(types)
+
+
+@dataclass(frozen=True)
+class ReplicaStatus:
+    '''
+    `ejected_for` is how many seconds are left before an ejected replica gets
+    reads again, 0 when it is up.
+    '''
+    name: str
+    healthy: bool
+    outstanding: int
+    requests: int
+    failures: int
+    ejected_for: float
+    last_error: str | None = None
+
+
+class Replica:
+    __slots__ = ('name', 'client', 'outstanding', 'requests', 'failures',
+                 'ejected_until', 'last_error')
+
+    def __init__(self, name: str, client: Any) -> None:
+        self.name = name
+        self.client = client
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.last_error: str | None = None
+
+
+class ReadRouter:
+    '''
+    Picks the replica client a read runs on. A replica that fails to answer,
+    or fails a health check, is ejected for `eject_time` seconds, then gets
+    reads again unless a health check failed it meanwhile. `acquire()`
+    returns None when every replica is ejected, and the read goes to the
+    primary.
+    '''
+
+    def __init__(self,
+                 clients: Sequence[tuple[str, Any]],
+                 balancing: Balancing = 'least_outstanding',
+                 eject_time: float = 30.0,
+                 clock=time.monotonic) -> None:
+        self._replicas = [Replica(name, client) for name, client in clients]
+        self.balancing = balancing
+        self.eject_time = eject_time
+        self._clock = clock
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._polling: threading.Event | None = None
+
+    def acquire(self) -> Replica | None:
+        '''
+        Pick a replica that is up and count the read as outstanding on it
+        until `release()`. Ties go round-robin.
+        '''
+        with self._lock:
+            now = self._clock()
+            up = [r for r in self._replicas if r.ejected_until <= now]
+            if not up:
+                return None
+            start = next(self._turn) % len(up)
+            up = up[start:] + up[:start]
+            replica = up[0] if self.balancing == 'round_robin' \
+                else min(up, key=lambda r: r.outstanding)
+            replica.outstanding += 1
+            replica.requests += 1
+            return replica
+
+    def release(self, replica: Replica) -> None:
+        with self._lock:
+            replica.outstanding -= 1
+
+    def eject(self, replica: Replica, error: BaseException | str) -> None:
+        with self._lock:
+            replica.failures += 1
+            replica.ejected_until = self._clock() + self.eject_time
+            replica.last_error = error if isinstance(error, str) \
+                else f'{type(error).__name__}: {error}'
+
+    def readmit(self, replica: Replica) -> None:
+        with self._lock:
+            replica.ejected_until = 0.0
+
+    def check(self,
+              ping: Callable[[Any], object],
+              timeout: float = 2.0) -> list[ReplicaStatus]:
+        '''
+        Run `ping` on every replica client at once, eject the ones that fail
+        or take longer than `timeout` seconds and readmit the others.
+        '''
+        executor = ThreadPoolExecutor(len(self._replicas) or 1,
+                                      thread_name_prefix='edgedb-conn-replicas')
+        try:
+            futures = {executor.submit(ping, r.client): r for r in self._replicas}
+            done, pending = wait(futures, timeout=timeout)
+            for future in done:
+                replica = futures[future]
+                if (error := future.exception()) is None:
+                    self.readmit(replica)
+                else:
+                    self.eject(replica, error)
+            for future in pending:
+                self.eject(futures[future], 'health check timed out')
+        finally:
+            executor.shutdown(wait=False)
+        return self.statuses()
+
+    def start_polling(self,
+                      interval: float,
+                      ping: Callable[[Any], object],
+                      timeout: float = 2.0) -> None:
+        '''
+        `check()` every `interval` seconds in a daemon thread, until
+        `stop_polling()`.
+        '''
+        with self._lock:
+            if self._polling is not None:
+                return
+            self._polling = stopped = threading.Event()
+
+        def _poll():
+            while not stopped.is_set():
+                self.check(ping, timeout)
+                stopped.wait(interval)
+
+        threading.Thread(target=_poll, name='edgedb-conn-replicas-poll',
+                         daemon=True).start()
+
+    def stop_polling(self) -> None:
+        with self._lock:
+            stopped, self._polling = self._polling, None
+        if stopped is not None:
+            stopped.set()
+
+    def statuses(self) -> list[ReplicaStatus]:
+        with self._lock:
+            now = self._clock()
+            return [ReplicaStatus(name=r.name,
+                                  healthy=r.ejected_until <= now,
+                                  outstanding=r.outstanding,
+                                  requests=r.requests,
+                                  failures=r.failures,
+                                  ejected_for=max(r.ejected_until - now, 0.0),
+                                  last_error=r.last_error)
+                    for r in self._replicas]
+
+    def clients(self) -> list[Any]:
+        return [r.client for r in self._replicas]
+
+    def __len__(self) -> int:
+        return len(self._replicas)
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from concurrent.futures import Future, wait
+from typing import Any, Awaitable, Callable, Hashable
+
+from .admission import DeadlineExceededError, deadline_errors, remaining
+
+
+class _LeaderTimedOut(Exception):
+    '''
+    Set on a shared call whose leader ran out of its own deadline, which says
+    nothing about whether the followers' calls would succeed.
+    '''
+
+
+def _leader_failure(e: BaseException, deadline: float | None) -> BaseException:
+    if deadline is not None and isinstance(e, deadline_errors()):
+        return _LeaderTimedOut()
+    return e
+
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls with the same key: the first caller runs the
+    function, and the callers arriving while it runs wait for its result, or
+    its exception, instead of running it again.
+
+    A caller never waits past its own `deadline`. When the leader fails
+    because its deadline ran out, its followers don't fail with it, and the
+    first one to notice runs the function again as the new leader.
+    '''
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self,
+           key: Hashable,
+           func: Callable[[], Any],
+           deadline: float | None = None) -> tuple[Any, bool]:
+        '''
+        Return the result of `func()` and whether it was shared with, i.e.
+        run by, another caller.
+        '''
+        while True:
+            with self._lock:
+                future = self._calls.get(key)
+                leader = future is None
+                if leader:
+                    future = self._calls[key] = Future()
+            if leader:
+                break
+            done, _ = wait([future],
+                           None if deadline is None else remaining(deadline))
+            if not done:
+                raise DeadlineExceededError(
+                    'ran out of time waiting for an identical call')
+            try:
+                return future.result(), True
+            except _LeaderTimedOut:
+                continue
+
+        # The key is released before the followers wake up, so that those
+        # retrying after a timed out leader don't find its call again.
+        try:
+            result = func()
+        except BaseException as e:
+            self._release(key)
+            future.set_exception(_leader_failure(e, deadline))
+            raise
+        self._release(key)
+        future.set_result(result)
+        return result, False
+
+    def _release(self, key: Hashable) -> None:
+        with self._lock:
+            del self._calls[key]
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class AsyncSingleFlight:
+    '''
+    The asyncio flavour of `SingleFlight`, for calls on a single event loop.
+    '''
+
+    def __init__(self) -> None:
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self,
+                 key: Hashable,
+                 func: Callable[[], Awaitable[Any]],
+                 deadline: float | None = None) -> tuple[Any, bool]:
+        while (future := self._calls.get(key)) is not None:
+            # Unlike `wait_for`, a waiter timing out or being cancelled does
+            # not cancel the shared call.
+            done, _ = await asyncio.wait(
+                {future}, timeout=None if deadline is None else remaining(deadline))
+            if not done:
+                raise DeadlineExceededError(
+                    'ran out of time waiting for an identical call')
+            try:
+                return future.result(), True
+            except _LeaderTimedOut:
+                continue
+
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(_leader_failure(e, deadline))
+            # Don't log it as never retrieved when nobody was waiting.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, False
+
+    def __len__(self) -> int:
+        return len(self._calls)
@@ -0,0 +1,90 @@
+from functools import lru_cache
+from typing import Any, NamedTuple
+
+from .cache import estimate_size
+from .jsonresult import JSONResult
+from .lazy import is_edgedb_object
+
+
+class _FrozenObject(NamedTuple):
+    pointers: tuple[tuple[str, str], ...]
+    values: tuple
+
+
+class _FrozenList(tuple):
+    pass
+
+
+@lru_cache(maxsize=256)
+def _pointers(descriptor) -> tuple[tuple[str, str], ...]:
+    '''
+    The `(name, kind)` pairs of an object descriptor in field order, where
+    kind is what `create_object_factory` expects.
+    '''
+    pointers = []
+    for name in sorted(dir(descriptor), key=descriptor.get_pos):
+        if descriptor.is_linkprop(name):
+            pointers.append((name, 'link-property'))
+        elif descriptor.is_implicit(name):
+            pointers.append((name, 'implicit'))
+        elif descriptor.is_link(name):
+            pointers.append((name, 'link'))
+        else:
+            pointers.append((name, 'property'))
+    return tuple(pointers)
+
+
+@lru_cache(maxsize=256)
+def _factory(pointers: tuple[tuple[str, str], ...]):
+    from edgedb.datatypes.datatypes import create_object_factory
+
+    return create_object_factory(**{name.removeprefix('@'): kind
+                                    for name, kind in pointers})
+
+
+def _freeze(value: Any) -> Any:
+    match value:
+        case _ if is_edgedb_object(value):
+            from edgedb.datatypes.datatypes import get_object_descriptor
+
+            pointers = _pointers(get_object_descriptor(value))
+            return _FrozenObject(
+                pointers,
+                tuple(_freeze(value[name] if kind == 'link-property'
+                              else getattr(value, name))
+                      for name, kind in pointers))
+        case list():
+            return _FrozenList(_freeze(v) for v in value)
+        case _:
+            return value
+
+
+def _thaw(value: Any) -> Any:
+    match value:
+        case _FrozenObject(pointers, values):
+            return _factory(pointers)(*(_thaw(v) for v in values))
+        case _FrozenList():
+            return [_thaw(v) for v in value]
+        case _:
+            return value
+
+
+class Snapshot:
+    '''
+    An immutable copy of a query result, safe to share between sessions.
+
+    JSON results are kept as UTF-8 bytes, and result sets as nested tuples
+    that are rebuilt into fresh `edgedb.Object`s and lists on every `thaw()`,
+    so no reader can mutate what another one sees.
+    '''
+    __slots__ = ('_data', '_is_json', 'nbytes')
+
+    def __init__(self, result: Any) -> None:
+        self._is_json = isinstance(result, JSONResult)
+        self._data = result.encode() if self._is_json else _freeze(result)
+        self.nbytes = estimate_size(self._data)
+
+    def thaw(self) -> Any:
+        if self._is_json:
+            return JSONResult(self._data, 'utf-8')
+        return _thaw(self._data)
@@ -0,0 +1,457 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Hashable
+
+from .cache import MISSING, CacheStats, EntryInfo, bumped_tags, generation_tags, to_seconds
+from .edgeql import WILDCARD
+from .jsonresult import JSONResult
+from .snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+# Don't turn every hit into a write, the LRU order only needs to be roughly
+# right.
+_TOUCH_INTERVAL = 1.0
+
+# The most expired entries dropped by one `set`, so that a write after a long
+# idle period doesn't stall on deleting all of them.
+_EXPIRE_BATCH = 256
+
+_JSON, _PICKLE = 0, 1
+
+_SCHEMA = '''
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS entries (
+    namespace TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    key BLOB NOT NULL,
+    kind INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    expires_at REAL,
+    stale_at REAL,
+    accessed_at REAL NOT NULL,
+    tags TEXT NOT NULL,
+    PRIMARY KEY (namespace, digest)
+);
+CREATE INDEX IF NOT EXISTS entries_lru ON entries (namespace, accessed_at);
+CREATE INDEX IF NOT EXISTS entries_expiry ON entries (namespace, expires_at);
+CREATE TABLE IF NOT EXISTS tags (
+    namespace TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (namespace, tag, digest)
+);
+CREATE TABLE IF NOT EXISTS generations (
+    namespace TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    generation INTEGER NOT NULL,
+    PRIMARY KEY (namespace, tag)
+);
+CREATE TABLE IF NOT EXISTS totals (
+    namespace TEXT PRIMARY KEY,
+    entries INTEGER NOT NULL,
+    nbytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals
+    SELECT namespace, count(*), sum(nbytes) FROM entries GROUP BY namespace;
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+    INSERT INTO totals VALUES (new.namespace, 1, new.nbytes)
+        ON CONFLICT (namespace) DO UPDATE
+        SET entries = entries + 1, nbytes = nbytes + excluded.nbytes;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+    UPDATE totals SET entries = entries - 1, nbytes = nbytes - old.nbytes
+        WHERE namespace = old.namespace;
+END;
+COMMIT;
+'''
+
+
+def default_path() -> str:
+    '''
+    A file in the user's cache directory, `$XDG_CACHE_HOME` or `~/.cache`,
+    created only accessible to them.
+    '''
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    directory = os.path.join(base, 'st-edgedb-conn')
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    return os.path.join(directory, 'cache.sqlite')
+
+
+def _check_owner(path: str) -> None:
+    '''
+    Create the file at `path` readable by its owner only, or make sure the
+    existing one belongs to the current user: anyone able to write to it can
+    run code in the processes unpickling its entries.
+    '''
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        owner = os.fstat(fd).st_uid
+    finally:
+        os.close(fd)
+    if hasattr(os, 'getuid') and owner != os.getuid():
+        raise PermissionError(
+            f'{path} belongs to another user, refusing to load cached results from it')
+
+
+def _canonical(key: Any) -> str:
+    '''
+    A representation of a cache key that is the same in every process,
+    unlike the iteration order of its frozensets.
+    '''
+    match key:
+        case tuple():
+            return '(' + ','.join(_canonical(k) for k in key) + ')'
+        case frozenset() | set():
+            return '{' + ','.join(sorted(_canonical(k) for k in key)) + '}'
+        case _:
+            return repr(key)
+
+
+def digest(key: Hashable) -> str:
+    return hashlib.sha256(_canonical(key).encode()).hexdigest()
+
+
+def namespace(connection_name: str, dsn: str) -> str:
+    '''
+    Keep the entries of different connections apart in a shared file,
+    without writing the dsn and its password to disk.
+    '''
+    return hashlib.sha256(f'{connection_name}\0{dsn}'.encode()).hexdigest()[:32]
+
+
+def _dump(value: Any) -> tuple[int, bytes]:
+    if isinstance(value, JSONResult):
+        return _JSON, value.encode()
+    if not isinstance(value, Snapshot):
+        value = Snapshot(value)
+    return _PICKLE, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _load(kind: int, data: bytes) -> Any:
+    if kind == _JSON:
+        return JSONResult(data, 'utf-8')
+    return pickle.loads(data)
+
+
+class SQLiteResultCache:
+    """A `ResultCache` persisted to a SQLite file, so that it survives
+    restarts and is shared by all the processes using the same file, e.g.
+    the workers of a deployment.
+
+    JSON results are stored as is, other results as pickled `Snapshot`s,
+    which `thaw()` into fresh objects. Results that can't be pickled are not
+    cached. Unpickling runs arbitrary code, so the file defaults to the
+    user's own cache directory, and a file owned by another user is refused.
+
+    Expiry uses the wall clock, since it is shared by the processes, and
+    the size bounds are enforced by dropping the least recently used
+    entries. The hit and miss counts are per process."""
+
+    def __init__(self,
+                 path: str | None = None,
+                 namespace: str = '',
+                 max_entries: int = 1024,
+                 max_bytes: int = 256 * 1024 * 1024,
+                 busy_timeout: float = 5.0,
+                 clock=time.time) -> None:
+        self.path = default_path() if path is None else path
+        _check_owner(self.path)
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.busy_timeout = busy_timeout
+        self._clock = clock
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._stale_hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._db.executescript(_SCHEMA)
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        '''
+        A connection per thread, and per process after a fork.
+        '''
+        pid, db = getattr(self._local, 'db', (None, None))
+        if pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout,
+                                 isolation_level=None, check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = (os.getpid(), db)
+            with self._lock:
+                self._connections.append(db)
+        return db
+
+    def _write(self,
+               *statements: tuple[str, tuple],
+               check: Callable[[], bool] | None = None) -> list[sqlite3.Cursor] | None:
+        '''
+        Run `statements` in one transaction, unless `check` is given and
+        returns False once the transaction has begun.
+        '''
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if check is not None and not check():
+                db.execute('ROLLBACK')
+                return None
+            cursors = [db.execute(sql, params) for sql, params in statements]
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return cursors
+
+    def get(self, key: Hashable) -> Any:
+        '''
+        Return the cached value, or `MISSING` if there is no live entry.
+        '''
+        return self.lookup(key)[0]
+
+    def lookup(self, key: Hashable) -> tuple[Any, bool]:
+        '''
+        Return the cached value, or `MISSING`, and whether it is past its
+        soft TTL, i.e. still served but due for a refresh.
+        '''
+        now = self._clock()
+        d = digest(key)
+        value, stale_at, accessed_at = self._load_entry(key, d, now)
+        with self._lock:
+            if value is MISSING:
+                self._misses += 1
+                return MISSING, False
+            stale = stale_at is not None and stale_at <= now
+            self._hits += 1
+            self._stale_hits += stale
+        if now - accessed_at >= _TOUCH_INTERVAL:
+            self._db.execute(
+                'UPDATE entries SET accessed_at = ? WHERE namespace = ? AND digest = ?',
+                (now, self.namespace, d))
+        return value, stale
+
+    def _peek(self, key: Hashable) -> Any:
+        '''
+        Like `get`, without counting a hit or a miss, for a read that was
+        already counted.
+        '''
+        return self._load_entry(key, digest(key), self._clock())[0]
+
+    def _load_entry(self,
+                    key: Hashable,
+                    d: str,
+                    now: float) -> tuple[Any, float | None, float | None]:
+        '''
+        The live value of the entry with digest `d`, or `MISSING`, and its
+        `stale_at` and `accessed_at`. An expired or unreadable entry is
+        dropped.
+        '''
+        row = self._db.execute(
+            'SELECT kind, value, expires_at, stale_at, accessed_at FROM entries '
+            'WHERE namespace = ? AND digest = ?', (self.namespace, d)).fetchone()
+        if row is None:
+            return MISSING, None, None
+        kind, data, expires_at, stale_at, accessed_at = row
+        if expires_at is not None and expires_at <= now:
+            self._delete([d])
+            return MISSING, None, None
+        try:
+            return _load(kind, data), stale_at, accessed_at
+        except Exception:
+            logger.exception('Loading cache entry %r failed', key)
+            self._delete([d])
+            return MISSING, None, None
+
+    def set(self,
+            key: Hashable,
+            value: Any,
+            ttl: float | timedelta | None = None,
+            tags: frozenset[str] = frozenset({WILDCARD}),
+            soft_ttl: float | timedelta | None = None,
+            generation: tuple[int, ...] | None = None) -> None:
+        '''
+        Like `ResultCache.set`. The size of an entry is the size of its
+        serialized value, and `generation` is checked against the
+        invalidations of every process.
+        '''
+        ttl = to_seconds(ttl)
+        soft_ttl = to_seconds(soft_ttl)
+        if ttl is not None and ttl <= 0:
+            return
+        try:
+            kind, data = _dump(value)
+        except Exception as e:
+            logger.debug('Not caching %r: %s', key, e)
+            return
+        if len(data) > self.max_bytes:
+            return
+        now = self._clock()
+        expires_at = None if ttl is None else now + ttl
+        stale_at = None
+        if soft_ttl is not None and (ttl is None or soft_ttl < ttl):
+            stale_at = now + soft_ttl
+        d = digest(key)
+        ns = self.namespace
+        # Not `INSERT OR REPLACE`, which doesn't fire the triggers keeping
+        # the totals.
+        written = self._write(
+            ('DELETE FROM tags WHERE namespace = ? AND digest = ?', (ns, d)),
+            ('DELETE FROM entries WHERE namespace = ? AND digest = ?', (ns, d)),
+            ('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+             (ns, d, pickle.dumps(key), kind, data, len(data), expires_at,
+              stale_at, now, json.dumps(sorted(tags)))),
+            *(('INSERT OR IGNORE INTO tags VALUES (?, ?, ?)', (ns, tag, d))
+              for tag in tags),
+            check=None if generation is None
+            else lambda: generation == self.generation(tags))
+        if written is not None:
+            self._evict(now)
+
+    def invalidate(self, key: Hashable) -> bool:
+        return self._delete([digest(key)]) > 0
+
+    def invalidate_tags(self, tags: frozenset[str]) -> int:
+        '''
+        Drop every entry tagged with one of `tags`, or with `WILDCARD`, in
+        every process sharing the file. Passing `WILDCARD` itself drops
+        everything. Return the number of dropped entries.
+        '''
+        # Bumped first, so that a result read before the invalidation is
+        # either dropped with the others or not stored at all.
+        self._bump(tags)
+        if WILDCARD in tags:
+            count = self._clear()
+        else:
+            tags = (*tags, WILDCARD)
+            marks = ', '.join('?' * len(tags))
+            digests = [d for d, in self._db.execute(
+                f'SELECT DISTINCT digest FROM tags WHERE namespace = ? AND tag IN ({marks})',
+                (self.namespace, *tags))]
+            count = self._delete(digests)
+        with self._lock:
+            self._invalidations += count
+        return count
+
+    def generation(self, tags: frozenset[str]) -> tuple[int, ...]:
+        names = generation_tags(tags)
+        marks = ', '.join('?' * len(names))
+        found = dict(self._db.execute(
+            f'SELECT tag, generation FROM generations WHERE namespace = ? AND tag IN ({marks})',
+            (self.namespace, *names)))
+        return tuple(found.get(name, 0) for name in names)
+
+    def _bump(self, tags: frozenset[str]) -> None:
+        self._write(*(('INSERT INTO generations VALUES (?, ?, 1) '
+                       'ON CONFLICT (namespace, tag) DO UPDATE SET generation = generation + 1',
+                       (self.namespace, tag))
+                      for tag in bumped_tags(tags)))
+
+    def clear(self) -> None:
+        self._bump(frozenset({WILDCARD}))
+        self._clear()
+
+    def _clear(self) -> int:
+        ns = self.namespace
+        cursor, _ = self._write(
+            ('DELETE FROM entries WHERE namespace = ?', (ns,)),
+            ('DELETE FROM tags WHERE namespace = ?', (ns,)))
+        return cursor.rowcount
+
+    def _delete(self, digests: list[str]) -> int:
+        if not digests:
+            return 0
+        ns = self.namespace
+        cursors = self._write(
+            *(('DELETE FROM entries WHERE namespace = ? AND digest = ?', (ns, d))
+              for d in digests),
+            *(('DELETE FROM tags WHERE namespace = ? AND digest = ?', (ns, d))
+              for d in digests))
+        return sum(c.rowcount for c in cursors[:len(digests)])
+
+    def _evict(self, now: float) -> None:
+        '''
+        Drop a batch of expired entries, then the least recently used ones
+        until the cache fits its bounds. Both are read off an index, and the
+        size of the cache off its running totals, so a write doesn't scan
+        the whole table.
+        '''
+        expired = [d for d, in self._db.execute(
+            'SELECT digest FROM entries WHERE namespace = ? AND expires_at <= ? '
+            'LIMIT ?', (self.namespace, now, _EXPIRE_BATCH))]
+        self._delete(expired)
+        entries, nbytes = self._totals()
+        if entries <= self.max_entries and nbytes <= self.max_bytes:
+            return
+        evicted = []
+        for d, size in self._db.execute(
+                'SELECT digest, nbytes FROM entries WHERE namespace = ? '
+                'ORDER BY accessed_at', (self.namespace,)):
+            if entries <= self.max_entries and nbytes <= self.max_bytes:
+                break
+            evicted.append(d)
+            entries -= 1
+            nbytes -= size
+        count = self._delete(evicted)
+        with self._lock:
+            self._evictions += count
+
+    def entries(self) -> list[EntryInfo]:
+        '''
+        Report the serialized size and remaining TTL of each entry, from the
+        least to the most recently used.
+        '''
+        now = self._clock()
+        return [EntryInfo(key=pickle.loads(key),
+                          nbytes=nbytes,
+                          expires_in=None if expires_at is None
+                          else max(expires_at - now, 0),
+                          stale_in=None if stale_at is None
+                          else max(stale_at - now, 0),
+                          tags=frozenset(json.loads(tags)))
+                for key, nbytes, expires_at, stale_at, tags in self._db.execute(
+                    'SELECT key, nbytes, expires_at, stale_at, tags FROM entries '
+                    'WHERE namespace = ? ORDER BY accessed_at', (self.namespace,))]
+
+    def _totals(self) -> tuple[int, int]:
+        row = self._db.execute('SELECT entries, nbytes FROM totals WHERE namespace = ?',
+                               (self.namespace,)).fetchone()
+        return row or (0, 0)
+
+    def stats(self) -> CacheStats:
+        entries, nbytes = self._totals()
+        with self._lock:
+            return CacheStats(hits=self._hits,
+                              stale_hits=self._stale_hits,
+                              misses=self._misses,
+                              evictions=self._evictions,
+                              invalidations=self._invalidations,
+                              entries=entries,
+                              nbytes=nbytes)
+
+    def close(self) -> None:
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for db in connections:
+            db.close()
+        self._local = threading.local()
+
+    def __len__(self) -> int:
+        return self._totals()[0]
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._db.execute(
+            'SELECT 1 FROM entries WHERE namespace = ? AND digest = ?',
+            (self.namespace, digest(key))).fetchone() is not None
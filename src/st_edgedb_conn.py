@@ -1,12 +1,97 @@
-from contextlib import AbstractContextManager
+import asyncio
+import atexit
+import json
+import logging
+import threading
+from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AbstractContextManager, nullcontext
+from datetime import timedelta
+from functools import partial
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    Mapping,
+    Sequence,
+    TypeVar,
+)
 
-import edgedb
 import streamlit as st
-from edgedb import Client as EdgeDBClient
-from edgedb import Object as EdgeDBObject
-from edgedb.blocking_client import Iteration, Retry
 from streamlit.connections import ExperimentalBaseConnection
 
+from .admission import (
+    Admission,
+    AdmissionStats,
+    AsyncAdmission,
+    DeadlineExceededError,
+    deadline_after,
+    deadline_errors,
+    remaining,
+)
+from .bulk import chunked, encode_rows, infer_casts, insert_query, is_name
+from .cache import MISSING, ResultCache, freeze_arg, make_key, make_key_prefix
+from .config import EdgeDBConfig, PoolStats, pool_stats
+from .explain import Plan, SlowQuery, SlowQueryLog, analyze_query, parse_plan
+from .edgeql import (
+    SCHEMA_QUERY,
+    WILDCARD,
+    StatementInfo,
+    build_dependents,
+    classify,
+    paginate,
+    parse_params,
+    strip_module,
+)
+from .frames import to_arrow, to_dataframe
+from .health import ALIVE_PATH, READY_PATH, HealthChecker, HealthStatus
+from .jsonresult import JSONResult, wrap_json
+from .instrumentation import Instrumentation, Probe, QueryEvent, QueryStats
+from .refresh import AsyncRefresher, Refresher
+from .routing import (
+    BALANCINGS,
+    ReadRouter,
+    RecentWrites,
+    Replica,
+    ReplicaStatus,
+    replica_errors,
+    replica_name,
+)
+from .singleflight import AsyncSingleFlight, SingleFlight
+from .snapshot import Snapshot
+from .sqlite_cache import SQLiteResultCache
+from .sqlite_cache import namespace as cache_namespace
+from .watch import Watch, Watcher, rerun_on_change
+
+# edgedb is imported when the first client is created, not with this module.
+if TYPE_CHECKING:
+    from edgedb import AsyncIOClient as EdgeDBAsyncClient
+    from edgedb import Client as EdgeDBClient
+    from edgedb import Object as EdgeDBObject
+    from edgedb.asyncio_client import AsyncIORetry
+    from edgedb.blocking_client import Iteration, Retry
+
+logger = logging.getLogger(__name__)
+
+_shared: dict[tuple[str, str, str], Any] = {}
+_shared_lock = threading.Lock()
+_connections: dict[tuple, 'BaseEdgeDBConnection'] = {}
+_connections_lock = threading.Lock()
+
+ClientT = TypeVar('ClientT')
+
+# (qry, args, kwargs, jsonify, required_single); trailing items may be omitted.
+QuerySpec = str | tuple
+
+# 'resource' caches the result objects themselves, shared by every session;
+# 'data' caches immutable snapshots that are decoded into fresh copies on read.
+Storage = Literal['resource', 'data']
+
 
 class WrongQueryParamsError(Exception):
     pass
@@ -33,11 +118,201 @@ def match_func_name(jsonify=False, required_single=None):
     return func_name
 
 
-class EdgeDBConnection(ExperimentalBaseConnection[EdgeDBClient], AbstractContextManager):
+def unpack_query_spec(spec: QuerySpec) -> tuple[str, tuple, dict, bool, bool | None]:
+    '''
+    Fill in the defaults of a `(qry, args, kwargs, jsonify, required_single)`
+    query spec. A bare string is a query without arguments.
+    '''
+    if isinstance(spec, str):
+        spec = (spec,)
+    defaults = ((), {}, False, None)
+    if not 1 <= len(spec) <= len(defaults) + 1:
+        raise WrongQueryParamsError(
+            f'{spec} must be (qry, args, kwargs, jsonify, required_single)')
+    qry, args, kwargs, jsonify, required_single = (
+        *spec, *defaults[len(spec) - 1:])
+    return qry, tuple(args), dict(kwargs), jsonify, required_single
+
+
+def _get_shared(kind: str, connection_name: str, dsn: str, factory):
+    key = (kind, connection_name, dsn)
+    with _shared_lock:
+        if key not in _shared:
+            _shared[key] = factory()
+        return _shared[key]
+
+
+def get_result_cache(connection_name: str,
+                     dsn: str,
+                     backend: str = 'memory',
+                     path: str | None = None,
+                     **kwargs) -> ResultCache | SQLiteResultCache:
+    '''
+    Result caches live at module level, keyed by connection name and dsn,
+    so they survive Streamlit reruns that build a new connection object.
+    The `'sqlite'` backend also survives restarts, and is shared by the
+    processes using the same file.
+    The cache options only take effect when the cache is first created.
+    '''
+    def factory():
+        match backend:
+            case 'memory':
+                return ResultCache(**kwargs)
+            case 'sqlite':
+                if path is not None:
+                    kwargs['path'] = path
+                return SQLiteResultCache(
+                    namespace=cache_namespace(connection_name, dsn), **kwargs)
+            case _:
+                raise WrongQueryParamsError(
+                    f"{backend} must be 'memory'/'sqlite'")
+    return _get_shared('cache', connection_name, dsn, factory)
+
+
+def get_instrumentation(connection_name: str, dsn: str, **kwargs) -> Instrumentation:
+    '''
+    Like the result caches, query stats are shared by the connections with
+    the same name and dsn. The options only take effect when they are first
+    created.
+    '''
+    return _get_shared('instrumentation', connection_name, dsn,
+                       lambda: Instrumentation(**kwargs))
+
+
+def get_slow_query_log(connection_name: str, dsn: str, **kwargs) -> SlowQueryLog:
+    '''
+    The slow query log is shared like the query stats it is fed from. Its
+    options only take effect when it is first created.
+    '''
+    instrumentation = get_instrumentation(connection_name, dsn)
+
+    def factory():
+        log = instrumentation.slow_log = SlowQueryLog(**kwargs)
+        return log
+    return _get_shared('slow_query_log', connection_name, dsn, factory)
+
+
+def get_single_flight(connection_name: str, dsn: str) -> SingleFlight:
+    '''
+    Identical reads are coalesced across all the connections with the same
+    name and dsn, i.e. across Streamlit sessions.
+    '''
+    return _get_shared('single_flight', connection_name, dsn, SingleFlight)
+
+
+def get_refresher(connection_name: str, dsn: str, **kwargs) -> Refresher:
+    '''
+    The background refreshes of stale entries are run by one thread pool per
+    result cache. Its options only take effect when it is first created.
+    '''
+    return _get_shared('refresher', connection_name, dsn,
+                       lambda: Refresher(**kwargs))
+
+
+def get_admission(connection_name: str, dsn: str, **kwargs) -> Admission:
+    '''
+    The in-flight calls are bounded across all the connections with the same
+    name and dsn. The options only take effect when it is first created.
+    '''
+    return _get_shared('admission', connection_name, dsn,
+                       lambda: Admission(**kwargs))
+
+
+def get_watcher(connection_name: str, dsn: str, **kwargs) -> Watcher:
+    '''
+    Watched queries are polled once for all the sessions of the connections
+    with the same name and dsn. The options only take effect when it is
+    first created.
+    '''
+    return _get_shared('watcher', connection_name, dsn, lambda: Watcher(**kwargs))
+
+
+def get_recent_writes(connection_name: str, dsn: str, **kwargs) -> RecentWrites:
+    '''
+    The recent writes are tracked across all the connections with the same
+    name and dsn, like the cache they invalidate. The options only take
+    effect when it is first created.
+    '''
+    return _get_shared('recent_writes', connection_name, dsn,
+                       lambda: RecentWrites(**kwargs))
+
+
+def get_health_checker(connection_name: str, dsn: str, **kwargs) -> HealthChecker:
+    '''
+    The health status is cached and polled once per server, whatever the
+    number of sessions checking it.
+    '''
+    return _get_shared('health', connection_name, dsn,
+                       lambda: HealthChecker(**kwargs))
+
+
+class BaseEdgeDBConnection(ExperimentalBaseConnection[ClientT], AbstractContextManager):
+    '''
+    The dsn handling, result caching and invalidation shared by the blocking
+    and the asyncio connections.
+    '''
     _ENV_EDGEDB_DSN = 'EDGEDB_DSN'
+    _ENV_EDGEDB_READ_DSNS = 'EDGEDB_READ_DSNS'
 
     def __init__(self, connection_name: str = "edgedb_conn", **kwargs) -> None:
         super().__init__(connection_name, **kwargs)
+        self._health_client_lock = threading.Lock()
+        self._bind(self._dsn)
+
+    def _bind(self, dsn: str) -> None:
+        '''
+        Attach the result cache, stats, single flights, refresher, replicas
+        and admission kept per connection name and `dsn`.
+        '''
+        name, kwargs = self._connection_name, self._kwargs
+        self._bound_dsn = dsn
+        cache_kwargs = {option: kwargs[f'cache_{option}']
+                        for option in ('max_entries', 'max_bytes', 'backend', 'path')
+                        if f'cache_{option}' in kwargs}
+        self._cache = get_result_cache(name, dsn, **cache_kwargs)
+        self._instrumentation = get_instrumentation(
+            name, dsn,
+            **({'max_queries': kwargs['query_stats_size']}
+               if 'query_stats_size' in kwargs else {}))
+        if 'slow_query_threshold' in kwargs:
+            log = get_slow_query_log(
+                name, dsn,
+                threshold=kwargs['slow_query_threshold'],
+                maxlen=kwargs.get('slow_query_log_size', 100))
+            if kwargs.get('slow_query_explain', False):
+                log.explain = self._explain_in_background
+        self._flights = self._make_flights()
+        self._refresher = self._make_refresher()
+        self._dependents: dict[str, frozenset[str]] | None = None
+        self._health_client: ClientT | None = None
+        self._router = self._make_router()
+        self._recent_writes = get_recent_writes(
+            name, dsn, window=kwargs.get('replica_lag', 5.0))
+        self._admission = self._make_admission()
+        # Whether client calls run as is, without routing, admission or deadline.
+        self._passthrough = self._router is None and self._admission is None \
+            and kwargs.get('query_timeout') is None
+
+    def _make_flights(self) -> SingleFlight | AsyncSingleFlight:
+        return get_single_flight(self._connection_name, self._dsn)
+
+    def _make_refresher(self) -> Refresher | AsyncRefresher:
+        return get_refresher(self._connection_name, self._dsn, **self._refresh_kwargs)
+
+    def reset(self) -> None:
+        '''
+        Reconnect on next use. Streamlit also calls this when the secrets of
+        the connection change, and if the dsn changed with them, everything
+        kept per dsn is switched to the new one, so that the new database is
+        not read through the cache of the old one.
+        '''
+        super().reset()
+        if self._dsn != self._bound_dsn:
+            # Like the old client, the old replica clients are left to the
+            # sessions still using them.
+            if self._router is not None:
+                self._router.stop_polling()
+            self._bind(self._dsn)
 
     @property
     def _dsn(self) -> str:
@@ -48,64 +323,1361 @@ class EdgeDBConnection(ExperimentalBaseConnection[EdgeDBClient], AbstractContext
         '''
         return self._kwargs.get('dsn') or self._secrets[self._ENV_EDGEDB_DSN]
 
-    def _connect(self, **kwargs) -> EdgeDBClient:
-        return edgedb.create_client(dsn=self._dsn)
+    @property
+    def _read_dsns(self) -> list[str]:
+        '''
+        The read replicas, from the `read_dsns` kwarg or else the
+        `EDGEDB_READ_DSNS` secret, either a dsn or a list of them.
+        '''
+        dsns = self._kwargs.get('read_dsns') \
+            or self._secrets.get(self._ENV_EDGEDB_READ_DSNS) or ()
+        return [dsns] if isinstance(dsns, str) else list(dsns)
+
+    @abstractmethod
+    def _create_client(self, dsn: str, **options) -> ClientT:
+        '''
+        A client of `dsn`, with the pool options from `config` unless
+        overridden by `options`.
+        '''
+
+    def _connect(self, **kwargs) -> ClientT:
+        return self._create_client(self._dsn)
+
+    def _make_router(self) -> ReadRouter | None:
+        '''
+        Pass `read_balancing` to pick how reads are spread over the replicas,
+        and `replica_eject_time` to set how many seconds a failed replica is
+        left out.
+        '''
+        if not (dsns := self._read_dsns):
+            return None
+        balancing = self._kwargs.get('read_balancing', 'least_outstanding')
+        if balancing not in BALANCINGS:
+            raise WrongQueryParamsError(
+                f"{balancing} must be 'least_outstanding'/'round_robin'")
+        return ReadRouter([(replica_name(dsn), self._create_client(dsn))
+                           for dsn in dsns],
+                          balancing=balancing,
+                          eject_time=self._kwargs.get('replica_eject_time', 30.0))
+
+    def _replica_for(self, info: StatementInfo) -> Replica | None:
+        '''
+        The replica to run a read on, or None to run it on the primary: for
+        writes, when no replica is up, and for the reads of types written
+        less than `replica_lag` seconds (5 by default) ago, which the
+        replicas may not have caught up with yet.
+        '''
+        router = self._router
+        if router is None or info.is_mutation \
+                or self._recent_writes.overlaps(info.reads or frozenset({WILDCARD})):
+            return None
+        return router.acquire()
+
+    def replicas(self) -> list[ReplicaStatus]:
+        '''
+        The reads in flight and served by each replica, and whether it is
+        currently ejected.
+        '''
+        return [] if self._router is None else self._router.statuses()
 
     @property
-    def client(self) -> EdgeDBClient:
+    def config(self) -> EdgeDBConfig:
+        '''
+        The validated pool, timeout and retry settings, read from the
+        connection secrets and overridden by the connection kwargs.
+        '''
+        return EdgeDBConfig.from_sources(self._secrets, self._kwargs)
+
+    @property
+    def client(self) -> ClientT:
         return self._instance
 
+    def pool_stats(self) -> PoolStats:
+        return pool_stats(self.client)
+
+    @property
+    def cache(self) -> ResultCache | SQLiteResultCache:
+        return self._cache
+
+    @property
+    def instrumentation(self) -> Instrumentation:
+        return self._instrumentation
+
+    def query_stats(self) -> list[QueryStats]:
+        '''
+        Per-query call counts, wall/client/decode times, result sizes, cache
+        hits and retries, slowest queries first, for the last
+        `query_stats_size` (default 1000) queries recorded.
+        '''
+        return self._instrumentation.stats()
+
+    def add_hook(self, hook: Callable[[QueryEvent], None]) -> None:
+        '''
+        Call `hook` with a `QueryEvent` after every query, execute and
+        transaction, e.g. `prometheus_hook()` or `opentelemetry_hook()`.
+        '''
+        self._instrumentation.add_hook(hook)
+
+    def remove_hook(self, hook: Callable[[QueryEvent], None]) -> None:
+        self._instrumentation.remove_hook(hook)
+
+    def slow_queries(self) -> list[SlowQuery]:
+        '''
+        The calls slower than `slow_query_threshold` seconds, latest first,
+        among the last `slow_query_log_size` (default 100). With
+        `slow_query_explain=True`, slow reads also get their `analyze` plan,
+        run in the background with the same arguments.
+        '''
+        log = self._instrumentation.slow_log
+        return [] if log is None else log.entries()
+
+    @abstractmethod
+    def _explain_in_background(self, qry: str, args: tuple, kwargs: dict) -> Plan:
+        ...
+
+    @property
+    def _admission_kwargs(self) -> dict[str, Any] | None:
+        '''
+        Pass `max_in_flight` to bound the concurrent client calls. Up to
+        `max_queued` more calls (`max_in_flight` by default) wait at most
+        `queue_timeout` seconds (5 by default) for a slot, and the others
+        fail at once with `OverloadedError`.
+        '''
+        if self._kwargs.get('max_in_flight') is None:
+            return None
+        return {name: self._kwargs[name]
+                for name in ('max_in_flight', 'max_queued', 'queue_timeout')
+                if name in self._kwargs}
+
+    def _make_admission(self) -> Admission | None:
+        if (admission_kwargs := self._admission_kwargs) is None:
+            return None
+        return get_admission(self._connection_name, self._dsn, **admission_kwargs)
+
+    def admission_stats(self) -> AdmissionStats | None:
+        '''
+        The calls in flight and queued, and how many were admitted or
+        rejected, when `max_in_flight` is set.
+        '''
+        return None if self._admission is None else self._admission.stats()
+
+    def _admit(self, deadline: float | None):
+        if self._admission is None:
+            return nullcontext()
+        return self._admission.admit(deadline)
+
+    def _deadline(self, timeout: float | timedelta | None) -> float | None:
+        '''
+        Pass `query_timeout` to give every call a default `timeout`.
+        '''
+        if timeout is None:
+            timeout = self._kwargs.get('query_timeout')
+        return deadline_after(timeout)
+
+    @property
+    def _watcher(self) -> Watcher:
+        '''
+        Pass `watch_idle_timeout` to set after how many seconds without any
+        session watching it a query stops being polled.
+        '''
+        options = {}
+        if 'watch_idle_timeout' in self._kwargs:
+            options['idle_timeout'] = self._kwargs['watch_idle_timeout']
+        return get_watcher(self._connection_name, self._dsn, **options)
+
+    @abstractmethod
+    def _poll(self, func_name: str, qry: str, args: tuple, kwargs: dict):
+        ...
+
+    def get_watch(self,
+                  qry: str,
+                  *args,
+                  interval: float = 5.0,
+                  jsonify: bool = False,
+                  required_single: bool | None = None,
+                  **kwargs) -> Watch:
+        '''
+        The poller of a read and its arguments, shared by every session, e.g.
+        to `subscribe` to its changes.
+        '''
+        if classify(qry).is_mutation:
+            raise WrongQueryParamsError(
+                f'{qry} is a mutation; only reads can be watched')
+        func_name = match_func_name(jsonify, required_single)
+        return self._watcher.watch(make_key(func_name, qry, args, kwargs), qry,
+                                   partial(self._poll, func_name, qry, args, kwargs),
+                                   interval)
+
+    def watch(self,
+              qry: str,
+              *args,
+              interval: float = 5.0,
+              jsonify: bool = False,
+              required_single: bool | None = None,
+              rerun: bool = True,
+              **kwargs) -> 'JSONResult | EdgeDBObject':
+        '''
+        Return the latest result of a read that is polled every `interval`
+        seconds in the background, once for every session watching it. In a
+        Streamlit script, the app reruns when the result changes, and only
+        then, unless `rerun=False`.
+        '''
+        watch = self.get_watch(qry, *args, interval=interval, jsonify=jsonify,
+                               required_single=required_single, **kwargs)
+        result, version = watch.latest()
+        if rerun:
+            rerun_on_change(watch, version)
+        return result
+
+    def watches(self) -> list[Watch]:
+        return self._watcher.watches()
+
+    @property
+    def _refresh_kwargs(self) -> dict[str, int]:
+        '''
+        Pass `refresh_workers` to cap the concurrent background refreshes.
+        '''
+        if 'refresh_workers' in self._kwargs:
+            return {'max_workers': self._kwargs['refresh_workers']}
+        return {}
+
+    def _lookup(self, func_name, qry, args, kwargs, ttl, probe: Probe | None = None):
+        '''
+        Classify the query and look it up in the cache, and tell whether the
+        cached result is stale. Mutations and `ttl=0` always miss.
+        '''
+        info = classify(qry)
+        key = make_key(func_name, qry, args, kwargs)
+        if info.is_mutation or ttl == 0:
+            return info, key, MISSING, False
+        result, stale = self._cache.lookup(key)
+        if isinstance(result, Snapshot):
+            if probe is None:
+                result = result.thaw()
+            else:
+                with probe.decode():
+                    result = result.thaw()
+        return info, key, result, stale
+
+    def _follow(self, key, result, probe: Probe):
+        '''
+        The result of a read coalesced into another caller's query. It is
+        read back from the cache when it was stored there, so that
+        `storage='data'` still hands out a copy per caller. The read was
+        already counted as a miss, so it is not counted again.
+        '''
+        cached = self._cache._peek(key)
+        if isinstance(cached, Snapshot):
+            with probe.decode():
+                cached = cached.thaw()
+        return probe.done(result if cached is MISSING else cached, coalesced=True)
+
+    def _store(self,
+               info: StatementInfo,
+               key,
+               result,
+               ttl,
+               storage: Storage | None = None,
+               soft_ttl: float | timedelta | None = None,
+               generation: tuple[int, ...] | None = None) -> None:
+        '''
+        Cache a read result. Past `soft_ttl`, it is still served while being
+        refreshed in the background, until it expires after `ttl`. The result
+        is dropped if the types it read were invalidated since `generation`,
+        taken by `_generation` before the read.
+        '''
+        if info.is_mutation:
+            return
+        match storage or self._kwargs.get('storage', 'resource'):
+            case 'resource':
+                pass
+            case 'data':
+                result = Snapshot(result)
+            case storage:
+                raise WrongQueryParamsError(
+                    f"{storage} must be 'resource'/'data'")
+        if soft_ttl is None:
+            soft_ttl = self._kwargs.get('soft_ttl')
+        self._cache.set(key, result, ttl=ttl,
+                        tags=info.reads or frozenset({WILDCARD}),
+                        soft_ttl=soft_ttl,
+                        generation=generation)
+
+    def _generation(self, info: StatementInfo) -> tuple[int, ...] | None:
+        if info.is_mutation:
+            return None
+        return self._cache.generation(info.reads or frozenset({WILDCARD}))
+
+    @property
+    def _schema_aware(self) -> bool:
+        '''
+        Pass `schema_aware_invalidation=False` to match type names only.
+        '''
+        return self._kwargs.get('schema_aware_invalidation', True)
+
+    def _load_dependents(self, raw_schema: str) -> dict[str, frozenset[str]]:
+        try:
+            self._dependents = build_dependents(json.loads(raw_schema))
+        except (ValueError, TypeError, KeyError):
+            return {}
+        return self._dependents
+
+    def _invalidate(self,
+                    types: frozenset[str],
+                    dependents: dict[str, frozenset[str]]) -> int:
+        if WILDCARD in types:
+            self._dependents = None
+            affected = types
+        else:
+            affected = frozenset().union(
+                *(dependents.get(t, frozenset({t})) for t in types))
+        self._recent_writes.add(affected)
+        return self._cache.invalidate_tags(affected)
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
+
+    def _status_urls(self, path: str) -> list[str]:
+        """https://www.edgedb.com/docs/guides/deployment/health_checks#health-checks"""
+        from yarl import URL
+
+        url = URL(self._dsn)
+        return [f'http{s}://{url.host}:{url.port}{path}' for s in ('', 's')]
+
+    @property
+    def _status_alive_urls(self):
+        return self._status_urls(ALIVE_PATH)
+
+    @property
+    def _health(self) -> HealthChecker:
+        '''
+        Pass `health_ttl` to set how long a status is cached, and
+        `health_timeout` to bound a check, both in seconds.
+        '''
+        options = {name: self._kwargs[f'health_{name}']
+                   for name in ('ttl', 'timeout')
+                   if f'health_{name}' in self._kwargs}
+        return get_health_checker(self._connection_name, self._dsn,
+                                  alive_urls=self._status_alive_urls,
+                                  ready_urls=self._status_urls(READY_PATH),
+                                  **options)
+
+    @abstractmethod
+    def _ping_client(self, client: ClientT) -> None:
+        ...
+
+    def _ping(self) -> None:
+        '''
+        Ping from a one-connection client of its own, which gives up after
+        `health_timeout` instead of the pool's `wait_until_available`, and
+        takes no connection from the queries.
+        '''
+        with self._health_client_lock:
+            if self._health_client is None:
+                timeout = self._health.timeout
+                self._health_client = self._create_client(
+                    self._dsn, max_concurrency=1, timeout=timeout,
+                    wait_until_available=timeout)
+            client = self._health_client
+        self._ping_client(client)
+
+    def health(self, max_age: float | None = None) -> HealthStatus:
+        '''
+        Whether the server is alive and ready, over http(s), and answers over
+        the binary protocol. The status is cached for `health_ttl` seconds, or
+        `max_age` if given, so this usually returns without any request.
+        '''
+        return self._health.check(self._ping, max_age=max_age)
+
+    def is_healthy(self) -> bool:
+        return self.health().alive
+
+    def start_health_polling(self, interval: float = 5.0) -> None:
+        '''
+        Refresh the health status every `interval` seconds in the background.
+        '''
+        self._health.start_polling(interval, self._ping)
+        if self._router is not None:
+            self._router.start_polling(interval, self._ping_client,
+                                       timeout=self._health.timeout)
+
+    def stop_health_polling(self) -> None:
+        self._health.stop_polling()
+        if self._router is not None:
+            self._router.stop_polling()
+
+    def check_replicas(self) -> list[ReplicaStatus]:
+        '''
+        Ping every replica with `SELECT 1`, eject the ones that fail and
+        readmit the others. `start_health_polling` runs this in the background.
+        '''
+        if self._router is None:
+            return []
+        return self._router.check(self._ping_client, timeout=self._health.timeout)
+
+
+class EdgeDBConnection(BaseEdgeDBConnection['EdgeDBClient']):
+    def _create_client(self, dsn: str, **options) -> 'EdgeDBClient':
+        import edgedb
+
+        config = self.config
+        return config.apply(
+            edgedb.create_client(dsn=dsn, **(config.client_kwargs | options)))
+
+    def _call(self,
+              client: 'EdgeDBClient',
+              func_name: str,
+              qry: str,
+              args: tuple,
+              kwargs: dict,
+              deadline: float | None):
+        '''
+        With a deadline, the server is told to cancel the query once the
+        time left runs out.
+        '''
+        if deadline is not None:
+            client = client.with_config(
+                query_execution_timeout=timedelta(seconds=remaining(deadline)))
+        return getattr(client, func_name)(qry, *args, **kwargs)
+
+    def _read(self,
+              info: StatementInfo,
+              func_name: str,
+              qry: str,
+              args: tuple,
+              kwargs: dict,
+              deadline: float | None = None):
+        '''
+        Run a read on the replica picked by `_replica_for`, or else on the
+        primary. A replica that fails to answer is ejected and the read is
+        retried on the primary.
+        '''
+        with self._admit(deadline):
+            router = self._router
+            replica = self._replica_for(info)
+            if replica is not None:
+                try:
+                    return self._call(replica.client, func_name, qry, args, kwargs,
+                                      deadline)
+                except deadline_errors():
+                    # The caller ran out of time, which says nothing about
+                    # the replica, and leaves none for the primary.
+                    raise
+                except replica_errors() as e:
+                    logger.warning('Replica %s failed, ejecting it: %s',
+                                   replica.name, e)
+                    router.eject(replica, e)
+                finally:
+                    router.release(replica)
+            return self._call(self.client, func_name, qry, args, kwargs, deadline)
+
     def query(self,
               qry: str,
               *args,
-              ttl: int | None = None,
+              ttl: float | timedelta | None = None,
               jsonify: bool = False,
               required_single: bool | None = None,
-              **kwargs) -> str | EdgeDBObject:
+              storage: Storage | None = None,
+              soft_ttl: float | timedelta | None = None,
+              timeout: float | timedelta | None = None,
+              **kwargs) -> 'JSONResult | EdgeDBObject':
         func_name = match_func_name(jsonify, required_single)
-        mutated_kws = ('insert', 'update', 'delete')
-        is_mutated = any(mutated_kw in qry.casefold()
-                         for mutated_kw in mutated_kws)
-        if is_mutated:
-            ttl = 0
+        with self._instrumentation.probe('query', func_name, qry,
+                                         args, kwargs) as probe:
+            info, key, result, stale = self._lookup(
+                func_name, qry, args, kwargs, ttl, probe)
+            deadline = self._deadline(timeout)
+
+            def _fetch(probe: Probe = probe, deadline: float | None = deadline):
+                generation = self._generation(info)
+                with probe.client():
+                    result = wrap_json(func_name, self._read(
+                        info, func_name, qry, args, kwargs, deadline))
+                if info.is_mutation:
+                    self.invalidate(info.writes)
+                self._store(info, key, result, ttl, storage, soft_ttl, generation)
+                return result
+
+            if result is not MISSING:
+                if stale:
+                    self._revalidate(key, func_name, qry, _fetch, args, kwargs)
+                return probe.done(result, cache_hit=True)
+
+            with st.spinner('Executing your query...'):
+                if info.is_mutation:
+                    return probe.done(_fetch())
+                # Concurrent identical reads wait for the first one, at most
+                # until their own deadline.
+                result, shared = self._flights.do(key, _fetch, deadline)
+            if shared:
+                return self._follow(key, result, probe)
+            return probe.done(result)
+
+    def query_df(self,
+                 qry: str,
+                 *args,
+                 ttl: float | timedelta | None = None,
+                 engine: Literal['pandas', 'arrow'] = 'pandas',
+                 **kwargs):
+        '''
+        Run a query and return its result set as a pandas DataFrame, or a
+        pyarrow Table with `engine='arrow'`. The converted frame is cached in
+        place of the result set, so reruns skip the conversion; treat it as
+        read-only since it is shared by every session.
+        '''
+        if unsupported := {'jsonify', 'required_single'} & kwargs.keys():
+            raise TypeError(
+                f"query_df() got unsupported arguments {sorted(unsupported)}: "
+                "it always converts the whole result set")
+        match engine:
+            case 'pandas':
+                convert = to_dataframe
+            case 'arrow':
+                convert = to_arrow
+            case _:
+                raise WrongQueryParamsError(f"{engine} must be 'pandas'/'arrow'")
+        func_name = f'query_df_{engine}'
+        with self._instrumentation.probe('query', func_name, qry,
+                                         args, kwargs) as probe:
+            info, key, frame, _ = self._lookup(func_name, qry, args, kwargs, ttl)
+            if frame is not MISSING:
+                return probe.done(frame, cache_hit=True)
+
+            generation = self._generation(info)
+            result = self.query(qry, *args, ttl=0, **kwargs)
+            with probe.decode():
+                frame = convert(result)
+            self._store(info, key, frame, ttl, storage='resource',
+                        generation=generation)
+            return probe.done(frame)
+
+    def query_many(self,
+                   specs: Sequence[QuerySpec],
+                   ttl: float | timedelta | None = None,
+                   max_workers: int | None = None,
+                   timeout: float | timedelta | None = None) -> list:
+        '''
+        Run independent `(qry, args, kwargs, jsonify, required_single)` read
+        specs and return their results in order. Cached results are served
+        directly, and the misses run concurrently on a thread pool sized to the
+        client's `max_concurrency` unless `max_workers` is given. `timeout`
+        applies to each query.
+        '''
+        results = []
+        misses = []
+        for spec in specs:
+            qry, args, kwargs, jsonify, required_single = unpack_query_spec(spec)
+            func_name = match_func_name(jsonify, required_single)
+            with self._instrumentation.probe('query', func_name, qry,
+                                             args, kwargs) as probe:
+                info, key, result, _ = self._lookup(
+                    func_name, qry, args, kwargs, ttl, probe)
+                if info.is_mutation:
+                    raise WrongQueryParamsError(
+                        f'{qry} is a mutation; query_many only runs reads')
+                if result is MISSING:
+                    # Recorded by the call in `_query` instead.
+                    probe.discard()
+                    misses.append(
+                        (len(results), func_name, qry, args, kwargs, info, key))
+                else:
+                    probe.done(result, cache_hit=True)
+            results.append(result)
+        if not misses:
+            return results
 
-        @st.cache_resource(ttl=ttl, show_spinner='Executing your query...')
-        def _query(func_name, qry, *args, **kwargs):
-            # print(f'_query called, {ttl=}')  # For DEBUG
-            return getattr(self.client, func_name)(qry, *args, **kwargs)
+        def _query(miss):
+            _, func_name, qry, args, kwargs, info, key = miss
+            deadline = self._deadline(timeout)
+
+            def _fetch():
+                generation = self._generation(info)
+                with probe.client():
+                    result = wrap_json(func_name, self._read(
+                        info, func_name, qry, args, kwargs, deadline))
+                self._store(info, key, result, ttl, generation=generation)
+                return result
+
+            with self._instrumentation.probe('query', func_name, qry,
+                                             args, kwargs) as probe:
+                result, shared = self._flights.do(key, _fetch, deadline)
+                if shared:
+                    return self._follow(key, result, probe)
+                return probe.done(result)
+
+        with st.spinner('Executing your queries...'):
+            if max_workers is None:
+                # The pool is sized from the server's suggestion on connect.
+                self.client.ensure_connected()
+                max_workers = self.client.max_concurrency
+            with ThreadPoolExecutor(min(max_workers, len(misses))) as pool:
+                fetched = list(pool.map(_query, misses))
+        for (i, *_), result in zip(misses, fetched):
+            results[i] = result
+        return results
+
+    def iter_query(self,
+                   qry: str,
+                   *args,
+                   page_size: int = 100,
+                   keyset: bool = False,
+                   ttl: float | timedelta | None = None,
+                   jsonify: bool = False,
+                   **kwargs) -> Iterator[list | str]:
+        '''
+        Yield the results of a read query page by page, each page being a
+        separately cached `query()` call, kept for `ttl` like any other.
+        Pages are fetched lazily, so the first page renders before the rest
+        are read.
+
+        By default pages are cut with OFFSET/LIMIT and keep the query's
+        ordering; give it an ORDER BY, since without one the database returns
+        the results in no fixed order and pages may overlap. `keyset=True`
+        pages on `.id` instead, which stays fast for deep pages but orders the
+        results by `.id`; with `jsonify=True` the query shape must then
+        include `id`.
+        '''
+        if page_size < 1:
+            raise WrongQueryParamsError(f'{page_size} must be a positive integer')
+        if classify(qry).is_mutation:
+            raise WrongQueryParamsError(
+                f'{qry} is a mutation; iter_query only runs reads')
+        offset, after_id = 0, None
+        while True:
+            page_qry = paginate(qry, page_size, offset=offset, after_id=after_id,
+                                keyset=keyset)
+            page = self.query(page_qry, *args, ttl=ttl, jsonify=jsonify, **kwargs)
+            rows = page.data if jsonify else page
+            if rows:
+                yield page
+            if len(rows) < page_size:
+                return
+            offset += page_size
+            if keyset:
+                last = rows[-1]
+                after_id = last['id'] if jsonify else str(last.id)
+
+    def prepare(self,
+                qry: str,
+                jsonify: bool = False,
+                required_single: bool | None = None) -> 'PreparedQuery':
+        '''
+        Return a reusable callable for a query that is run on every rerun,
+        with the dispatch, classification and cache key prefix worked out once:
+
+            get_movie = conn.prepare('SELECT Movie {title} FILTER .title = <str>$title;',
+                                     required_single=False)
+            movie = get_movie(title='John Wick', ttl=60)
+        '''
+        return PreparedQuery(self, qry, jsonify, required_single)
+
+    def _revalidate(self, key, func_name: str, qry: str,
+                    fetch: Callable[[Probe], Any],
+                    args: tuple = (),
+                    kwargs: dict | None = None) -> None:
+        '''
+        Refresh a stale cache entry in the background. The refresh is
+        coalesced with any reads of the same key missing the cache meanwhile.
+        It only has the `query_timeout` deadline, if any, not the one of the
+        read that found the entry stale.
+        '''
+        def _refresh():
+            deadline = self._deadline(None)
+            with self._instrumentation.probe('refresh', func_name, qry,
+                                             args, kwargs) as probe:
+                return probe.done(self._flights.do(
+                    key, partial(fetch, probe, deadline=deadline), deadline)[0])
 
-        return _query(func_name, qry, *args, **kwargs)
+        self._refresher.submit(key, _refresh)
 
-    def execute(self, qry) -> None:
-        return self.client.execute(qry)
+    def _poll(self, func_name: str, qry: str, args: tuple, kwargs: dict):
+        with self._instrumentation.probe('watch', func_name, qry,
+                                         args, kwargs) as probe:
+            with probe.client():
+                result = wrap_json(func_name, self._read(
+                    classify(qry), func_name, qry, args, kwargs,
+                    self._deadline(None)))
+            return probe.done(result)
+
+    def explain(self,
+                qry: str,
+                *args,
+                timeout: float | timedelta | None = None,
+                **kwargs) -> Plan:
+        '''
+        Run the query under EdgeDB's `analyze` and return its plan tree with
+        the time spent in every node. The query is really run, so only
+        explain writes you want applied.
+        '''
+        with self._instrumentation.probe('explain', 'query_required_single',
+                                         qry, args, kwargs) as probe:
+            deadline = self._deadline(timeout)
+            with probe.client(), self._admit(deadline):
+                output = self._call(self.client, 'query_required_single',
+                                    analyze_query(qry), args, kwargs, deadline)
+            with probe.decode():
+                return probe.done(parse_plan(qry, output))
+
+    def _explain_in_background(self, qry: str, args: tuple, kwargs: dict) -> Plan:
+        return self.explain(qry, *args, **kwargs)
+
+    def execute(self, qry, timeout: float | timedelta | None = None) -> None:
+        with self._instrumentation.probe('execute', 'execute', qry) as probe:
+            deadline = self._deadline(timeout)
+            with probe.client(), self._admit(deadline):
+                result = self._call(self.client, 'execute', qry, (), {}, deadline)
+            info = classify(qry)
+            if info.is_mutation:
+                self.invalidate(info.writes)
+            return result
+
+    def bulk_insert(self,
+                    type_name: str,
+                    rows: Iterable[Mapping[str, Any]],
+                    chunk_size: int = 1000,
+                    casts: Mapping[str, str] | None = None,
+                    max_workers: int = 1) -> int:
+        '''
+        Insert one `type_name` object per row of property values, `chunk_size`
+        rows per `FOR ... IN json_array_unpack(...)` statement, and return how
+        many were inserted:
+
+            conn.bulk_insert('Movie', [{'title': 'Dune', 'release_year': 2021}])
+
+        `rows` can also be a pandas DataFrame. The casts are inferred from the
+        Python values, e.g. `int` to `int64`, unless given in `casts`. Each
+        chunk runs in a transaction that is retried like `transaction()`, and
+        with `max_workers > 1` several chunks run at once, so when one fails
+        the others may still be committed.
+        '''
+        if chunk_size < 1:
+            raise WrongQueryParamsError(f'{chunk_size} must be a positive integer')
+        if max_workers < 1:
+            raise WrongQueryParamsError(f'{max_workers} must be a positive integer')
+        casts = dict(casts or {})
+        invalid = [name for name in (type_name, *casts.values())
+                   if not is_name(name, qualified=True)]
+        invalid += [name for name in casts if not is_name(name)]
+        if invalid:
+            raise WrongQueryParamsError(f'{invalid} are not valid EdgeQL names')
+        if hasattr(rows, 'to_dict'):
+            rows = rows.astype(object).where(rows.notna(), None).to_dict('records')
+
+        def _insert(chunk):
+            chunk_casts = infer_casts(chunk, casts)
+            if invalid := [name for name in chunk_casts if not is_name(name)]:
+                raise WrongQueryParamsError(f'{invalid} are not valid EdgeQL names')
+            qry = insert_query(type_name, tuple(sorted(
+                (name, cast) for name, cast in chunk_casts.items() if cast)))
+            data = encode_rows(chunk)
+            with self._instrumentation.probe('bulk_insert', 'query_required_single',
+                                             qry) as probe:
+                for attempt, tx in enumerate(self.client.transaction()):
+                    probe.retries = attempt
+                    with tx, probe.client():
+                        inserted = tx.query_required_single(qry, data=data)
+                probe.done(chunk)
+                return inserted
+
+        with st.spinner('Inserting your rows...'):
+            try:
+                if max_workers == 1:
+                    return sum(map(_insert, chunked(rows, chunk_size)))
+                with ThreadPoolExecutor(max_workers) as pool:
+                    return sum(pool.map(_insert, chunked(rows, chunk_size)))
+            finally:
+                self.invalidate(frozenset({strip_module(type_name)}))
+
+    def invalidate(self, types: frozenset[str]) -> int:
+        '''
+        Drop the cached results that may depend on any of the given object
+        types, and return how many were dropped.
+        A `WILDCARD` type drops everything and forgets the introspected schema.
+        '''
+        dependents = {} if WILDCARD in types else self._schema_dependents()
+        return self._invalidate(types, dependents)
+
+    def _schema_dependents(self) -> dict[str, frozenset[str]]:
+        '''
+        Introspect the schema once, so that writing a type also drops the
+        cached reads of its ancestors, descendants and the types linking to it.
+        '''
+        if not self._schema_aware:
+            return {}
+        if self._dependents is None:
+            import edgedb
+
+            try:
+                return self._load_dependents(self.client.query_json(SCHEMA_QUERY))
+            except edgedb.EdgeDBError:
+                return {}
+        return self._dependents
+
+    def _ping_client(self, client: 'EdgeDBClient') -> None:
+        client.query_required_single('SELECT 1')
 
     def close(self) -> None:
+        if self._router is not None:
+            self._router.stop_polling()
+            for client in self._router.clients():
+                client.close()
+        if self._health_client is not None:
+            self._health_client.close()
         self.client.close()
 
-    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
-        self.close()
-
-    def transaction(self) -> Retry:
+    def transaction(self) -> 'Retry':
         return self.client.transaction()
 
-    def __call__(self) -> Iteration:
-        for tx in self.transaction():
-            with tx:
-                yield tx
+    def __call__(self, label: str = '') -> Iterator['Transaction']:
+        '''
+        Iterate over the attempts of a transaction, retried like
+        `client.transaction()`:
+
+            for tx in conn():
+                with tx:
+                    tx.query('INSERT Movie {title := <str>$0};', 'Dune')
+
+        Without the `with` block the attempt is committed when the loop moves
+        on, and rolled back if the loop body raises, but then only conflicts
+        on commit can be retried. Each transaction is recorded as one
+        'transaction' event under `label`, with its retries, backoff and
+        commit time.
+        '''
+        with self._instrumentation.probe('transaction', 'transaction',
+                                         label) as probe:
+            retry = self.transaction()
+            attempt = 0
+            while True:
+                with probe.backoff():
+                    try:
+                        iteration = next(retry)
+                    except StopIteration:
+                        return
+                probe.retries = attempt
+                attempt += 1
+                tx = Transaction(self, iteration, probe)
+                try:
+                    yield tx
+                except BaseException as e:
+                    if tx._implicit and tx._open:
+                        tx.__exit__(type(e), e, e.__traceback__)
+                    raise
+                if tx._implicit and tx._open:
+                    tx.__exit__(None, None, None)
+
+
+class PreparedQuery:
+    '''
+    A query bound to an `EdgeDBConnection`, created by `EdgeDBConnection.prepare`.
+    Calling it behaves like `conn.query(qry, *args, ttl=ttl, **kwargs)`, and
+    shares its cache entries, but skips the per-call parse and dispatch work.
+    '''
+    __slots__ = ('conn', 'qry', 'func_name', 'info', 'params',
+                 '_prefix', '_client', '_method')
+
+    def __init__(self,
+                 conn: EdgeDBConnection,
+                 qry: str,
+                 jsonify: bool = False,
+                 required_single: bool | None = None) -> None:
+        self.conn = conn
+        self.qry = qry
+        self.func_name = match_func_name(jsonify, required_single)
+        self.info = classify(qry)
+        self.params = parse_params(qry)
+        self._prefix = make_key_prefix(self.func_name, qry)
+        self._client = None
+        self._method = None
+
+    def __call__(self,
+                 *args,
+                 ttl: float | timedelta | None = None,
+                 storage: Storage | None = None,
+                 soft_ttl: float | timedelta | None = None,
+                 timeout: float | timedelta | None = None,
+                 **kwargs) -> 'JSONResult | EdgeDBObject':
+        if len(args) != self.params.positional \
+                or not kwargs.keys() <= self.params.named:
+            raise WrongQueryParamsError(
+                f'{self.qry} takes {self.params.positional} positional and '
+                f'{sorted(self.params.named)} named arguments')
+        conn = self.conn
+        key = (*self._prefix, freeze_arg(args), freeze_arg(kwargs))
+        with conn.instrumentation.probe('query', self.func_name,
+                                        self.qry, args, kwargs) as probe:
+            # Rebind if the connection was reset, e.g. after its secrets changed.
+            client = conn.client
+            if client is not self._client:
+                self._client, self._method = client, getattr(client, self.func_name)
+
+            deadline = conn._deadline(timeout)
+
+            def _fetch(probe: Probe = probe, deadline: float | None = deadline):
+                generation = conn._generation(self.info)
+                with probe.client():
+                    if conn._passthrough and deadline is None:
+                        result = self._method(self.qry, *args, **kwargs)
+                    else:
+                        result = conn._read(self.info, self.func_name,
+                                            self.qry, args, kwargs, deadline)
+                    result = wrap_json(self.func_name, result)
+                if self.info.is_mutation:
+                    conn.invalidate(self.info.writes)
+                conn._store(self.info, key, result, ttl, storage, soft_ttl,
+                            generation)
+                return result
+
+            if not self.info.is_mutation and ttl != 0:
+                result, stale = conn.cache.lookup(key)
+                if isinstance(result, Snapshot):
+                    with probe.decode():
+                        result = result.thaw()
+                if result is not MISSING:
+                    if stale:
+                        conn._revalidate(key, self.func_name, self.qry, _fetch,
+                                         args, kwargs)
+                    return probe.done(result, cache_hit=True)
+
+            with st.spinner('Executing your query...'):
+                if self.info.is_mutation:
+                    return probe.done(_fetch())
+                result, shared = conn._flights.do(key, _fetch, deadline)
+            if shared:
+                return conn._follow(key, result, probe)
+            return probe.done(result)
+
+
+class Transaction:
+    '''
+    One attempt of a transaction from `EdgeDBConnection.__call__`, with the
+    `query(jsonify=, required_single=)` dispatch of the connection. Its
+    queries bypass the result cache, since they must see the transaction's
+    own writes, and the types they write are invalidated on commit.
+    '''
+    __slots__ = ('conn', 'tx', 'writes', '_probe', '_implicit', '_open')
+
+    def __init__(self, conn: EdgeDBConnection, tx: 'Iteration', probe: Probe) -> None:
+        self.conn = conn
+        self.tx = tx
+        self.writes: set[str] = set()
+        self._probe = probe
+        # Entered by the first query rather than a `with` block.
+        self._implicit = False
+        self._open = False
+
+    def __enter__(self) -> 'Transaction':
+        self.tx.__enter__()
+        self._open = True
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> bool | None:
+        self._open = False
+        if exc_type is not None:
+            return self.tx.__exit__(exc_type, exc_val, exc_tb)
+        with self._probe.commit():
+            suppress = self.tx.__exit__(None, None, None)
+        if self.writes:
+            self.conn.invalidate(frozenset(self.writes))
+        return suppress
+
+    def _run(self, func_name: str, qry: str, *args, **kwargs):
+        if not self._open:
+            self.__enter__()
+            self._implicit = True
+        self.writes |= classify(qry).writes
+        with self.conn.instrumentation.probe('transaction_query', func_name,
+                                             qry, args, kwargs) as probe, \
+                probe.client(), self._probe.client():
+            return probe.done(wrap_json(
+                func_name, getattr(self.tx, func_name)(qry, *args, **kwargs)))
+
+    def query(self,
+              qry: str,
+              *args,
+              jsonify: bool = False,
+              required_single: bool | None = None,
+              **kwargs) -> 'JSONResult | EdgeDBObject':
+        return self._run(match_func_name(jsonify, required_single),
+                         qry, *args, **kwargs)
+
+    def execute(self, qry: str, *args, **kwargs) -> None:
+        self._run('execute', qry, *args, **kwargs)
+
+    def __getattr__(self, name: str):
+        # query_single, query_json, ... like edgedb's own transactions.
+        if name.startswith('query_'):
+            return partial(self._run, name)
+        raise AttributeError(name)
+
+
+class AsyncEdgeDBConnection(BaseEdgeDBConnection['EdgeDBAsyncClient']):
+    '''
+    An `EdgeDBConnection` backed by `edgedb.AsyncIOClient`, so independent
+    queries can run concurrently over the client pool.
+
+    The client is bound to the event loop it is first used on. Streamlit
+    scripts are synchronous, so use `run()` to drive the coroutines of this
+    connection on its own event loop thread:
+
+        conn = AsyncEdgeDBConnection()
+        movies, people = conn.run(conn.gather_queries([
+            'SELECT Movie {title};',
+            ('SELECT Person {name} FILTER .name = <str>$0;', ('Rhys Ifans',)),
+        ]))
+    '''
+
+    def __init__(self, connection_name: str = "edgedb_conn", **kwargs) -> None:
+        super().__init__(connection_name, **kwargs)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_lock = threading.Lock()
+
+    # asyncio futures and tasks are bound to this connection's event loop.
+    def _make_flights(self) -> AsyncSingleFlight:
+        return AsyncSingleFlight()
+
+    def _make_refresher(self) -> AsyncRefresher:
+        return AsyncRefresher(**self._refresh_kwargs)
+
+    def _make_admission(self) -> AsyncAdmission | None:
+        # Like the single flights, bound to this connection's event loop.
+        if (admission_kwargs := self._admission_kwargs) is None:
+            return None
+        return AsyncAdmission(**admission_kwargs)
+
+    def _create_client(self, dsn: str, **options) -> 'EdgeDBAsyncClient':
+        import edgedb
+
+        config = self.config
+        return config.apply(
+            edgedb.create_async_client(dsn=dsn, **(config.client_kwargs | options)))
 
     @property
-    def _status_alive_urls(self):
-        """https://www.edgedb.com/docs/guides/deployment/health_checks#health-checks"""
-        from yarl import URL
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever,
+                                 name='edgedb-conn-loop',
+                                 daemon=True).start()
+            return self._loop
 
-        url = URL(self._dsn)
-        return [f'http{s}://{url.host}:{url.port}/server/status/alive'
-                for s in ('', 's')]
-
-    def is_healthy(self):
-        import httpx
-        return any(httpx.get(url,
-                             follow_redirects=True,
-                             verify=False,
-                             timeout=30).status_code == 200
-                   for url in self._status_alive_urls)
+    def run(self, aw, timeout: float | None = None) -> Any:
+        '''
+        Run a coroutine on the event loop thread owned by this connection
+        and wait for its result.
+        '''
+        return asyncio.run_coroutine_threadsafe(aw, self.loop).result(timeout)
+
+    def _ping_client(self, client: 'EdgeDBAsyncClient') -> None:
+        self.run(client.query_required_single('SELECT 1'),
+                 timeout=self._health.timeout)
+
+    async def _call(self,
+                    client: 'EdgeDBAsyncClient',
+                    func_name: str,
+                    qry: str,
+                    args: tuple,
+                    kwargs: dict,
+                    deadline: float | None):
+        '''
+        With a deadline, the query is also cancelled on the client once the
+        time left runs out.
+        '''
+        if deadline is None:
+            return await getattr(client, func_name)(qry, *args, **kwargs)
+        left = remaining(deadline)
+        client = client.with_config(query_execution_timeout=timedelta(seconds=left))
+        try:
+            async with asyncio.timeout(left) as cm:
+                return await getattr(client, func_name)(qry, *args, **kwargs)
+        except TimeoutError:
+            if cm.expired():
+                raise DeadlineExceededError(f'{qry} ran out of time') from None
+            raise
+
+    async def _read(self,
+                    info: StatementInfo,
+                    func_name: str,
+                    qry: str,
+                    args: tuple,
+                    kwargs: dict,
+                    deadline: float | None = None):
+        async with self._admit(deadline):
+            router = self._router
+            replica = self._replica_for(info)
+            if replica is not None:
+                try:
+                    return await self._call(replica.client, func_name, qry, args,
+                                            kwargs, deadline)
+                except deadline_errors():
+                    raise
+                except replica_errors() as e:
+                    logger.warning('Replica %s failed, ejecting it: %s',
+                                   replica.name, e)
+                    router.eject(replica, e)
+                finally:
+                    router.release(replica)
+            return await self._call(self.client, func_name, qry, args, kwargs,
+                                    deadline)
+
+    async def query(self,
+                    qry: str,
+                    *args,
+                    ttl: float | timedelta | None = None,
+                    jsonify: bool = False,
+                    required_single: bool | None = None,
+                    storage: Storage | None = None,
+                    soft_ttl: float | timedelta | None = None,
+                    timeout: float | timedelta | None = None,
+                    **kwargs) -> 'JSONResult | EdgeDBObject':
+        func_name = match_func_name(jsonify, required_single)
+        with self._instrumentation.probe('query', func_name, qry,
+                                         args, kwargs) as probe:
+            info, key, result, stale = self._lookup(
+                func_name, qry, args, kwargs, ttl, probe)
+            deadline = self._deadline(timeout)
+
+            async def _fetch(probe: Probe = probe, deadline: float | None = deadline):
+                generation = self._generation(info)
+                with probe.client():
+                    result = wrap_json(func_name, await self._read(
+                        info, func_name, qry, args, kwargs, deadline))
+                if info.is_mutation:
+                    await self.invalidate(info.writes)
+                self._store(info, key, result, ttl, storage, soft_ttl, generation)
+                return result
+
+            if result is not MISSING:
+                if stale:
+                    self._revalidate(key, func_name, qry, _fetch, args, kwargs)
+                return probe.done(result, cache_hit=True)
+
+            if info.is_mutation:
+                return probe.done(await _fetch())
+            result, shared = await self._flights.do(key, _fetch, deadline)
+            if shared:
+                return self._follow(key, result, probe)
+            return probe.done(result)
+
+    def _revalidate(self, key, func_name: str, qry: str,
+                    fetch: Callable[[Probe], Awaitable[Any]],
+                    args: tuple = (),
+                    kwargs: dict | None = None) -> None:
+        async def _refresh():
+            deadline = self._deadline(None)
+            with self._instrumentation.probe('refresh', func_name, qry,
+                                             args, kwargs) as probe:
+                result, _ = await self._flights.do(
+                    key, partial(fetch, probe, deadline=deadline), deadline)
+                return probe.done(result)
+
+        self._refresher.submit(key, _refresh)
+
+    def _poll(self, func_name: str, qry: str, args: tuple, kwargs: dict):
+        async def _apoll():
+            with self._instrumentation.probe('watch', func_name, qry,
+                                             args, kwargs) as probe:
+                with probe.client():
+                    result = wrap_json(func_name, await self._read(
+                        classify(qry), func_name, qry, args, kwargs,
+                        self._deadline(None)))
+                return probe.done(result)
+
+        return self.run(_apoll())
+
+    async def gather_queries(self,
+                             specs: Sequence[QuerySpec],
+                             ttl: float | timedelta | None = None,
+                             timeout: float | timedelta | None = None) -> list:
+        '''
+        Run `(qry, args, kwargs, jsonify, required_single)` specs concurrently
+        and return their results in order.
+        '''
+        coros = []
+        for spec in specs:
+            qry, args, kwargs, jsonify, required_single = unpack_query_spec(spec)
+            coros.append(self.query(qry, *args, ttl=ttl, jsonify=jsonify,
+                                    required_single=required_single,
+                                    timeout=timeout, **kwargs))
+        return list(await asyncio.gather(*coros))
+
+    async def explain(self,
+                      qry: str,
+                      *args,
+                      timeout: float | timedelta | None = None,
+                      **kwargs) -> Plan:
+        with self._instrumentation.probe('explain', 'query_required_single',
+                                         qry, args, kwargs) as probe:
+            deadline = self._deadline(timeout)
+            async with self._admit(deadline):
+                with probe.client():
+                    output = await self._call(self.client, 'query_required_single',
+                                              analyze_query(qry), args, kwargs,
+                                              deadline)
+            with probe.decode():
+                return probe.done(parse_plan(qry, output))
+
+    def _explain_in_background(self, qry: str, args: tuple, kwargs: dict) -> Plan:
+        return self.run(self.explain(qry, *args, **kwargs))
+
+    async def execute(self, qry, timeout: float | timedelta | None = None) -> None:
+        with self._instrumentation.probe('execute', 'execute', qry) as probe:
+            deadline = self._deadline(timeout)
+            async with self._admit(deadline):
+                with probe.client():
+                    result = await self._call(self.client, 'execute', qry, (), {},
+                                              deadline)
+            info = classify(qry)
+            if info.is_mutation:
+                await self.invalidate(info.writes)
+            return result
+
+    async def invalidate(self, types: frozenset[str]) -> int:
+        dependents = {} if WILDCARD in types else await self._schema_dependents()
+        return self._invalidate(types, dependents)
+
+    async def _schema_dependents(self) -> dict[str, frozenset[str]]:
+        if not self._schema_aware:
+            return {}
+        if self._dependents is None:
+            import edgedb
+
+            try:
+                return self._load_dependents(
+                    await self.client.query_json(SCHEMA_QUERY))
+            except edgedb.EdgeDBError:
+                return {}
+        return self._dependents
+
+    async def aclose(self) -> None:
+        if self._router is not None:
+            self._router.stop_polling()
+            for client in self._router.clients():
+                await client.aclose()
+        if self._health_client is not None:
+            await self._health_client.aclose()
+        await self.client.aclose()
+
+    def close(self) -> None:
+        '''
+        Close the clients on the connection's event loop thread, and stop
+        it. When it was never started, e.g. because the queries were awaited
+        on another loop, close them on a loop of their own; from a running
+        loop, `await aclose()` instead.
+        '''
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            asyncio.run(self.aclose())
+            return
+        asyncio.run_coroutine_threadsafe(self.aclose(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+
+    def transaction(self) -> 'AsyncIORetry':
+        return self.client.transaction()
+
+    async def __call__(self, label: str = '') -> AsyncIterator['AsyncTransaction']:
+        with self._instrumentation.probe('transaction', 'transaction',
+                                         label) as probe:
+            retry = self.transaction()
+            attempt = 0
+            while True:
+                with probe.backoff():
+                    try:
+                        iteration = await anext(retry)
+                    except StopAsyncIteration:
+                        return
+                probe.retries = attempt
+                attempt += 1
+                tx = AsyncTransaction(self, iteration, probe)
+                try:
+                    yield tx
+                except BaseException as e:
+                    if tx._implicit and tx._open:
+                        await tx.__aexit__(type(e), e, e.__traceback__)
+                    raise
+                if tx._implicit and tx._open:
+                    await tx.__aexit__(None, None, None)
+
+
+class AsyncTransaction(Transaction):
+    '''
+    The asyncio flavour of `Transaction`, used with `async with tx:`.
+    '''
+    __slots__ = ()
+
+    async def __aenter__(self) -> 'AsyncTransaction':
+        await self.tx.__aenter__()
+        self._open = True
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> bool | None:
+        self._open = False
+        if exc_type is not None:
+            return await self.tx.__aexit__(exc_type, exc_val, exc_tb)
+        with self._probe.commit():
+            suppress = await self.tx.__aexit__(None, None, None)
+        if self.writes:
+            await self.conn.invalidate(frozenset(self.writes))
+        return suppress
+
+    async def _run(self, func_name: str, qry: str, *args, **kwargs):
+        if not self._open:
+            await self.__aenter__()
+            self._implicit = True
+        self.writes |= classify(qry).writes
+        with self.conn.instrumentation.probe('transaction_query', func_name,
+                                             qry, args, kwargs) as probe, \
+                probe.client(), self._probe.client():
+            return probe.done(wrap_json(
+                func_name, await getattr(self.tx, func_name)(qry, *args, **kwargs)))
+
+    async def query(self,
+                    qry: str,
+                    *args,
+                    jsonify: bool = False,
+                    required_single: bool | None = None,
+                    **kwargs) -> 'JSONResult | EdgeDBObject':
+        return await self._run(match_func_name(jsonify, required_single),
+                               qry, *args, **kwargs)
+
+    async def execute(self, qry: str, *args, **kwargs) -> None:
+        await self._run('execute', qry, *args, **kwargs)
+
+    def __enter__(self):
+        raise TypeError('use `async with` with an AsyncTransaction')
+
+
+def get_connection(connection_name: str = 'edgedb_conn',
+                   conn_class: type[BaseEdgeDBConnection] = EdgeDBConnection,
+                   **kwargs) -> BaseEdgeDBConnection:
+    '''
+    The connection of `conn_class` with this name, dsn and options, created
+    once and reused by every rerun and session, so its client pool is too.
+    The connections are closed when the process exits.
+
+    A dsn read from the secrets is not part of the key: when the secrets
+    change, the connection reconnects, and switches to the cache of the new
+    dsn, by itself.
+    '''
+    key = (conn_class, connection_name, freeze_arg(kwargs))
+    with _connections_lock:
+        conn = _connections.get(key)
+        if conn is None:
+            conn = _connections[key] = conn_class(connection_name, **kwargs)
+        return conn
+
+
+@atexit.register
+def close_connections() -> None:
+    '''
+    Close the connections created by `get_connection`.
+    '''
+    with _connections_lock:
+        connections = list(_connections.values())
+        _connections.clear()
+    for conn in connections:
+        try:
+            conn.close()
+        except Exception:
+            logger.exception('Closing %r failed', conn)
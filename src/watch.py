@@ -0,0 +1,235 @@
+import hashlib
+import logging
+import pickle
+import threading
+import time
+from typing import Any, Callable, Hashable
+
+from .cache import MISSING
+from .snapshot import _freeze
+
+logger = logging.getLogger(__name__)
+
+
+def result_digest(result: Any) -> bytes:
+    '''
+    A digest of a query result to tell whether it changed. JSON results are
+    hashed as they are, result sets through their frozen snapshot.
+    '''
+    if isinstance(result, str):
+        data = result.encode()
+    else:
+        try:
+            data = pickle.dumps(_freeze(result), protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            data = repr(result).encode()
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class Watch:
+    '''
+    Polls one read every `interval` seconds from a daemon thread and keeps its
+    latest result. `version` only goes up when the result changed, and the
+    subscribers are then called with the new result. The poller stops once
+    it has had no subscriber and no `touch()` for `idle_timeout` seconds.
+    '''
+
+    def __init__(self,
+                 key: Hashable,
+                 qry: str,
+                 fetch: Callable[[], Any],
+                 interval: float,
+                 idle_timeout: float = 60.0,
+                 expire: Callable[['Watch'], bool] | None = None,
+                 clock=time.monotonic) -> None:
+        self.key = key
+        self.qry = qry
+        self.interval = interval
+        self.idle_timeout = idle_timeout
+        self.result: Any = MISSING
+        self.version = 0
+        self.polls = 0
+        self.changed_at: float | None = None
+        self.error: str | None = None
+        self._fetch = fetch
+        self._expire = expire or Watch.idle
+        self._clock = clock
+        self._digest: bytes | None = None
+        self._subscribers: list[Callable[[Any], None]] = []
+        self._touched_at = clock()
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def latest(self) -> tuple[Any, int]:
+        '''
+        The result and its version, polling first if there is none yet.
+        '''
+        self.touch()
+        if self.result is MISSING:
+            with self._poll_lock:
+                if self.result is MISSING:
+                    self._poll()
+        with self._lock:
+            return self.result, self.version
+
+    def poll(self) -> bool:
+        '''
+        Run the query now, and return whether its result changed.
+        '''
+        with self._poll_lock:
+            return self._poll()
+
+    def _poll(self) -> bool:
+        try:
+            result = self._fetch()
+        except Exception as e:
+            with self._lock:
+                self.error = f'{type(e).__name__}: {e}'
+            raise
+        digest = result_digest(result)
+        with self._lock:
+            self.polls += 1
+            self.error = None
+            if digest == self._digest:
+                return False
+            self.result, self._digest = result, digest
+            self.version += 1
+            self.changed_at = time.time()
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber(result)
+            except Exception:
+                logger.exception('Notifying a watcher of %r failed', self.qry)
+        return True
+
+    def subscribe(self, callback: Callable[[Any], None]) -> Callable[[], None]:
+        '''
+        Call `callback` with every new result, from the polling thread, until
+        the returned function is called.
+        '''
+        with self._lock:
+            self._subscribers.append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers:
+                    self._subscribers.remove(callback)
+                    self._touched_at = self._clock()
+        return unsubscribe
+
+    def touch(self) -> None:
+        with self._lock:
+            self._touched_at = self._clock()
+
+    def idle(self) -> bool:
+        with self._lock:
+            return not self._subscribers \
+                and self._clock() - self._touched_at >= self.idle_timeout
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run,
+                                            name='edgedb-conn-watch',
+                                            daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            if self._expire(self):
+                self._stopped.set()
+                return
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Polling %r failed', self.qry)
+
+
+class Watcher:
+    '''
+    The watches of a connection, one per query and arguments, shared by every
+    session. A query watched with several intervals is polled at the
+    shortest one.
+    '''
+
+    def __init__(self, idle_timeout: float = 60.0) -> None:
+        self.idle_timeout = idle_timeout
+        self._watches: dict[Hashable, Watch] = {}
+        self._lock = threading.Lock()
+
+    def watch(self,
+              key: Hashable,
+              qry: str,
+              fetch: Callable[[], Any],
+              interval: float) -> Watch:
+        with self._lock:
+            watch = self._watches.get(key)
+            if watch is None or watch.stopped:
+                watch = self._watches[key] = Watch(
+                    key, qry, fetch, interval, self.idle_timeout, self._expire)
+                watch.start()
+            else:
+                watch.interval = min(watch.interval, interval)
+                watch.touch()
+            return watch
+
+    def _expire(self, watch: Watch) -> bool:
+        # Under the lock, so that `watch()` can't hand out a watch being stopped.
+        with self._lock:
+            if not watch.idle():
+                return False
+            watch.stop()
+            if self._watches.get(watch.key) is watch:
+                del self._watches[watch.key]
+            return True
+
+    def watches(self) -> list[Watch]:
+        with self._lock:
+            return list(self._watches.values())
+
+    def stop(self) -> None:
+        with self._lock:
+            watches = list(self._watches.values())
+            self._watches.clear()
+        for watch in watches:
+            watch.stop()
+
+    def __len__(self) -> int:
+        return len(self._watches)
+
+
+def rerun_on_change(watch: Watch, version: int) -> None:
+    '''
+    Check `watch` every `interval` seconds from a fragment that renders
+    nothing, and rerun the app only once its version moved past `version`,
+    the one this run rendered. Outside of a Streamlit script run, do nothing.
+    '''
+    import streamlit as st
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return
+
+    @st.fragment(run_every=watch.interval)
+    def _check():
+        # The open pages keep the watch alive, and rerun to watch again if it
+        # was stopped anyway.
+        watch.touch()
+        if watch.version != version or watch.stopped:
+            st.rerun()
+
+    # A fragment is identified by its function and container, so each check
+    # gets a container of its own.
+    with st.empty():
+        _check()
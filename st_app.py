@@ -3,7 +3,7 @@ import datetime
 import pandas as pd
 import streamlit as st
 
-from src.st_edgedb_conn import EdgeDBConnection
+from src.st_edgedb_conn import get_connection
 from st_utils import (
     edgedb_intro,
     param_fun_relations,
@@ -23,7 +23,7 @@ with st.sidebar:
 
 
 def main():
-    conn = EdgeDBConnection()
+    conn = get_connection(slow_query_threshold=1.0, slow_query_explain=True)
     dsn = conn._dsn
 
     with st.container():
@@ -46,14 +46,18 @@ def main():
 
         with healthy_col:
             if st.button('EdgeDB instance healthy check'):
-                if conn.is_healthy():
+                status = conn.health()
+                if status.healthy:
                     st.toast('Connected successfully', icon="✅")
+                elif status.alive:
+                    st.toast('Connected, but the instance is not ready', icon="⚠️")
                 else:
                     st.toast('Connected unsuccessfully', icon="🚨")
 
-    query_tab, exec_tab, benchmark_tab = st.tabs(['Query Form',
-                                                  'Exec Form',
-                                                  'Performance Benchmarks'])
+    query_tab, profiling_tab, exec_tab, benchmark_tab = st.tabs(['Query Form',
+                                                                 'Profiling',
+                                                                 'Exec Form',
+                                                                 'Performance Benchmarks'])
 
     with query_tab:
         with st.form('query-form'):
@@ -188,12 +192,48 @@ def main():
                 with st.container():
                     st.markdown('#### Query result: ')
                     if jsonify:
-                        if (null := str(qry_result)) == 'null':
-                            st.markdown(f'`{null}`')
+                        # A JSONResult is the client's JSON text, rendered as is.
+                        if qry_result.is_null:
+                            st.markdown('`null`')
                         else:
-                            st.json(str(qry_result))
+                            st.json(qry_result)
                     else:
                         st.write(qry_result)
+    with profiling_tab:
+        with st.form('explain-form'):
+            st.warning(
+                '''`analyze` runs the query, so an explained `INSERT`, `UPDATE` or
+                   `DELETE` is applied.''')
+            qry_explain = st.text_area(
+                'EdgeDB Analyze',
+                placeholder='Example: \nSELECT Movie {title, actors: {name}};')
+            *_, qry_explain_last_col = st.columns(7)
+            with qry_explain_last_col:
+                qry_explain_submit_button = st.form_submit_button('Explain')
+            if qry_explain_submit_button and qry_explain:
+                plan = conn.explain(qry_explain)
+                st.markdown(f'#### Plan: `{plan.total_time}` ms')
+                st.dataframe(pd.DataFrame(
+                    [{'node': '\u2003' * depth + node.node_type,
+                      'query': node.label,
+                      'total (ms)': node.total_time,
+                      'self (ms)': node.self_time,
+                      'rows': node.rows,
+                      'loops': node.loops}
+                     for depth, node in plan.nodes()]), hide_index=True)
+
+        st.markdown('#### Slow queries')
+        if slow_queries := conn.slow_queries():
+            st.dataframe(pd.DataFrame(
+                [{'started at': datetime.datetime.fromtimestamp(q.started_at),
+                  'latency (s)': q.latency,
+                  'query': q.qry,
+                  'args': q.args_shape,
+                  'plan (ms)': q.plan and q.plan.total_time}
+                 for q in slow_queries]), hide_index=True)
+        else:
+            st.markdown('No query took more than a second yet.')
+
     with exec_tab:
         with st.form('exec-form'):
             st.warning(
@@ -0,0 +1,177 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import edgedb
+
+from src.admission import (
+    Admission,
+    AsyncAdmission,
+    DeadlineExceededError,
+    OverloadedError,
+    deadline_after,
+    remaining,
+)
+from tests.fakes import FakeAsyncEdgeDBConnection, make_conn
+
+
+class TestAdmission(unittest.TestCase):
+    def test_full_queue_is_rejected(self):
+        admission = Admission(max_in_flight=1, max_queued=0)
+        with admission.admit():
+            with self.assertRaises(OverloadedError):
+                with admission.admit():
+                    pass
+        with admission.admit():
+            pass
+        stats = admission.stats()
+        self.assertEqual((0, 0, 2, 1), (stats.in_flight, stats.queued,
+                                        stats.admitted, stats.rejected))
+
+    def test_queued_call_gets_a_freed_slot(self):
+        admission = Admission(max_in_flight=1, max_queued=1)
+        entered = threading.Event()
+
+        def _hold():
+            with admission.admit():
+                entered.set()
+                time.sleep(0.05)
+
+        thread = threading.Thread(target=_hold)
+        thread.start()
+        entered.wait()
+        with admission.admit():
+            self.assertEqual(1, admission.stats().in_flight)
+        thread.join()
+        self.assertEqual(0, admission.stats().rejected)
+
+    def test_queue_timeout_and_deadline(self):
+        admission = Admission(max_in_flight=1, queue_timeout=0.02)
+        with admission.admit():
+            with self.assertRaises(OverloadedError):
+                with admission.admit():
+                    pass
+            with self.assertRaises(OverloadedError):
+                with admission.admit(deadline_after(1)):
+                    pass
+            # A call that runs out of its own time is not overloaded.
+            with self.assertRaises(DeadlineExceededError):
+                with admission.admit(deadline_after(0.01)):
+                    pass
+            with self.assertRaises(DeadlineExceededError):
+                with admission.admit(deadline_after(-1)):
+                    pass
+            self.assertEqual(0, admission.stats().queued)
+        self.assertEqual(2, admission.stats().rejected)
+
+    def test_remaining(self):
+        self.assertGreater(remaining(deadline_after(1)), 0.5)
+        with self.assertRaises(DeadlineExceededError):
+            remaining(deadline_after(0))
+
+    def test_async_admission(self):
+        admission = AsyncAdmission(max_in_flight=1, max_queued=1, queue_timeout=0.02)
+
+        async def _call(delay):
+            async with admission.admit():
+                await asyncio.sleep(delay)
+
+        async def _main():
+            return await asyncio.gather(_call(0.1), _call(0), _call(0),
+                                        return_exceptions=True)
+
+        _, queued, rejected = asyncio.run(_main())
+        self.assertIsInstance(queued, OverloadedError)
+        self.assertIsInstance(rejected, OverloadedError)
+        self.assertEqual((1, 2), (admission.stats().admitted,
+                                  admission.stats().rejected))
+
+    def test_async_deadline_in_the_queue(self):
+        admission = AsyncAdmission(max_in_flight=1, queue_timeout=1)
+
+        async def _main():
+            async with admission.admit():
+                for deadline in (deadline_after(0.01), deadline_after(-1)):
+                    with self.assertRaises(DeadlineExceededError):
+                        async with admission.admit(deadline):
+                            pass
+
+        asyncio.run(_main())
+        self.assertEqual((1, 0), (admission.stats().admitted,
+                                  admission.stats().rejected))
+
+
+class TestConnAdmission(unittest.TestCase):
+    def test_overloaded_connection_fails_fast(self):
+        conn = make_conn('admission_conn', result=[], delay=0.2,
+                         max_in_flight=1, max_queued=0)
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(conn.query, f'SELECT {i};', ttl=0)
+                       for i in range(2)]
+            outcomes = [f.exception() for f in futures]
+        self.assertEqual(1, sum(isinstance(e, OverloadedError) for e in outcomes))
+        self.assertEqual(1, conn.admission_stats().rejected)
+        self.assertIsNone(make_conn('no_admission_conn').admission_stats())
+
+    def test_timeout_is_sent_to_the_server(self):
+        conn = make_conn('timeout_conn', result=[], delay=0.5)
+        # The fake client only cancels the query past the limit it was sent.
+        with self.assertRaises(edgedb.QueryTimeoutError):
+            conn.query('SELECT Movie;', ttl=0, timeout=0.05)
+        self.assertEqual([], conn.client.calls)
+
+        conn.client.delay = 0
+        conn.execute('SELECT 1;', timeout=1)
+        conn.prepare('SELECT Movie;')(ttl=0, timeout=1)
+        self.assertEqual(['execute', 'query'], [c[0] for c in conn.client.calls])
+        limits = [c['query_execution_timeout'].total_seconds()
+                  for c in conn.client.configs]
+        self.assertTrue(all(0 < limit <= 1 for limit in limits))
+
+    def test_coalesced_reads_keep_their_own_deadline(self):
+        running, release = threading.Event(), threading.Event()
+
+        def _result(func_name, qry, *args, **kwargs):
+            running.set()
+            release.wait(5)
+            return []
+
+        conn = make_conn('coalesced_timeout_conn', result=_result)
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(conn.query, 'SELECT Movie;', ttl=0)
+            self.assertTrue(running.wait(5))
+            with self.assertRaises(DeadlineExceededError):
+                conn.query('SELECT Movie;', ttl=0, timeout=0.05)
+            self.assertFalse(leader.done())
+            release.set()
+            self.assertEqual([], leader.result())
+
+        # The leader's timeout is not passed on to a follower without one,
+        # which runs the query again.
+        conn.client.result, conn.client.delay = [], 0.3
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(conn.query, 'SELECT Movie;', ttl=0, timeout=0.1)
+            time.sleep(0.05)
+            follower = pool.submit(conn.query, 'SELECT Movie;', ttl=0)
+            self.assertIsInstance(leader.exception(), edgedb.QueryTimeoutError)
+            self.assertEqual([], follower.result())
+        self.assertEqual(2, len(conn.client.calls))
+
+    def test_default_query_timeout(self):
+        conn = make_conn('default_timeout_conn', result=[], query_timeout=2)
+        conn.query('SELECT Movie;')
+        self.assertIn('query_execution_timeout', conn.client.configs[-1])
+
+    def test_async_timeout_cancels_the_call(self):
+        conn = make_conn('async_timeout_conn', FakeAsyncEdgeDBConnection,
+                         result=[], delay=0.5, max_in_flight=2)
+        with self.assertRaises(DeadlineExceededError):
+            conn.run(conn.query('SELECT Movie;', ttl=0, timeout=0.05))
+        self.assertEqual(0, conn.admission_stats().in_flight)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
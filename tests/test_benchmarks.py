@@ -0,0 +1,17 @@
+import unittest
+
+from benchmarks.__main__ import discover
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_benchmarks_run(self):
+        benchmarks = discover()
+        self.assertGreater(len(benchmarks), 0)
+        for benchmark in benchmarks:
+            with self.subTest(benchmark.name):
+                suite = benchmark.suite()
+                if hasattr(suite, 'setup'):
+                    suite.setup(*benchmark.params)
+                getattr(suite, benchmark.method)(*benchmark.params)
+                if hasattr(suite, 'teardown'):
+                    suite.teardown(*benchmark.params)
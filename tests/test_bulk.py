@@ -0,0 +1,58 @@
+import json
+import unittest
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from src.bulk import chunked, encode_rows, infer_cast, infer_casts, insert_query, is_name
+
+
+class TestBulk(unittest.TestCase):
+    def test_infer_cast(self):
+        cases = [(True, 'bool'), (1, 'int64'), (1.5, 'float64'), ('a', 'str'),
+                 (Decimal('1.5'), 'decimal'), (date(2023, 1, 1), 'cal::local_date'),
+                 (datetime(2023, 1, 1), 'cal::local_datetime'),
+                 (datetime(2023, 1, 1, tzinfo=timezone.utc), 'datetime'),
+                 (timedelta(hours=1), 'duration'), (uuid.uuid4(), 'uuid'),
+                 ({'a': 1}, 'json'), (object(), None)]
+        for value, cast in cases:
+            with self.subTest(value=value):
+                self.assertEqual(cast, infer_cast(value))
+
+    def test_infer_casts(self):
+        rows = [{'title': 'Dune', 'rating': None, 'note': None},
+                {'title': 'Alien', 'rating': 8.5}]
+        self.assertEqual({'title': 'str', 'rating': 'float64', 'note': None},
+                         infer_casts(rows))
+        self.assertEqual({'title': 'str', 'rating': 'float32', 'note': None},
+                         infer_casts(rows, {'rating': 'float32'}))
+        with self.assertRaises(TypeError):
+            infer_casts([{'title': object()}])
+
+    def test_encode_rows(self):
+        rows = [{'released': date(2021, 10, 22), 'runtime': timedelta(minutes=155),
+                 'budget': Decimal('165000000.00')}]
+        self.assertEqual([{'released': '2021-10-22',
+                           'runtime': '9300000000 microseconds',
+                           'budget': '165000000.00'}],
+                         json.loads(encode_rows(rows)))
+
+    def test_insert_query(self):
+        qry = insert_query('Movie', (('meta', 'json'), ('released', 'cal::local_date'),
+                                     ('title', 'str')))
+        self.assertEqual(
+            "SELECT count((FOR item IN json_array_unpack(<json>$data) UNION "
+            "(INSERT Movie {meta := json_get(item, 'meta'), "
+            "released := <cal::local_date><str>json_get(item, 'released'), "
+            "title := <str>json_get(item, 'title')})))", qry)
+
+    def test_is_name(self):
+        self.assertTrue(is_name('release_year'))
+        self.assertFalse(is_name('release year'))
+        self.assertFalse(is_name("title := 'x'}"))
+        self.assertFalse(is_name('default::Movie'))
+        self.assertTrue(is_name('default::Movie', qualified=True))
+
+    def test_chunked(self):
+        self.assertEqual([[0, 1], [2, 3], [4]], list(chunked(iter(range(5)), 2)))
+        self.assertEqual([], list(chunked([], 2)))
@@ -0,0 +1,115 @@
+import unittest
+
+from src.cache import MISSING, ResultCache, make_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ResultCache(max_entries=2, clock=self.clock)
+
+    def test_get_set(self):
+        self.assertIs(MISSING, self.cache.get('a'))
+        self.cache.set('a', 1)
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual(1, self.cache._peek('a'))
+        self.assertIs(MISSING, self.cache._peek('b'))
+        stats = self.cache.stats()
+        self.assertEqual((1, 1), (stats.hits, stats.misses))
+
+    def test_ttl(self):
+        self.cache.set('a', 1, ttl=10)
+        self.cache.set('b', 2, ttl=0)
+        self.assertIs(MISSING, self.cache.get('b'))
+        self.clock.now = 9.9
+        self.assertEqual(1, self.cache.get('a'))
+        self.clock.now = 10
+        self.assertIs(MISSING, self.cache._peek('a'))
+        self.assertIs(MISSING, self.cache.get('a'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_soft_ttl(self):
+        self.cache.set('a', 1, ttl=10, soft_ttl=5)
+        self.assertEqual((1, False), self.cache.lookup('a'))
+        self.clock.now = 5
+        self.assertEqual((1, True), self.cache.lookup('a'))
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual(2, self.cache.stats().stale_hits)
+        entry, = self.cache.entries()
+        self.assertEqual((5, 0), (entry.expires_in, entry.stale_in))
+        self.clock.now = 10
+        self.assertEqual((MISSING, False), self.cache.lookup('a'))
+        # A soft TTL past the hard one is ignored.
+        self.cache.set('b', 1, ttl=5, soft_ttl=10)
+        self.assertIsNone(self.cache.entries()[0].stale_in)
+
+    def test_lru_eviction_by_entries(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(1, self.cache.stats().evictions)
+
+    def test_eviction_by_bytes(self):
+        cache = ResultCache(max_bytes=200)
+        cache.set('a', 'x' * 100)
+        cache.set('b', 'y' * 100)
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        cache.set('c', 'z' * 1000)
+        self.assertNotIn('c', cache)
+        self.assertLessEqual(cache.stats().nbytes, 200)
+
+    def test_invalidate_tags(self):
+        cache = ResultCache()
+        cache.set('movies', 1, tags=frozenset({'Movie'}))
+        cache.set('people', 2, tags=frozenset({'Person'}))
+        cache.set('unknown', 3)
+        self.assertEqual(2, cache.invalidate_tags(frozenset({'Movie'})))
+        self.assertEqual(['people'], [k for k in ('movies', 'people', 'unknown')
+                                      if k in cache])
+        self.assertEqual(1, cache.invalidate_tags(frozenset({'*'})))
+        self.assertEqual(0, len(cache))
+
+    def test_generation(self):
+        cache = ResultCache()
+        movies = frozenset({'Movie'})
+        generation = cache.generation(movies)
+        cache.invalidate_tags(frozenset({'Person'}))
+        self.assertEqual(generation, cache.generation(movies))
+        cache.invalidate_tags(movies)
+        cache.set('movies', 1, tags=movies, generation=generation)
+        self.assertNotIn('movies', cache)
+        cache.set('movies', 1, tags=movies, generation=cache.generation(movies))
+        self.assertIn('movies', cache)
+
+        # Entries of unknown types depend on every invalidation.
+        generation = cache.generation(frozenset({'*'}))
+        cache.invalidate_tags(frozenset({'Person'}))
+        cache.set('unknown', 2, generation=generation)
+        self.assertNotIn('unknown', cache)
+        generation = cache.generation(movies)
+        cache.clear()
+        self.assertNotEqual(generation, cache.generation(movies))
+
+    def test_make_key(self):
+        k1 = make_key('query', 'SELECT Movie {title};', ([1, 2],), {'t': 'a'})
+        k2 = make_key('query', 'SELECT Movie  {title}', ((1, 2),), {'t': 'a'})
+        k3 = make_key('query_json', 'SELECT Movie {title}', ((1, 2),), {'t': 'a'})
+        self.assertEqual(k1, k2)
+        self.assertNotEqual(k1, k3)
+        hash(k1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from edgedb import RetryCondition
+
+from src.config import EdgeDBConfig, InvalidConfigError, pool_stats
+from src.st_edgedb_conn import EdgeDBConnection
+from tests.fakes import FAKE_DSN
+
+
+class TestEdgeDBConfig(unittest.TestCase):
+    def test_from_sources(self):
+        config = EdgeDBConfig.from_sources(
+            {'EDGEDB_DSN': FAKE_DSN, 'max_concurrency': 10, 'timeout': 5},
+            {'dsn': FAKE_DSN, 'timeout': 2.5, 'retry_attempts': 5})
+        self.assertEqual(EdgeDBConfig(max_concurrency=10,
+                                      timeout=2.5,
+                                      retry_attempts=5), config)
+
+    def test_validation(self):
+        for options in ({'max_concurrency': 0},
+                        {'max_concurrency': 2.5},
+                        {'retry_attempts': True},
+                        {'timeout': -1},
+                        {'timeout': '5'},
+                        {'readonly': 'yes'}):
+            with self.subTest(options=options):
+                with self.assertRaises(InvalidConfigError):
+                    EdgeDBConfig(**options)
+
+    def test_policies(self):
+        self.assertIsNone(EdgeDBConfig().retry_options)
+        self.assertIsNone(EdgeDBConfig().transaction_options)
+        config = EdgeDBConfig(retry_attempts=2,
+                              transaction_conflict_attempts=10,
+                              readonly=True)
+        self.assertEqual(2, config.retry_options._default.attempts)
+        self.assertEqual(
+            10, config.retry_options._overrides[RetryCondition.TransactionConflict].attempts)
+        self.assertIn('READ ONLY',
+                      config.transaction_options.start_transaction_query())
+
+    def test_connection_client(self):
+        conn = EdgeDBConnection('config_conn', dsn=FAKE_DSN,
+                                max_concurrency=7, retry_attempts=4)
+        self.assertEqual(7, conn.client.max_concurrency)
+        self.assertEqual(4, conn.client._options.retry_options._default.attempts)
+        stats = pool_stats(conn.client)
+        self.assertEqual((7, 0, 0, 0), (stats.max_concurrency, stats.open,
+                                        stats.idle, stats.in_use))
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,34 @@
+import asyncio
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
 import unittest
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import PropertyMock, patch
 
 import edgedb
 
 from src.st_edgedb_conn import (
+    BaseEdgeDBConnection,
     EdgeDBConnection,
     WrongQueryParamsError,
+    close_connections,
+    get_connection,
     match_func_name,
 )
+from src.cache import make_key
+from src.edgeql import SCHEMA_QUERY
+from tests.fakes import (
+    FAKE_DSN,
+    FakeAsyncEdgeDBConnection,
+    FakeEdgeDBConnection,
+    make_conn,
+    make_movie,
+)
 
 
 class TestUtils(unittest.TestCase):
@@ -35,6 +57,485 @@ class TestUtils(unittest.TestCase):
         with self.assertRaises(WrongQueryParamsError):
             match_func_name(jsonify='123', required_single=0)
 
+    def test_get_connection(self):
+        conn = get_connection('factory_conn', FakeEdgeDBConnection, dsn=FAKE_DSN)
+        self.assertIs(conn, get_connection('factory_conn', FakeEdgeDBConnection,
+                                           dsn=FAKE_DSN))
+        other = get_connection('factory_conn', FakeEdgeDBConnection,
+                               dsn=FAKE_DSN, max_concurrency=2)
+        self.assertIsNot(conn, other)
+        client = conn.client
+        close_connections()
+        self.assertTrue(client.closed)
+        self.assertTrue(other.client.closed)
+        self.assertIsNot(conn, get_connection('factory_conn', FakeEdgeDBConnection,
+                                              dsn=FAKE_DSN))
+        close_connections()
+
+    def test_connection_hooks_are_abstract(self):
+        class NoPing(BaseEdgeDBConnection):
+            def _create_client(self, dsn, **options): ...
+            def _explain_in_background(self, qry, args, kwargs): ...
+            def _poll(self, func_name, qry, args, kwargs): ...
+
+        with self.assertRaisesRegex(TypeError, '_ping_client'):
+            NoPing('no_ping_conn', dsn=FAKE_DSN)
+
+    def test_edgedb_is_imported_lazily(self):
+        code = ('import sys, src.st_edgedb_conn; '
+                'print(any(m.startswith("edgedb") for m in sys.modules))')
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, check=True).stdout
+        self.assertEqual('False', out.strip())
+
+
+class TestConnCache(unittest.TestCase):
+    """ Exercise the caching layer of `EdgeDBConnection` against a fake client."""
+
+    def setUp(self):
+        self.conn = make_conn(result=['Movie'])
+        self.client = self.conn.client
+
+    def test_query_hits_cache(self):
+        before = self.conn.cache.stats()
+        r1 = self.conn.query('SELECT Movie {title};')
+        r2 = self.conn.query('SELECT Movie\n    {title}')
+        self.assertEqual(r1, r2)
+        self.assertEqual(1, len(self.client.calls))
+        after = self.conn.cache.stats()
+        self.assertEqual((1, 1), (after.hits - before.hits,
+                                  after.misses - before.misses))
+
+    def test_query_keyed_on_method_and_args(self):
+        qry = 'SELECT Movie {title} FILTER .title = <str>$title;'
+        self.conn.query(qry, title='a')
+        self.conn.query(qry, title='b')
+        self.conn.query(qry, title='a', jsonify=True)
+        self.conn.query(qry, title='a')
+        self.assertEqual(['query', 'query', 'query_json'],
+                         [call[0] for call in self.client.calls])
+
+    def test_query_ttl_zero_skips_cache(self):
+        qry = 'SELECT Movie {title};'
+        self.conn.query(qry, ttl=0)
+        self.conn.query(qry, ttl=0)
+        self.assertEqual(2, len(self.client.calls))
+        self.assertEqual(0, len(self.conn.cache))
+
+    def test_new_dsn_in_the_secrets_switches_the_cache(self):
+        class Secrets(dict):
+            def to_dict(self):
+                return dict(self)
+
+        secrets = Secrets(EDGEDB_DSN=FAKE_DSN)
+        with patch.object(FakeEdgeDBConnection, '_secrets', new_callable=PropertyMock,
+                          return_value=secrets):
+            conn = FakeEdgeDBConnection('secrets_conn', result=['Dune'])
+            conn.cache.clear()
+            conn.query('SELECT Movie;')
+            old_cache = conn.cache
+
+            secrets['EDGEDB_DSN'] = FAKE_DSN.replace('10700', '10701')
+            conn._on_secrets_changed('secrets')
+            self.assertEqual(secrets['EDGEDB_DSN'], conn.client.dsn)
+            self.assertIsNot(old_cache, conn.cache)
+            conn.query('SELECT Movie;')
+            self.assertEqual(1, len(conn.client.calls))
+
+    def test_cache_shared_across_connections(self):
+        self.conn.query('SELECT Movie {title};')
+        other = FakeEdgeDBConnection('fake_conn', dsn=FAKE_DSN)
+        self.assertIs(self.conn.cache, other.cache)
+        self.assertEqual(['Movie'], other.query('SELECT Movie {title};'))
+        self.assertEqual([], other.client.calls)
+
+    def test_mutation_invalidates_affected_types(self):
+        conn = make_conn(schema_aware_invalidation=False)
+        movies = 'SELECT Movie {title};'
+        people = 'SELECT Person {name};'
+        conn.query(movies)
+        conn.query(people)
+        conn.query('''SELECT (INSERT Movie {title := 'John Wick 05'}) {title};''')
+        self.assertNotIn(make_key('query', movies, (), {}), conn.cache)
+        self.assertIn(make_key('query', people, (), {}), conn.cache)
+
+        conn.execute('CREATE TYPE Award;')
+        self.assertEqual(0, len(conn.cache))
+
+    def test_read_racing_a_write_is_not_cached(self):
+        conn = make_conn('racing_write_conn', schema_aware_invalidation=False)
+        movies = 'SELECT Movie {title};'
+
+        def _written_meanwhile(func_name, qry, *args, **kwargs):
+            conn.invalidate(frozenset({'Movie'}))
+            return ['Dune']
+
+        conn.client.result = _written_meanwhile
+        self.assertEqual(['Dune'], conn.query(movies))
+        self.assertEqual(['Dune'], conn.prepare(movies)())
+        self.assertEqual(0, len(conn.cache))
+        conn.client.result = ['Dune']
+        conn.query(movies)
+        self.assertIn(make_key('query', movies, (), {}), conn.cache)
+
+    def test_mutation_invalidates_linking_types(self):
+        schema = json.dumps([
+            {'name': 'default::Movie', 'ancestors': [],
+             'links': [{'target': {'name': 'default::Person'}}]},
+            {'name': 'default::Person', 'ancestors': [], 'links': []},
+        ])
+        conn = make_conn(result=lambda func_name, qry, *args, **kwargs:
+                         schema if qry == SCHEMA_QUERY else [])
+        movies = 'SELECT Movie {title, actors: {name}};'
+        conn.query(movies)
+        conn.query('''INSERT Person {name := 'Keanu Reeves'};''')
+        self.assertNotIn(make_key('query', movies, (), {}), conn.cache)
+
+    def test_query_many(self):
+        conn = make_conn(result=lambda func_name, qry, *args, **kwargs: (func_name, args),
+                         delay=0.2)
+        conn.query('SELECT Show {title};')
+        results = conn.query_many(['SELECT Movie {title};',
+                                   'SELECT Show {title};',
+                                   ('SELECT Person {name} FILTER .name = <str>$0;',
+                                    ('Rhys Ifans',), {}, True, True)])
+        self.assertEqual([('query', ()),
+                          ('query', ()),
+                          ('query_required_single_json', ('Rhys Ifans',))],
+                         results)
+        # The two uncached queries ran at the same time.
+        self.assertEqual(2, conn.client.peak)
+        self.assertEqual(3, len(conn.client.calls))
+        self.assertEqual(results, conn.query_many(['SELECT Movie {title};',
+                                                  'SELECT Show {title};',
+                                                  ('SELECT Person {name} FILTER .name = <str>$0;',
+                                                   ('Rhys Ifans',), {}, True, True)]))
+        self.assertEqual(3, len(conn.client.calls))
+
+    def test_query_many_rejects_mutations(self):
+        with self.assertRaises(WrongQueryParamsError):
+            self.conn.query_many(['DELETE Movie;'])
+
+    def test_iter_query(self):
+        rows = list(range(25))
+
+        def result(func_name, qry, *args, **kwargs):
+            offset, limit = map(int, re.search(r'OFFSET (\d+) LIMIT (\d+)', qry).groups())
+            page = rows[offset:offset + limit]
+            return json.dumps(page) if func_name == 'query_json' else page
+
+        conn = make_conn(result=result)
+        self.assertEqual([list(range(10)), list(range(10, 20)), list(range(20, 25))],
+                         list(conn.iter_query('SELECT Movie;', page_size=10)))
+        pages = conn.iter_query('SELECT Movie;', page_size=5, jsonify=True)
+        self.assertEqual('[0, 1, 2, 3, 4]', next(pages))
+        self.assertEqual(4, len(conn.client.calls))
+        self.assertEqual(4, len(list(pages)))
+        self.assertEqual(9, len(conn.client.calls))
+
+    def test_iter_query_keyset(self):
+        ids = [uuid.UUID(int=i) for i in range(1, 8)]
+
+        def result(func_name, qry, *args, **kwargs):
+            rows = ids
+            if match := re.search(r"\.id > <uuid>'([^']+)'", qry):
+                rows = [i for i in rows if i > uuid.UUID(match[1])]
+            # Without an ORDER BY, the set comes back in any order.
+            rows = sorted(rows) if 'ORDER BY .id' in qry else rows[::-1]
+            limit = int(re.search(r'LIMIT (\d+)', qry)[1])
+            return [make_movie(i, 'Dune', 2021, 4.0) for i in rows[:limit]]
+
+        conn = make_conn('keyset_conn', result=result)
+        pages = list(conn.iter_query('SELECT Movie;', page_size=3, keyset=True))
+        self.assertEqual(ids, [movie.id for page in pages for movie in page])
+
+    def test_query_df_caches_frame(self):
+        conn = make_conn(result=[1, 2, 3])
+        df = conn.query_df('SELECT {1, 2, 3};')
+        self.assertEqual([1, 2, 3], df['value'].tolist())
+        self.assertIs(df, conn.query_df('SELECT {1, 2, 3};'))
+        self.assertEqual(1, len(conn.client.calls))
+        self.assertEqual(3, conn.query_df('SELECT {1, 2, 3};', engine='arrow').num_rows)
+        with self.assertRaises(WrongQueryParamsError):
+            conn.query_df('SELECT {1, 2, 3};', engine='polars')
+        for kwargs in ({'jsonify': True}, {'required_single': True}):
+            with self.assertRaises(TypeError):
+                conn.query_df('SELECT {1, 2, 3};', **kwargs)
+
+    def test_data_storage_returns_copies(self):
+        conn = make_conn(result=lambda func_name, qry, *args, **kwargs: ['Movie'])
+        qry = 'SELECT Movie {title};'
+        conn.query(qry, storage='data').append('mutated')
+        r1 = conn.query(qry)
+        r1.append('mutated')
+        self.assertEqual(['Movie'], conn.query(qry))
+        entry, = conn.cache.entries()
+        self.assertGreater(entry.nbytes, 0)
+        self.assertEqual(frozenset({'Movie'}), entry.tags)
+        with self.assertRaises(WrongQueryParamsError):
+            conn.query('SELECT Person;', storage='disk')
+
+    def test_prepare(self):
+        qry = 'SELECT Movie {title} FILTER .title = <str>$title;'
+        get_movie = self.conn.prepare(qry, required_single=False)
+        self.assertEqual(['Movie'], get_movie(title='John Wick'))
+        self.assertEqual(['Movie'], get_movie(title='John Wick'))
+        self.assertEqual(['Movie'],
+                         self.conn.query(qry, title='John Wick', required_single=False))
+        self.assertEqual([('query_single', qry, (), {'title': 'John Wick'})],
+                         self.client.calls)
+        with self.assertRaises(WrongQueryParamsError):
+            get_movie('John Wick')
+        with self.assertRaises(WrongQueryParamsError):
+            get_movie(name='John Wick')
+
+    def test_prepare_mutation(self):
+        conn = make_conn(schema_aware_invalidation=False)
+        conn.query('SELECT Movie {title};')
+        insert_movie = conn.prepare('INSERT Movie {title := <str>$0};')
+        insert_movie('John Wick 5')
+        insert_movie('John Wick 5')
+        self.assertEqual(3, len(conn.client.calls))
+        self.assertEqual(0, len(conn.cache))
+
+    def test_bulk_insert(self):
+        def result(func_name, qry, *args, data=None, **kwargs):
+            return ['Movie'] if data is None else len(json.loads(data))
+
+        conn = make_conn(result=result, conflicts=1, schema_aware_invalidation=False)
+        conn.query('SELECT Movie {title};')
+        conn.query('SELECT Person {name};')
+        rows = ({'title': f'Movie {i}', 'release_year': 2000 + i} for i in range(5))
+        self.assertEqual(5, conn.bulk_insert('default::Movie', rows, chunk_size=2,
+                                             casts={'release_year': 'int16'}))
+        inserts = [call for call in conn.client.calls
+                   if call[0] == 'query_required_single']
+        # Every chunk conflicted once and was retried.
+        self.assertEqual(6, len(inserts))
+        self.assertIn("release_year := <int16>json_get(item, 'release_year')",
+                      inserts[0][1])
+        self.assertEqual([2, 2, 2, 2, 1, 1],
+                         [len(json.loads(call[3]['data'])) for call in inserts])
+        # Only the Movie read was invalidated.
+        self.assertEqual(1, len(conn.cache))
+        stats, = [s for s in conn.query_stats() if s.operation == 'bulk_insert']
+        self.assertEqual((3, 3, 5), (stats.calls, stats.retries, stats.result_size))
+
+        self.assertEqual(3, conn.bulk_insert('Movie', [{'title': 'Dune'}] * 3,
+                                             chunk_size=1, max_workers=3))
+        with self.assertRaises(WrongQueryParamsError):
+            conn.bulk_insert('Movie', [{'release year': 2021}])
+        with self.assertRaises(WrongQueryParamsError):
+            conn.bulk_insert('Movie; DELETE Movie', [{'title': 'Dune'}])
+
+    def test_transaction(self):
+        conn = make_conn(schema_aware_invalidation=False, conflicts=2)
+        conn.query('SELECT Movie {title};')
+        conn.query('SELECT Person {name};')
+        bodies = 0
+        for tx in conn('add movie'):
+            bodies += 1
+            tx.query('SELECT Movie {title};')
+            tx.execute('INSERT Movie {title := "Dune"};')
+        # Conflicts on commit are retried without a `with` block.
+        self.assertEqual(3, bodies)
+        self.assertEqual(1, len(conn.cache))
+        stats = {s.operation: s for s in conn.query_stats()}
+        self.assertEqual(('add movie', 1, 2), (stats['transaction'].qry,
+                                               stats['transaction'].calls,
+                                               stats['transaction'].retries))
+        self.assertGreater(stats['transaction'].commit_time, 0)
+        self.assertEqual(6, sum(s.calls for s in conn.query_stats()
+                                if s.operation == 'transaction_query'))
+
+    def test_transaction_retries_conflicts_in_with_block(self):
+        conn = make_conn(result='[]', schema_aware_invalidation=False)
+        conn.query('SELECT Movie {title};')
+        bodies = 0
+        for tx in conn():
+            with tx:
+                bodies += 1
+                self.assertEqual('[]', tx.query_json('SELECT Movie {title};'))
+                tx.query('DELETE Movie;')
+                if bodies == 1:
+                    raise edgedb.TransactionConflictError('conflict')
+        self.assertEqual(2, bodies)
+        self.assertEqual(0, len(conn.cache))
+
+    def test_transaction_rolls_back_on_error(self):
+        conn = make_conn(schema_aware_invalidation=False)
+        conn.query('SELECT Movie {title};')
+        with self.assertRaises(ValueError):
+            for tx in conn():
+                tx.execute('DELETE Movie;')
+                raise ValueError
+        self.assertEqual(['rollback'], conn.client.outcomes)
+        self.assertEqual(1, len(conn.cache))
+
+    def test_concurrent_identical_reads_are_coalesced(self):
+        conn = make_conn(result=lambda func_name, qry, *args, **kwargs: ['Movie'],
+                         delay=0.2)
+        qry = 'SELECT Movie {title} FILTER .title = <str>$0;'
+        before = conn.cache.stats()
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(
+                lambda _: conn.query(qry, 'Dune', storage='data'), range(8)))
+        self.assertEqual(1, len(conn.client.calls))
+        self.assertEqual([['Movie']] * 8, results)
+        # Every caller got its own copy of the snapshot.
+        self.assertEqual(8, len({id(result) for result in results}))
+        stats, = conn.query_stats()
+        self.assertEqual(7, stats.coalesced)
+        # The followers read the result back without counting a second time.
+        after = conn.cache.stats()
+        self.assertEqual(8, after.hits + after.misses - before.hits - before.misses)
+
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(lambda _: conn.query(qry, 'Dune', ttl=0), range(2)))
+            list(pool.map(lambda title: conn.query(qry, title, ttl=0),
+                          ['Alien', 'Heat']))
+        self.assertEqual(4, len(conn.client.calls))
+
+    def test_stale_while_revalidate(self):
+        versions = iter(range(100))
+        refreshing, refreshed = threading.Event(), threading.Event()
+
+        def _result(func_name, qry, *args, **kwargs):
+            version = next(versions)
+            if version:
+                refreshing.set()
+                refreshed.wait(5)
+            return version
+
+        conn = make_conn(result=_result)
+        qry = 'SELECT Movie {title};'
+        self.assertEqual(0, conn.query(qry, ttl=10, soft_ttl=0.05))
+        time.sleep(0.1)
+        # The stale result is served while it is refreshed in the background.
+        self.assertEqual(0, conn.query(qry, ttl=10, soft_ttl=0.05))
+        self.assertTrue(refreshing.wait(5))
+        self.assertEqual(0, conn.query(qry, ttl=10, soft_ttl=0.05))
+        self.assertEqual(2, len(conn.client.calls))
+        refreshed.set()
+        conn._refresher.shutdown()
+        self.assertEqual(1, conn.query(qry, ttl=10, soft_ttl=0.05))
+        self.assertEqual(2, len(conn.client.calls))
+        self.assertEqual(1, sum(s.calls for s in conn.query_stats()
+                                if s.operation == 'refresh'))
+
+    def test_query_stats(self):
+        qry = 'SELECT Movie {title};'
+        self.conn.query(qry)
+        self.conn.query(qry)
+        self.conn.query_many([qry, 'SELECT Person {name};'])
+        self.conn.execute('DELETE Movie;')
+        stats = {(s.operation, s.qry): s for s in self.conn.query_stats()}
+        movie = stats['query', 'SELECT Movie {title}']
+        self.assertEqual((3, 2), (movie.calls, movie.cache_hits))
+        self.assertEqual(3, movie.result_size)
+        self.assertEqual(1, stats['query', 'SELECT Person {name}'].calls)
+        self.assertEqual(1, stats['execute', 'DELETE Movie'].calls)
+
+    def test_query_hooks(self):
+        events = []
+        self.conn.add_hook(events.append)
+        try:
+            self.conn.query_df('SELECT {1, 2, 3};')
+        finally:
+            self.conn.remove_hook(events.append)
+        query, query_df = events
+        self.assertEqual(('query', False), (query.func_name, query.cache_hit))
+        self.assertEqual('query_df_pandas', query_df.func_name)
+        self.assertGreater(query_df.decode_time, 0)
+        self.assertGreaterEqual(query_df.wall_time, query.wall_time)
+
+    def test_mentioning_mutation_keyword_is_not_mutation(self):
+        qry = 'SELECT Movie {inserted_at};'
+        self.conn.query(qry)
+        self.conn.query(qry)
+        self.assertEqual(1, len(self.client.calls))
+
+
+class TestAsyncConn(unittest.TestCase):
+    """ Exercise `AsyncEdgeDBConnection` against a fake asyncio client."""
+
+    def setUp(self):
+        self.conn = make_conn('fake_async_conn',
+                              conn_class=FakeAsyncEdgeDBConnection,
+                              result=lambda func_name, qry, *args, **kwargs: qry,
+                              delay=0.2)
+        self.client = self.conn.client
+
+    def tearDown(self):
+        self.conn.close()
+
+    def test_gather_queries_runs_concurrently(self):
+        specs = ['SELECT Movie {title};',
+                 ('SELECT Person {name};', (), {}, True),
+                 ('SELECT Show {title};', (), {}, False, None)]
+        results = self.conn.run(self.conn.gather_queries(specs))
+        self.assertEqual(['SELECT Movie {title};',
+                          'SELECT Person {name};',
+                          'SELECT Show {title};'], results)
+        self.assertEqual(3, self.client.peak)
+        self.assertEqual(['query', 'query', 'query_json'],
+                         sorted(call[0] for call in self.client.calls))
+
+    def test_query_shares_cache_semantics(self):
+        qry = 'SELECT Movie {title};'
+        self.conn.run(self.conn.query(qry))
+        self.conn.run(self.conn.query(qry))
+        self.assertEqual(1, len(self.client.calls))
+        self.conn.run(self.conn.execute('DELETE Movie;'))
+        self.assertEqual(0, len(self.conn.cache))
+
+
+    def test_transaction(self):
+        async def transfer():
+            bodies = 0
+            async for tx in self.conn():
+                async with tx:
+                    bodies += 1
+                    await tx.query('SELECT Movie {title};')
+                    await tx.execute('DELETE Movie;')
+                    if bodies == 1:
+                        raise edgedb.TransactionConflictError('conflict')
+            return bodies
+
+        self.conn.run(self.conn.query('SELECT Movie {title};'))
+        self.assertEqual(2, self.conn.run(transfer()))
+        self.assertEqual(0, len(self.conn.cache))
+
+
+    def test_close_without_the_loop_thread(self):
+        conn = make_conn('async_close_conn', conn_class=FakeAsyncEdgeDBConnection,
+                         result=[])
+        self.assertEqual([], asyncio.run(conn.query('SELECT Movie;')))
+        conn.close()
+        self.assertTrue(conn.client.closed)
+
+    def test_gather_identical_queries_are_coalesced(self):
+        qry = 'SELECT Movie {title};'
+        results = self.conn.run(self.conn.gather_queries([qry, qry, qry]))
+        self.assertEqual([qry] * 3, results)
+        self.assertEqual(1, len(self.client.calls))
+
+
+    def test_stale_while_revalidate(self):
+        versions = iter(range(100))
+        self.client.result = lambda func_name, qry, *args, **kwargs: next(versions)
+        qry = 'SELECT Movie {title};'
+
+        async def main():
+            self.assertEqual(0, await self.conn.query(qry, soft_ttl=0.05))
+            await asyncio.sleep(0.1)
+            self.assertEqual(0, await self.conn.query(qry, soft_ttl=0.05))
+            await asyncio.sleep(0.3)
+            return await self.conn.query(qry, soft_ttl=0.05)
+
+        self.assertEqual(1, self.conn.run(main()))
+        self.assertEqual(2, len(self.client.calls))
+
 
 class TestConn(unittest.TestCase):
     """ The test relies on true EdgeDB instance and its built-in `_example` database.
@@ -0,0 +1,122 @@
+import unittest
+
+from src.edgeql import (
+    WILDCARD,
+    build_dependents,
+    classify,
+    fingerprint,
+    normalize,
+    paginate,
+    parse_params,
+)
+
+
+class TestNormalize(unittest.TestCase):
+    def test_normalize_whitespace_and_comments(self):
+        qry = '''SELECT   Movie {
+                    title  # the title
+                 };;'''
+        self.assertEqual('SELECT Movie { title }', normalize(qry))
+
+    def test_normalize_keeps_string_literals(self):
+        qry = '''SELECT Movie FILTER .title = 'John   Wick # 5';'''
+        self.assertEqual(
+            "SELECT Movie FILTER .title = 'John   Wick # 5'", normalize(qry))
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint('SELECT Movie {title};'),
+                         fingerprint('SELECT Movie\n    {title}'))
+        self.assertNotEqual(fingerprint('SELECT Movie {title};'),
+                            fingerprint('SELECT Movie {id};'))
+
+
+
+class TestClassify(unittest.TestCase):
+    def test_read(self):
+        info = classify('''SELECT Movie {title, actors: {name}}
+                           FILTER .inserted_at > <datetime>$0
+                           AND .updated = 'delete';''')
+        self.assertFalse(info.is_mutation)
+        self.assertEqual(frozenset({'Movie'}), info.reads)
+
+    def test_read_with_type_filter_and_module(self):
+        info = classify('''WITH M := default::Movie
+                           SELECT Content[IS M] {title, count := count(Person)};''')
+        self.assertEqual(frozenset({'Movie', 'Content', 'Person'}), info.reads)
+
+    def test_insert(self):
+        info = classify('''SELECT (INSERT Movie {title := 'John Wick 05'}) {title};''')
+        self.assertTrue(info.is_mutation)
+        self.assertEqual(frozenset({'Movie'}), info.writes)
+
+    def test_update_and_delete(self):
+        info = classify('''WITH movie := (SELECT assert_single(
+                                (UPDATE Movie FILTER .title = <str>$title
+                                 SET {actors += (INSERT Person {name := 'K'})})))
+                           SELECT movie {title};''')
+        self.assertEqual(frozenset({'Movie', 'Person'}), info.writes)
+        info = classify('DELETE (SELECT Show FILTER .title = <str>$0);')
+        self.assertEqual(frozenset({'Show'}), info.writes)
+
+    def test_ddl(self):
+        info = classify('CREATE TYPE Award {CREATE PROPERTY name -> str};')
+        self.assertEqual(frozenset({WILDCARD}), info.writes)
+
+
+class TestParseParams(unittest.TestCase):
+    def test_parse_params(self):
+        self.assertEqual((2, frozenset()),
+                         parse_params('SELECT Movie FILTER .title = <str>$0 OR .title = <str>$1;'))
+        self.assertEqual((0, frozenset({'title'})),
+                         parse_params('''SELECT Movie FILTER .title = <str>$title
+                                         AND .note != '$ignored';'''))
+
+
+class TestPaginate(unittest.TestCase):
+    def test_offset_limit(self):
+        self.assertEqual(
+            'SELECT (SELECT Movie {title} ORDER BY .title) OFFSET 20 LIMIT 10',
+            paginate('''SELECT Movie {title}  # comment
+                        ORDER BY .title;''', 10, offset=20))
+
+    def test_keyset(self):
+        self.assertEqual(
+            "SELECT (SELECT Movie {title}) FILTER .id > "
+            "<uuid>'0b8f4c2e-0000-0000-0000-000000000000' ORDER BY .id LIMIT 10",
+            paginate('SELECT Movie {title};', 10,
+                     after_id='0b8f4c2e-0000-0000-0000-000000000000'))
+        self.assertEqual('SELECT (SELECT Movie {title}) ORDER BY .id LIMIT 10',
+                         paginate('SELECT Movie {title};', 10, keyset=True))
+
+
+class TestBuildDependents(unittest.TestCase):
+    def test_build_dependents(self):
+        object_types = [
+            {'name': 'default::Content',
+             'ancestors': [{'name': 'std::Object'}],
+             'links': [{'target': {'name': 'default::Person'}},
+                       {'target': {'name': 'schema::ObjectType'}}]},
+            {'name': 'default::Movie',
+             'ancestors': [{'name': 'default::Content'}, {'name': 'std::Object'}],
+             'links': [{'target': {'name': 'default::Person'}}]},
+            {'name': 'default::Show',
+             'ancestors': [{'name': 'default::Content'}],
+             'links': []},
+            {'name': 'default::Person', 'ancestors': [], 'links': []},
+            {'name': 'default::Account',
+             'ancestors': [],
+             'links': [{'target': {'name': 'default::Content'}}]},
+            {'name': 'schema::ObjectType', 'ancestors': [], 'links': []},
+        ]
+        dependents = build_dependents(object_types)
+        self.assertEqual(frozenset({'Movie', 'Content', 'Account'}),
+                         dependents['Movie'])
+        self.assertEqual(frozenset({'Person', 'Content', 'Movie', 'Account'}),
+                         dependents['Person'])
+        self.assertEqual(frozenset({'Content', 'Movie', 'Show', 'Account'}),
+                         dependents['Content'])
+        self.assertNotIn('ObjectType', dependents)
+
+
+if __name__ == '__main__':
+    unittest.main()
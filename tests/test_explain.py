@@ -0,0 +1,141 @@
+import json
+import time
+import unittest
+
+from src.explain import SlowQueryLog, analyze_query, parse_plan
+from src.instrumentation import Instrumentation
+from tests.fakes import FakeAsyncEdgeDBConnection, make_conn
+
+ANALYZE = json.dumps({
+    'buffers': [['SELECT Movie {title, actors: {name}}', '<main>']],
+    'fine_grained': {
+        'contexts': [{'start': 0, 'end': 35, 'buffer_idx': 0,
+                      'text': 'SELECT Movie {title, actors: {name}}'}],
+        'pipeline': [{'plan_type': 'Hash Join', 'actual_startup_time': 0.1,
+                      'actual_total_time': 4.0, 'actual_rows': 100,
+                      'actual_loops': 1, 'plan_rows': 80, 'total_cost': 42.5},
+                     {'plan_type': 'SeqScan'}],
+        'subplans': [
+            {'contexts': [{'start': 21, 'end': 27, 'buffer_idx': 0,
+                           'text': 'actors'}],
+             'pipeline': [{'plan_type': 'IndexScan', 'actual_total_time': 0.5,
+                           'actual_rows': 3, 'actual_loops': 6}],
+             'subplans': []},
+        ],
+    },
+    'coarse_grained': {},
+})
+
+
+def _analyze(func_name, qry, *args, **kwargs):
+    if qry.startswith('analyze'):
+        return ANALYZE
+    time.sleep(0.02)
+    return '[]' if func_name.endswith('_json') else []
+
+
+class TestPlan(unittest.TestCase):
+    def test_analyze_query(self):
+        self.assertEqual('analyze SELECT 1;', analyze_query('  SELECT 1;\n'))
+
+    def test_parse_fine_grained(self):
+        plan = parse_plan('SELECT Movie', ANALYZE)
+        self.assertEqual(4.0, plan.total_time)
+        root = plan.root
+        self.assertEqual('Hash Join / SeqScan', root.node_type)
+        self.assertEqual((100, 80, 1, 42.5),
+                         (root.rows, root.plan_rows, root.loops, root.cost))
+        self.assertEqual(1.0, root.self_time)
+        [(_, root), (depth, child)] = plan.nodes()
+        self.assertEqual((1, 'IndexScan', 'actors'),
+                         (depth, child.node_type, child.label))
+        self.assertEqual(3.0, child.self_time)
+        self.assertEqual([child, root], plan.slowest(2))
+
+    def test_parse_postgres_plan(self):
+        plan = parse_plan('SELECT 1', [{'Plan': {
+            'Node Type': 'Result', 'Actual Total Time': 0.01,
+            'Plans': [{'Node Type': 'Seq Scan'}]}}])
+        self.assertEqual('Result', plan.root.node_type)
+        self.assertEqual(['Seq Scan'], [c.node_type for c in plan.root.children])
+
+
+class TestSlowQueryLog(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+        self.explained = []
+
+        def explain(qry, args, kwargs):
+            self.explained.append((qry, args, kwargs))
+            return parse_plan(qry, ANALYZE)
+
+        self.log = SlowQueryLog(threshold=0.01, maxlen=2, explain=explain)
+        self.instrumentation.slow_log = self.log
+
+    def _call(self, qry, *args, delay=0.0, operation='query', cache_hit=False,
+              **kwargs):
+        with self.instrumentation.probe(operation, 'query', qry, args,
+                                        kwargs) as probe:
+            time.sleep(delay)
+            probe.done([], cache_hit=cache_hit)
+
+    def test_only_slow_calls_are_kept(self):
+        self._call('SELECT Movie', delay=0)
+        self._call('SELECT Movie', delay=0.02, cache_hit=True)
+        self.assertEqual(0, len(self.log))
+        self._call('SELECT Movie FILTER .title = <str>$title', delay=0.02,
+                   title='Up')
+        [entry] = self.log.entries()
+        self.assertEqual('(title: str)', entry.args_shape)
+        self.assertGreaterEqual(entry.latency, 0.02)
+        self.assertTrue(self.log.wait())
+        self.assertEqual([('SELECT Movie FILTER .title = <str>$title', (),
+                           {'title': 'Up'})], self.explained)
+        self.assertEqual(4.0, self.log.entries()[0].plan.total_time)
+
+    def test_ring_buffer(self):
+        for i in range(3):
+            self._call(f'SELECT {i}', delay=0.02)
+        self.assertEqual(['SELECT 2', 'SELECT 1'],
+                         [e.qry for e in self.log.entries()])
+
+    def test_writes_are_not_explained(self):
+        self._call("INSERT Movie {title := 'Up'}", delay=0.02)
+        self._call('SELECT 1', delay=0.02, operation='execute')
+        self.assertTrue(self.log.wait())
+        self.assertEqual(2, len(self.log))
+        self.assertEqual([], self.explained)
+
+
+class TestConnExplain(unittest.TestCase):
+    def test_explain(self):
+        conn = make_conn('explain_conn', result=_analyze)
+        plan = conn.explain('SELECT Movie {title} FILTER .rating > <float64>$0;', 4.5)
+        self.assertEqual(('query_required_single',
+                          'analyze SELECT Movie {title} FILTER .rating > <float64>$0;',
+                          (4.5,), {}), conn.client.calls[-1])
+        self.assertEqual('Hash Join / SeqScan', plan.root.node_type)
+        [stats] = conn.query_stats()
+        self.assertEqual('explain', stats.operation)
+
+    def test_slow_query_log(self):
+        conn = make_conn('slow_conn', result=_analyze, slow_query_threshold=0.01,
+                         slow_query_explain=True)
+        conn.query('SELECT Movie {title} FILTER .rating > <float64>$0;', 4.5, ttl=60)
+        conn.query('SELECT Movie {title} FILTER .rating > <float64>$0;', 4.5, ttl=60)
+        conn.instrumentation.slow_log.wait()
+        [entry] = conn.slow_queries()
+        self.assertEqual('(float)', entry.args_shape)
+        self.assertEqual(4.0, entry.plan.total_time)
+        self.assertEqual([], make_conn('other_conn').slow_queries())
+
+    def test_async_explain(self):
+        conn = make_conn('async_explain_conn', FakeAsyncEdgeDBConnection,
+                         result=_analyze)
+        plan = conn.run(conn.explain('SELECT Movie;'))
+        self.assertEqual(4.0, plan.total_time)
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import datetime
+import unittest
+import uuid
+from decimal import Decimal
+
+import pandas as pd
+import pyarrow as pa
+from edgedb.datatypes.datatypes import create_object_factory
+
+from src.frames import to_arrow, to_columns, to_dataframe
+
+make_movie = create_object_factory(id='property',
+                                   title='property',
+                                   year='property',
+                                   rating='property',
+                                   released='property',
+                                   budget='property',
+                                   director='link')
+make_person = create_object_factory(id='property', name='property')
+make_release = create_object_factory(id='implicit',
+                                     __tid__='implicit',
+                                     title='property',
+                                     release_year='property')
+
+
+def movies(n):
+    director = make_person(uuid.uuid4(), 'Chad Stahelski')
+    return [make_movie(uuid.uuid4(),
+                       f'John Wick {i}',
+                       2014 + i,
+                       7.5,
+                       datetime.date(2014 + i, 10, 24),
+                       Decimal('20.5'),
+                       director)
+            for i in range(n)]
+
+
+class TestFrames(unittest.TestCase):
+    def test_to_columns(self):
+        columns = to_columns(movies(3))
+        self.assertEqual(['id', 'title', 'year', 'rating', 'released', 'budget', 'director'],
+                         list(columns))
+        self.assertEqual((2014, 2015, 2016), columns['year'])
+        self.assertEqual({'value': (1, 2, 3)}, to_columns([1, 2, 3]))
+        self.assertEqual({'value': ()}, to_columns([]))
+
+    def test_columns_follow_the_query_shape(self):
+        ids = uuid.uuid4(), uuid.uuid4()
+        releases = [make_release(ids[0], ids[1], 'Dune', 2021)]
+        self.assertEqual(['title', 'release_year'], list(to_dataframe(releases).columns))
+        only_id = create_object_factory(id='implicit', __tid__='implicit')
+        self.assertEqual({'id': (ids[0],)}, to_columns([only_id(ids[0], ids[1])]))
+
+    def test_to_dataframe(self):
+        df = to_dataframe(movies(3))
+        self.assertEqual(3, len(df))
+        self.assertEqual('int64', df['year'].dtype)
+        self.assertEqual('float64', df['rating'].dtype)
+        self.assertTrue(pd.api.types.is_datetime64_any_dtype(df['released']))
+        self.assertEqual(object, df['budget'].dtype)
+
+    def test_to_arrow(self):
+        table = to_arrow(movies(3))
+        self.assertEqual(3, table.num_rows)
+        self.assertEqual(pa.int64(), table.schema.field('year').type)
+        self.assertEqual(pa.date32(), table.schema.field('released').type)
+        self.assertEqual(pa.string(), table.schema.field('id').type)
+        self.assertEqual(pa.string(), table.schema.field('director').type)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from src.health import ALIVE_PATH, READY_PATH, HealthChecker
+from tests.fakes import make_conn
+
+ALIVE_URLS = [f'http{s}://localhost:5656{ALIVE_PATH}' for s in ('', 's')]
+READY_URLS = [f'http{s}://localhost:5656{READY_PATH}' for s in ('', 's')]
+
+
+class FakeHealthChecker(HealthChecker):
+    '''
+    Answers the status requests from `responses`, a url to status code or
+    exception mapping, once `gate.wait()` returns, e.g. a `threading.Event`
+    or `Barrier`.
+    '''
+
+    def __init__(self, responses, gate=None, **kwargs):
+        super().__init__(ALIVE_URLS, READY_URLS, **kwargs)
+        self.responses = responses
+        self.gate = gate
+        self.requests = []
+        self._requests_lock = threading.Lock()
+
+    def _get(self, http, url):
+        with self._requests_lock:
+            self.requests.append(url)
+        if self.gate is not None:
+            self.gate.wait()
+        response = self.responses.get(url, 503)
+        if isinstance(response, Exception):
+            raise response
+        return response == 200
+
+
+class TestHealthChecker(unittest.TestCase):
+    def test_either_scheme_is_enough(self):
+        checker = FakeHealthChecker({ALIVE_URLS[1]: 200,
+                                     READY_URLS[0]: 200,
+                                     ALIVE_URLS[0]: ConnectionError('refused')})
+        status = checker.check()
+        self.assertTrue(status.alive)
+        self.assertTrue(status.ready)
+        self.assertIsNone(status.binary)
+        self.assertTrue(status.healthy)
+        checker.close()
+
+    def test_not_ready(self):
+        checker = FakeHealthChecker({ALIVE_URLS[0]: 200})
+        status = checker.check()
+        self.assertTrue(status.alive)
+        self.assertFalse(status.ready)
+        self.assertFalse(status.healthy)
+        checker.close()
+
+    def test_probes_run_concurrently(self):
+        # The four requests and the ping only pass once all of them are running.
+        barrier = threading.Barrier(5, timeout=5)
+        checker = FakeHealthChecker({url: 200 for url in ALIVE_URLS + READY_URLS},
+                                    gate=barrier, timeout=10)
+        status = checker.check(ping=barrier.wait)
+        self.assertTrue(status.healthy)
+        self.assertTrue(status.binary)
+        checker.close()
+
+    def test_slow_probes_time_out(self):
+        release = threading.Event()
+        checker = FakeHealthChecker({url: 200 for url in ALIVE_URLS}, gate=release,
+                                    timeout=0.05)
+        status = checker.check()
+        self.assertFalse(status.alive)
+        self.assertIn(f'{ALIVE_PATH}: timed out', status.errors)
+        release.set()
+        checker.close()
+
+    def test_binary_failure(self):
+        def ping():
+            raise OSError('connection reset')
+
+        checker = FakeHealthChecker({url: 200 for url in ALIVE_URLS + READY_URLS})
+        status = checker.check(ping)
+        self.assertFalse(status.binary)
+        self.assertFalse(status.healthy)
+        self.assertEqual(('binary: OSError: connection reset',), status.errors)
+        checker.close()
+
+    def test_stuck_ping_is_not_resubmitted(self):
+        released = threading.Event()
+        pings = []
+
+        def ping():
+            pings.append(1)
+            released.wait()
+
+        checker = FakeHealthChecker({url: 200 for url in ALIVE_URLS + READY_URLS},
+                                    timeout=0.05)
+        for _ in range(3):
+            status = checker.check(ping, max_age=0)
+            self.assertTrue(status.alive and status.ready)
+            self.assertFalse(status.binary)
+        self.assertEqual(1, len(pings))
+        self.assertIn('binary: TimeoutError: the previous ping is still running',
+                      status.errors)
+        released.set()
+        checker.close()
+
+    def test_status_is_cached(self):
+        now = [0.0]
+        checker = FakeHealthChecker({ALIVE_URLS[0]: 200}, ttl=5,
+                                    clock=lambda: now[0])
+        first = checker.check()
+        requests = len(checker.requests)
+        now[0] = 4.9
+        self.assertIs(first, checker.check())
+        self.assertEqual(requests, len(checker.requests))
+        self.assertIsNot(first, checker.check(max_age=1))
+        now[0] = 20
+        checker.check()
+        self.assertEqual(3 * requests, len(checker.requests))
+        checker.close()
+
+    def test_polling(self):
+        checker = FakeHealthChecker({ALIVE_URLS[0]: 200})
+        checker.start_polling(0.01)
+        time.sleep(0.1)
+        checker.stop_polling()
+        self.assertTrue(checker.status.alive)
+        self.assertGreater(len(checker.requests), 4)
+        checker.close()
+
+
+class TestConnHealth(unittest.TestCase):
+    def test_health(self):
+        conn = make_conn('health_conn', result=1)
+
+        def get(checker, http, url):
+            return url.startswith('https')
+
+        with patch.object(HealthChecker, '_get', get):
+            status = conn.health(max_age=0)
+            self.assertTrue(status.healthy)
+            self.assertTrue(status.binary)
+            self.assertTrue(conn.is_healthy())
+        # Pinged from a client of its own, bounded by the health timeout.
+        self.assertEqual([], conn.client.calls)
+        self.assertEqual('query_required_single', conn._health_client.calls[-1][0])
+        self.assertEqual(conn._health.timeout,
+                         conn._health_client.options['wait_until_available'])
+        self.assertEqual(['http://127.0.0.1:10700/server/status/alive',
+                          'https://127.0.0.1:10700/server/status/alive'],
+                         conn._status_alive_urls)
+        conn._health.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
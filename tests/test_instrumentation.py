@@ -0,0 +1,74 @@
+import unittest
+
+from src.instrumentation import Instrumentation, result_size
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = Instrumentation()
+
+    def test_probe_aggregates_per_fingerprint(self):
+        for qry in ('SELECT Movie;', 'SELECT  Movie', 'SELECT Person;'):
+            with self.instrumentation.probe('query', 'query', qry) as probe:
+                with probe.client():
+                    pass
+                probe.done([1, 2])
+        with self.instrumentation.probe('query', 'query', 'SELECT Movie;') as probe:
+            probe.done([1, 2], cache_hit=True)
+
+        movie, person = sorted(self.instrumentation.stats(), key=lambda s: s.qry)
+        self.assertEqual(('SELECT Movie', 3, 1), (movie.qry, movie.calls, movie.cache_hits))
+        self.assertEqual(6, movie.result_size)
+        self.assertAlmostEqual(1 / 3, movie.hit_rate)
+        self.assertGreater(movie.client_time, 0)
+        self.assertLessEqual(movie.client_time, movie.total_time)
+        self.assertGreaterEqual(movie.max_time, movie.mean_time)
+        self.assertEqual(1, person.calls)
+
+    def test_errors_are_recorded(self):
+        with self.assertRaises(ValueError):
+            with self.instrumentation.probe('execute', 'execute', 'DELETE Movie;'):
+                raise ValueError
+        stats, = self.instrumentation.stats()
+        self.assertEqual((1, 1), (stats.calls, stats.errors))
+
+    def test_least_recently_recorded_queries_are_dropped(self):
+        instrumentation = Instrumentation(max_queries=2)
+        for qry in ('SELECT Movie;', 'SELECT Person;', 'SELECT Movie;',
+                    'SELECT Movie OFFSET 100;'):
+            with instrumentation.probe('query', 'query', qry) as probe:
+                probe.done([])
+        self.assertEqual({'SELECT Movie', 'SELECT Movie OFFSET 100'},
+                         {s.qry for s in instrumentation.stats()})
+
+    def test_discarded_probe_is_not_recorded(self):
+        with self.instrumentation.probe('query', 'query', 'SELECT Movie;') as probe:
+            probe.discard()
+        self.assertEqual([], self.instrumentation.stats())
+
+    def test_hooks(self):
+        events = []
+
+        def failing_hook(event):
+            raise RuntimeError
+
+        self.instrumentation.add_hook(failing_hook)
+        self.instrumentation.add_hook(events.append)
+        with self.assertLogs('src.instrumentation', 'ERROR'):
+            with self.instrumentation.probe('query', 'query_json', 'SELECT 1;') as probe:
+                probe.done('[1]')
+        event, = events
+        self.assertEqual(('query_json', 3, False), (event.func_name,
+                                                    event.result_size,
+                                                    event.cache_hit))
+        self.instrumentation.remove_hook(events.append)
+        self.instrumentation.remove_hook(failing_hook)
+        with self.instrumentation.probe('query', 'query', 'SELECT 1;'):
+            pass
+        self.assertEqual(1, len(events))
+
+    def test_result_size(self):
+        self.assertEqual(0, result_size(None))
+        self.assertEqual(3, result_size([1, 2, 3]))
+        self.assertEqual(2, result_size('[]'))
+        self.assertEqual(1, result_size(42))
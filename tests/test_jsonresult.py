@@ -0,0 +1,80 @@
+import importlib.util
+import json
+import pickle
+import unittest
+
+from src.jsonresult import JSONResult, wrap_json
+from src.snapshot import Snapshot
+from tests.fakes import make_conn, sized_result
+
+
+class TestJSONResult(unittest.TestCase):
+    def test_is_the_json_text(self):
+        result = JSONResult('[{"a": 1}, {"a": 2}]')
+        self.assertIsInstance(result, str)
+        self.assertEqual('[{"a": 1}, {"a": 2}]', result)
+        self.assertEqual([{'a': 1}, {'a': 2}], result.data)
+        self.assertIs(result.data, result.data)
+        self.assertTrue(JSONResult('null').is_null)
+        self.assertFalse(result.is_null)
+
+    def test_head(self):
+        result = JSONResult(' [ {"a": [1, 2]} ,\n{"b": "]"}, 3 ] ')
+        self.assertEqual([], result.head(0).data)
+        self.assertEqual([{'a': [1, 2]}], json.loads(result.head(1)))
+        self.assertEqual([{'a': [1, 2]}, {'b': ']'}], json.loads(result.head(2)))
+        self.assertIs(result, result.head(3))
+        self.assertIs(result, result.head(10))
+        self.assertEqual([], JSONResult('[]').head(1).data)
+        obj = JSONResult('{"a": 1}')
+        self.assertIs(obj, obj.head(1))
+
+    def test_head_only_decodes_the_first_elements(self):
+        result = JSONResult('[1, 2, not json at all')
+        self.assertEqual([1, 2], result.head(2).data)
+
+    def test_pickle_drops_the_parsed_data(self):
+        result = JSONResult('[1]')
+        result.data
+        result.text
+        copy = pickle.loads(pickle.dumps(result))
+        self.assertIsInstance(copy, JSONResult)
+        self.assertNotIn('data', vars(copy))
+        self.assertNotIn('text', vars(copy))
+        self.assertEqual([1], copy.data)
+
+    def test_text_is_a_plain_str(self):
+        result = JSONResult('[{"a": 1}]')
+        self.assertIs(str, type(result.text))
+        self.assertEqual(result, result.text)
+        self.assertIs(result.text, result.text)
+
+    @unittest.skipUnless(importlib.util.find_spec('orjson'), 'needs orjson')
+    def test_orjson_takes_the_text(self):
+        import orjson
+
+        result = JSONResult('[{"a": 1}]')
+        self.assertEqual([{'a': 1}], orjson.loads(result.text))
+
+    def test_wrap_json(self):
+        self.assertIsInstance(wrap_json('query_json', '[]'), JSONResult)
+        self.assertNotIsInstance(wrap_json('query_single', 'abc'), JSONResult)
+        self.assertIsInstance(Snapshot(JSONResult('[1]')).thaw(), JSONResult)
+        self.assertNotIsInstance(Snapshot('abc').thaw(), JSONResult)
+
+
+class TestConnJSONResult(unittest.TestCase):
+    def test_query_returns_json_results(self):
+        conn = make_conn('json_conn', result=sized_result(5))
+        qry = 'SELECT Movie {title};'
+        result = conn.query(qry, jsonify=True, ttl=60)
+        self.assertIsInstance(result, JSONResult)
+        self.assertEqual(5, len(result.data))
+        self.assertIs(result, conn.query(qry, jsonify=True, ttl=60))
+        copy = conn.query(qry, jsonify=True, storage='data', ttl=60,
+                          required_single=False)
+        self.assertIsInstance(copy, JSONResult)
+
+
+if __name__ == '__main__':
+    unittest.main()
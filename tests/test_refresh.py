@@ -0,0 +1,63 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from src.refresh import AsyncRefresher, Refresher
+
+
+class TestRefresher(unittest.TestCase):
+    def test_one_refresh_per_key_under_a_cap(self):
+        refresher = Refresher(max_workers=2)
+        running = []
+        peak = []
+        lock = threading.Lock()
+
+        def refresh():
+            with lock:
+                running.append(1)
+                peak.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.pop()
+
+        self.assertTrue(refresher.submit('a', refresh))
+        self.assertFalse(refresher.submit('a', refresh))
+        for key in 'bcd':
+            refresher.submit(key, refresh)
+        refresher.shutdown()
+        self.assertEqual(4, len(peak))
+        self.assertEqual(2, max(peak))
+        self.assertEqual(0, len(refresher))
+
+    def test_failures_are_logged(self):
+        refresher = Refresher(max_pending=1)
+
+        def refresh():
+            raise ValueError
+
+        with self.assertLogs('src.refresh', 'ERROR'):
+            refresher.submit('a', refresh)
+            self.assertFalse(refresher.submit('b', refresh))
+            refresher.shutdown()
+        self.assertTrue(refresher.submit('a', lambda: None))
+        refresher.shutdown()
+
+
+class TestAsyncRefresher(unittest.TestCase):
+    def test_one_refresh_per_key(self):
+        refresher = AsyncRefresher()
+        calls = []
+
+        async def refresh():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+
+        async def main():
+            self.assertTrue(refresher.submit('a', refresh))
+            self.assertFalse(refresher.submit('a', refresh))
+            while len(refresher):
+                await asyncio.sleep(0.01)
+
+        asyncio.run(main())
+        self.assertEqual(1, len(calls))
@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import edgedb
+
+from src.admission import DeadlineExceededError, deadline_after
+from src.singleflight import AsyncSingleFlight, SingleFlight
+
+
+def _timing_out_once():
+    calls = []
+
+    def func():
+        calls.append(1)
+        time.sleep(0.1)
+        if len(calls) == 1:
+            raise edgedb.QueryTimeoutError('fake query_execution_timeout')
+        return 42
+    return func, calls
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_are_coalesced(self):
+        flights = SingleFlight()
+        calls = []
+
+        def func():
+            calls.append(threading.get_ident())
+            time.sleep(0.1)
+            return 42
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: flights.do('key', func), range(8)))
+        self.assertEqual(1, len(calls))
+        self.assertEqual([42] * 8, [result for result, _ in results])
+        self.assertEqual(7, sum(shared for _, shared in results))
+        self.assertEqual(0, len(flights))
+        self.assertEqual((42, False), flights.do('key', func))
+
+    def test_errors_are_shared(self):
+        flights = SingleFlight()
+
+        def func():
+            time.sleep(0.1)
+            raise ValueError
+
+        with ThreadPoolExecutor(4) as pool:
+            futures = [pool.submit(flights.do, 'key', func) for _ in range(4)]
+        for future in futures:
+            self.assertIsInstance(future.exception(), ValueError)
+        self.assertEqual(0, len(flights))
+
+    def test_followers_wait_until_their_own_deadline(self):
+        flights = SingleFlight()
+        running, release = threading.Event(), threading.Event()
+
+        def func():
+            running.set()
+            release.wait(5)
+            return 42
+
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(flights.do, 'key', func)
+            self.assertTrue(running.wait(5))
+            with self.assertRaises(DeadlineExceededError):
+                flights.do('key', lambda: 0, deadline_after(0.05))
+            self.assertFalse(leader.done())
+            release.set()
+            self.assertEqual((42, False), leader.result())
+
+    def test_leader_deadline_is_not_shared(self):
+        flights = SingleFlight()
+        func, calls = _timing_out_once()
+
+        with ThreadPoolExecutor(2) as pool:
+            leader = pool.submit(flights.do, 'key', func, deadline_after(0.05))
+            time.sleep(0.02)
+            follower = pool.submit(flights.do, 'key', func)
+            self.assertIsInstance(leader.exception(), edgedb.QueryTimeoutError)
+            self.assertEqual((42, False), follower.result())
+        self.assertEqual(2, len(calls))
+
+    def test_errors_without_deadline_are_shared(self):
+        flights = SingleFlight()
+        func, calls = _timing_out_once()
+
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(flights.do, 'key', func) for _ in range(2)]
+        for future in futures:
+            self.assertIsInstance(future.exception(), edgedb.QueryTimeoutError)
+        self.assertEqual(1, len(calls))
+
+
+class TestAsyncSingleFlight(unittest.TestCase):
+    def test_concurrent_calls_are_coalesced(self):
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 42
+
+        async def main():
+            return await asyncio.gather(*(flights.do('key', func) for _ in range(8)),
+                                        flights.do('other', func))
+
+        results = asyncio.run(main())
+        self.assertEqual(2, len(calls))
+        self.assertEqual([(42, False)] + [(42, True)] * 7 + [(42, False)], results)
+        self.assertEqual(0, len(flights))
+
+    def test_cancelled_waiter_does_not_cancel_the_call(self):
+        flights = AsyncSingleFlight()
+
+        async def func():
+            await asyncio.sleep(0.1)
+            return 42
+
+        async def main():
+            leader = asyncio.create_task(flights.do('key', func))
+            waiter = asyncio.create_task(flights.do('key', func))
+            await asyncio.sleep(0.01)
+            waiter.cancel()
+            return await leader
+
+        self.assertEqual((42, False), asyncio.run(main()))
+
+    def test_deadlines(self):
+        flights = AsyncSingleFlight()
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            if len(calls) == 1:
+                raise DeadlineExceededError
+            return 42
+
+        async def main():
+            leader = asyncio.create_task(flights.do('key', func, deadline_after(0.05)))
+            await asyncio.sleep(0.01)
+            impatient = asyncio.create_task(
+                flights.do('key', func, deadline_after(0.02)))
+            follower = asyncio.create_task(flights.do('key', func))
+            return await asyncio.gather(leader, impatient, follower,
+                                        return_exceptions=True)
+
+        leader, impatient, follower = asyncio.run(main())
+        self.assertIsInstance(leader, DeadlineExceededError)
+        self.assertIsInstance(impatient, DeadlineExceededError)
+        self.assertEqual((42, False), follower)
+        self.assertEqual(2, len(calls))
@@ -0,0 +1,55 @@
+import pickle
+import unittest
+import uuid
+
+from edgedb.datatypes.datatypes import create_object_factory
+
+from src.jsonresult import JSONResult
+from src.snapshot import Snapshot
+
+make_movie = create_object_factory(id='implicit', title='property', actors='link')
+make_actor = create_object_factory(id='implicit', name='property', role='link-property')
+
+
+def movies():
+    return [make_movie(uuid.uuid4(),
+                       'John Wick',
+                       [make_actor(uuid.uuid4(), 'Keanu Reeves', 'lead')])]
+
+
+class TestSnapshot(unittest.TestCase):
+    def test_thaw_result_set(self):
+        result = movies()
+        snapshot = Snapshot(result)
+        thawed = snapshot.thaw()
+        self.assertEqual(repr(result), repr(thawed))
+        self.assertEqual(result[0].id, thawed[0].id)
+        self.assertEqual('lead', thawed[0].actors[0]['@role'])
+        self.assertGreater(snapshot.nbytes, 0)
+
+    def test_thaw_returns_fresh_copies(self):
+        snapshot = Snapshot(movies())
+        first = snapshot.thaw()
+        first.clear()
+        first_again = snapshot.thaw()
+        self.assertEqual(1, len(first_again))
+        self.assertIsNot(first_again[0].actors, snapshot.thaw()[0].actors)
+
+    def test_thaw_json(self):
+        snapshot = Snapshot(JSONResult('[{"title": "John Wick"}]'))
+        self.assertEqual('[{"title": "John Wick"}]', snapshot.thaw())
+        self.assertIsInstance(snapshot.thaw(), JSONResult)
+        self.assertEqual(1, snapshot.thaw().count('John Wick'))
+
+    def test_thaw_scalar_string(self):
+        snapshot = Snapshot('John Wick')
+        self.assertIs(str, type(snapshot.thaw()))
+        self.assertEqual('John Wick', snapshot.thaw())
+
+    def test_snapshot_data_is_picklable(self):
+        snapshot = Snapshot(movies())
+        self.assertEqual(snapshot._data, pickle.loads(pickle.dumps(snapshot._data)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,189 @@
+import multiprocessing
+import os
+import tempfile
+import stat
+import unittest
+import uuid
+from unittest.mock import patch
+
+from src.cache import MISSING, make_key
+from src.jsonresult import JSONResult
+from src.snapshot import Snapshot
+from src.sqlite_cache import SQLiteResultCache, namespace
+from src.st_edgedb_conn import WrongQueryParamsError, get_result_cache
+from tests.fakes import FAKE_DSN, make_conn, make_movie, sized_result
+from tests.test_cache import FakeClock
+
+
+def _fill(path, start):
+    cache = SQLiteResultCache(path)
+    for i in range(start, start + 50):
+        cache.set(('key', i), JSONResult(f'[{i}]'), tags=frozenset({'Movie'}))
+    cache.close()
+
+
+class TestSQLiteResultCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.dir.name, 'cache.sqlite')
+        self.clock = FakeClock()
+        self.cache = SQLiteResultCache(self.path, max_entries=2, clock=self.clock)
+
+    def tearDown(self):
+        self.cache.close()
+        self.dir.cleanup()
+
+    def test_get_set(self):
+        self.assertIs(MISSING, self.cache.get('a'))
+        self.cache.set('a', JSONResult('[1]'))
+        self.assertEqual('[1]', self.cache.get('a'))
+        self.assertIsInstance(self.cache.get('a'), JSONResult)
+        movie = make_movie(uuid.UUID(int=1), 'Up', 2009, 4.5)
+        self.cache.set('b', [movie])
+        self.assertEqual('Up', self.cache.get('b').thaw()[0].title)
+        self.assertEqual('[1]', self.cache._peek('a'))
+        self.assertIs(MISSING, self.cache._peek('c'))
+        stats = self.cache.stats()
+        self.assertEqual((3, 1, 2), (stats.hits, stats.misses, stats.entries))
+
+    def test_plain_string(self):
+        # A scalar `str` result isn't JSON, and must come back as is.
+        self.cache.set('a', 'plain')
+        value = self.cache.get('a')
+        self.assertIsInstance(value, Snapshot)
+        self.assertEqual('plain', value.thaw())
+
+    def test_ttl(self):
+        self.cache.set('a', 1, ttl=10, soft_ttl=5)
+        self.cache.set('b', 2, ttl=0)
+        self.assertIs(MISSING, self.cache.get('b'))
+        self.clock.now = 5
+        value, stale = self.cache.lookup('a')
+        self.assertEqual((1, True), (value.thaw(), stale))
+        self.clock.now = 10
+        self.assertIs(MISSING, self.cache._peek('a'))
+        self.assertIs(MISSING, self.cache.get('a'))
+        self.assertEqual(0, len(self.cache))
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.clock.now = 2
+        self.cache.set('b', 2)
+        self.clock.now = 4
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertIn('a', self.cache)
+        self.assertNotIn('b', self.cache)
+        self.assertEqual(1, self.cache.stats().evictions)
+
+    def test_max_bytes(self):
+        cache = SQLiteResultCache(self.path, namespace='small', max_bytes=100)
+        cache.set('a', JSONResult('x' * 60))
+        cache.set('b', JSONResult('y' * 60))
+        cache.set('c', JSONResult('z' * 200))
+        self.assertEqual(['b'], [e.key for e in cache.entries()])
+        cache.close()
+
+    def test_invalidate_tags(self):
+        cache = SQLiteResultCache(self.path, namespace='tags')
+        cache.set('movies', 1, tags=frozenset({'Movie'}))
+        cache.set('people', 2, tags=frozenset({'Person'}))
+        cache.set('any', 3)
+        self.assertEqual(2, cache.invalidate_tags(frozenset({'Movie'})))
+        self.assertEqual(['people'], [e.key for e in cache.entries()])
+        self.assertEqual(frozenset({'Person'}), cache.entries()[0].tags)
+        cache.close()
+
+    def test_generation(self):
+        movies = frozenset({'Movie'})
+        generation = self.cache.generation(movies)
+        other = SQLiteResultCache(self.path, clock=self.clock)
+        other.invalidate_tags(movies)
+        self.cache.set('movies', 1, tags=movies, generation=generation)
+        self.assertNotIn('movies', self.cache)
+        self.cache.set('movies', 1, tags=movies, generation=self.cache.generation(movies))
+        self.assertIn('movies', self.cache)
+        other.close()
+
+    def test_shared_by_instances_of_the_same_namespace(self):
+        key = make_key('query', 'SELECT Movie', (), {'ids': {1, 2, 3}})
+        self.cache.set(key, JSONResult('[]'))
+        other = SQLiteResultCache(self.path, clock=self.clock)
+        self.assertEqual('[]', other.get(make_key('query', 'SELECT Movie', (),
+                                                  {'ids': {3, 2, 1}})))
+        other.invalidate_tags(frozenset({'*'}))
+        self.assertIs(MISSING, self.cache.get(key))
+        separate = SQLiteResultCache(self.path, namespace='other')
+        separate.set(key, JSONResult('[]'))
+        self.assertEqual(0, len(self.cache))
+        other.close()
+        separate.close()
+
+    def test_expired_entries_are_dropped_in_batches(self):
+        cache = SQLiteResultCache(self.path, namespace='expiry', clock=self.clock)
+        for i in range(300):
+            cache.set(i, JSONResult('[]'), ttl=1)
+        self.clock.now = 2
+        cache.set('fresh', JSONResult('[]'))
+        self.assertEqual(45, len(cache))
+        cache.set('fresh', JSONResult('[]'))
+        self.assertEqual(['fresh'], [e.key for e in cache.entries()])
+        self.assertEqual((1, 2), (cache.stats().entries, cache.stats().nbytes))
+        cache.close()
+
+    def test_default_path_is_private(self):
+        with patch.dict(os.environ, {'XDG_CACHE_HOME': self.dir.name}):
+            cache = SQLiteResultCache()
+        directory = os.path.dirname(cache.path)
+        self.assertEqual(self.dir.name, os.path.dirname(directory))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(directory).st_mode))
+        self.assertEqual(0, stat.S_IMODE(os.stat(cache.path).st_mode) & 0o077)
+        cache.close()
+
+    @unittest.skipUnless(hasattr(os, 'getuid'), 'needs POSIX file owners')
+    def test_refuses_another_users_file(self):
+        with patch('os.getuid', return_value=os.getuid() + 1):
+            with self.assertRaises(PermissionError):
+                SQLiteResultCache(self.path)
+
+    def test_concurrent_processes(self):
+        cache = SQLiteResultCache(self.path, max_entries=1000)
+        processes = [multiprocessing.Process(target=_fill, args=(self.path, start))
+                     for start in range(0, 200, 50)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        self.assertEqual([0] * 4, [p.exitcode for p in processes])
+        self.assertEqual(200, len(cache))
+        self.assertEqual('[123]', cache.get(('key', 123)))
+        cache.close()
+
+
+class TestConnSQLiteCache(unittest.TestCase):
+    def test_warm_restart(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cache.sqlite')
+            conn = make_conn('sqlite_conn', result=sized_result(3),
+                             cache_backend='sqlite', cache_path=path)
+            self.assertIsInstance(conn.cache, SQLiteResultCache)
+            movies = conn.query('SELECT Movie {title};', ttl=60)
+            conn.query('SELECT Movie {title};', ttl=60)
+            self.assertEqual(1, len(conn.client.calls))
+
+            # A new process opening the same file starts warm.
+            restarted = SQLiteResultCache(
+                path, namespace=namespace('sqlite_conn', FAKE_DSN))
+            self.assertEqual(1, len(restarted))
+            cached = restarted.get(restarted.entries()[0].key).thaw()
+            self.assertEqual([m.title for m in movies], [m.title for m in cached])
+            restarted.close()
+            conn.cache.close()
+
+    def test_unknown_backend(self):
+        with self.assertRaises(WrongQueryParamsError):
+            get_result_cache('unknown_backend', FAKE_DSN, backend='redis')
+
+
+if __name__ == '__main__':
+    unittest.main()
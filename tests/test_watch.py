@@ -0,0 +1,109 @@
+import time
+import unittest
+
+from src.st_edgedb_conn import WrongQueryParamsError
+from src.watch import Watch, Watcher, result_digest
+from tests.fakes import FakeAsyncEdgeDBConnection, make_conn, make_movie
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+class TestWatch(unittest.TestCase):
+    def test_result_digest(self):
+        self.assertEqual(result_digest('[1]'), result_digest('[1]'))
+        self.assertNotEqual(result_digest('[1]'), result_digest('[2]'))
+        movie = make_movie(None, 'Dune', 2021, 4.0)
+        self.assertEqual(result_digest([movie]),
+                         result_digest([make_movie(None, 'Dune', 2021, 4.0)]))
+        self.assertNotEqual(result_digest([movie]),
+                            result_digest([make_movie(None, 'Dune', 2024, 4.0)]))
+
+    def test_subscribers_only_see_changes(self):
+        rows = ['[1]']
+        watch = Watch('key', 'SELECT 1', lambda: rows[0], interval=60)
+        self.assertEqual(('[1]', 1), watch.latest())
+        seen = []
+        unsubscribe = watch.subscribe(seen.append)
+        self.assertFalse(watch.poll())
+        rows[0] = '[2]'
+        self.assertTrue(watch.poll())
+        unsubscribe()
+        rows[0] = '[3]'
+        watch.poll()
+        self.assertEqual(['[2]'], seen)
+        self.assertEqual((3, 4), (watch.version, watch.polls))
+
+    def test_failed_poll_keeps_the_result(self):
+        rows = ['[1]']
+        watch = Watch('key', 'SELECT 1', lambda: rows.pop(), interval=60)
+        watch.latest()
+        with self.assertRaises(IndexError):
+            watch.poll()
+        self.assertEqual(('[1]', 1), watch.latest())
+        self.assertIn('IndexError', watch.error)
+
+    def test_idle_watch_stops(self):
+        watcher = Watcher(idle_timeout=0)
+        watch = watcher.watch('key', 'SELECT 1', lambda: '[]', interval=0.01)
+        self.assertIs(watch, watcher.watch('key', 'SELECT 1', lambda: '[]', 1))
+        self.assertTrue(_wait_for(lambda: watch.stopped))
+        self.assertEqual(0, len(watcher))
+        self.assertIsNot(watch, watcher.watch('key', 'SELECT 1', lambda: '[]', 1))
+        watcher.stop()
+
+
+class TestConnWatch(unittest.TestCase):
+    def test_sessions_share_one_poller(self):
+        rows = ['[]']
+        result = lambda func_name, qry, *args, **kwargs: rows[0]
+        sessions = [make_conn('watch_conn', result=result) for _ in range(3)]
+        qry = 'SELECT Movie {title} FILTER .rating > <float64>$0;'
+        results = [conn.watch(qry, 4.5, interval=60, jsonify=True)
+                   for conn in sessions]
+        self.assertEqual(['[]'] * 3, results)
+        [watch] = sessions[0].watches()
+        self.assertEqual(1, watch.polls)
+
+        changed = []
+        unsubscribe = sessions[1].get_watch(
+            qry, 4.5, interval=60, jsonify=True).subscribe(changed.append)
+        self.assertFalse(watch.poll())
+        rows[0] = '[{"title": "Dune"}]'
+        self.assertTrue(watch.poll())
+        unsubscribe()
+        self.assertEqual(['[{"title": "Dune"}]'], changed)
+        self.assertEqual('[{"title": "Dune"}]',
+                         sessions[2].watch(qry, 4.5, interval=60, jsonify=True))
+        self.assertEqual((2, 3), (watch.version, watch.polls))
+        self.assertEqual('watch', sessions[0].query_stats()[0].operation)
+        sessions[0]._watcher.stop()
+
+    def test_watch_polls_in_the_background(self):
+        rows = [[]]
+        conn = make_conn('watch_poll_conn',
+                         result=lambda func_name, qry, *args, **kwargs: rows[0])
+        watch = conn.get_watch('SELECT Movie;', interval=0.01)
+        self.assertEqual(([], 1), watch.latest())
+        rows[0] = [1]
+        self.assertTrue(_wait_for(lambda: watch.version == 2))
+        self.assertEqual([1], conn.watch('SELECT Movie;', rerun=False))
+        conn._watcher.stop()
+
+    def test_mutations_are_not_watched(self):
+        with self.assertRaises(WrongQueryParamsError):
+            make_conn('watch_write_conn').watch("INSERT Movie {title := 'Dune'};")
+
+    def test_async_watch(self):
+        conn = make_conn('async_watch_conn', FakeAsyncEdgeDBConnection, result=[])
+        self.assertEqual([], conn.watch('SELECT Movie;', interval=60))
+        conn._watcher.stop()
+        conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()